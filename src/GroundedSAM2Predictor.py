@@ -1,92 +1,642 @@
+import copy
+import time
+import threading
 import torch
 import numpy as np
-from typing import List, Dict, Any
+from PIL import Image
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from torchvision.ops import box_convert, nms
 from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
-from groundingdino.util.inference import load_model, load_image, predict
+from groundingdino.util.inference import load_model, load_image
+from groundingdino.util.misc import nested_tensor_from_tensor_list
+import groundingdino.datasets.transforms as T
+from .cache import file_identity
+from .embedding_cache import EMBEDDING_DTYPES, EmbeddingStore, CachedBackboneBody
+from .mask_utils import CompactMask
+from .cpu_profile import PRECISIONS
+from .profiler import NULL_TRACER
+
+OUTPUTS = ("boxes", "masks")
+
+
+class LazyMasks:
+    """
+    Stand-in for a result's masks when only boxes were requested.
+    SAM2 runs the first time the masks are read, so an exporter that needs them still gets them.
+    """
+    def __init__(self, segment, count: int):
+        self._segment = segment
+        self._count = count
+        self._masks = None
+
+    @property
+    def resolved(self) -> bool:
+        return self._masks is not None
+
+    def _resolve(self):
+        if self._masks is None:
+            self._masks, _ = self._segment()
+            self._segment = None
+        return self._masks
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self._resolve()[i]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __array__(self, dtype=None, copy=None):
+        masks = np.asarray(self._resolve())
+        return masks if dtype is None else masks.astype(dtype)
 
 
 class GroundedSAM2Predictor:
     def __init__(self, sam2_model_config: str, sam2_checkpoint: str,
                  grounding_dino_config: str, grounding_dino_checkpoint: str,
                  device: str = "cuda", box_threshold: float = 0.35,
-                 text_threshold: float = 0.25):
+                 text_threshold: float = 0.25, embedding_dir: Optional[str] = None, embedding_dtype: str = "native",
+                 sam2_memory_mb: float = 1024, tile_size: int = 0, tile_overlap: int = 256,
+                 crop_padding: int = 64, tile_batch_size: int = 4, precision: str = "fp32",
+                 num_threads: int = 0, interop_threads: int = 0, outputs: Sequence[str] = OUTPUTS,
+                 manifest=None):
+        # outputs without "masks" skips building SAM2; it is loaded if masks are asked for later
+        if not set(outputs) <= set(OUTPUTS):
+            raise ValueError(f"outputs must be a subset of {OUTPUTS}, got {list(outputs)}")
+        self.outputs = tuple(outputs)
         self.device = device
+        self.precision = "fp32"
+        self._set_threads(num_threads, interop_threads)
+        self.sam2_memory_mb = sam2_memory_mb
+
+        # tile_size > 0 detects on overlapping tiles and segments crops around the detections
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.crop_padding = crop_padding
+        self.tile_batch_size = max(1, tile_batch_size)
+        if tile_size and not 0 <= tile_overlap < tile_size:
+            raise ValueError(f"tile_overlap must be in [0, tile_size), got {tile_overlap} for tile_size {tile_size}")
         self.box_threshold = box_threshold
         self.text_threshold = text_threshold
 
+        # the two checkpoints load concurrently; most of the time is spent in file reads and tensor copies
+        self.load_times = {}
+        self.sam2_predictor = None
+        self._sam2_source = (sam2_model_config, sam2_checkpoint)
+        self._sam2_lock = threading.RLock()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            if "masks" in self.outputs:
+                sam2_future = pool.submit(self._timed_load, "sam2", self._load_sam2, sam2_model_config, sam2_checkpoint)
+            grounding_future = pool.submit(
+                self._timed_load, "grounding_dino", self._load_grounding_dino, grounding_dino_config, grounding_dino_checkpoint
+            )
+            if "masks" in self.outputs:
+                self.sam2_predictor = sam2_future.result()
+            self.grounding_model = grounding_future.result()
+        self.max_text_len = getattr(self.grounding_model, "max_text_len", 256)
+        self._prompt_cache = {}
+        self.tracer = NULL_TRACER
+
+        # image-encoder outputs reused across runs with different classes or thresholds
+        self.embedding_store = None
+        if embedding_dir:
+            self._embedding_model_id = {
+                "sam2": [sam2_model_config, file_identity(sam2_checkpoint)],
+                "grounding_dino": [file_identity(grounding_dino_config), file_identity(grounding_dino_checkpoint)],
+            }
+            self.embedding_store = EmbeddingStore(
+                embedding_dir, self._embedding_model_id, EMBEDDING_DTYPES[embedding_dtype], manifest=manifest
+            )
+            self._backbone_body = CachedBackboneBody(self.grounding_model.backbone[0], self.embedding_store)
+            self.grounding_model.backbone[0] = self._backbone_body
+
+        self.set_precision(precision)
+
+    def _set_threads(self, num_threads: int, interop_threads: int):
+        # both settings are process-wide; the inter-op pool can only be sized before its first use
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if interop_threads and interop_threads != torch.get_num_interop_threads():
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError as e:
+                print(f"Could not set inter-op threads to {interop_threads}: {e}")
+
+    def set_precision(self, precision: str):
+        """
+        Switch the CPU execution profile. int8 replaces the nn.Linear layers of both models
+        (text encoder, transformers, SAM2 blocks and heads) with dynamically quantized ones;
+        bf16 runs the forwards under CPU autocast. Quantization cannot be undone in place.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}")
+        if precision == self.precision:
+            return
+        if precision != "fp32" and not str(self.device).startswith("cpu"):
+            raise ValueError(f"precision {precision} is a CPU profile; use fp32 on device {self.device}")
+        if self.precision == "int8":
+            raise ValueError(f"Cannot switch a quantized predictor back to {precision}")
+        if precision == "bf16" and not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            raise ValueError("This CPU has no bf16 support; use --precision int8 or fp32")
+
+        if precision == "int8":
+            self._quantize(self.grounding_model)
+            if self.sam2_predictor is not None:
+                self._quantize(self.sam2_predictor.model)
+        self.precision = precision
+
+        # reduced-precision features must not mix with fp32 ones in the embedding store
+        if self.embedding_store is not None:
+            self.embedding_store = EmbeddingStore(
+                self.embedding_store.store_dir, {**self._embedding_model_id, "precision": precision}, self.embedding_store.dtype,
+                manifest=self.embedding_store.manifest
+            )
+            self._backbone_body.store = self.embedding_store
+
+    def _quantize(self, model: torch.nn.Module):
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    def replicate(self) -> "GroundedSAM2Predictor":
+        """Another predictor over the same weights with its own SAM2 image state, for a second inference thread."""
+        replica = copy.copy(self)
+        if self.sam2_predictor is not None:
+            replica.sam2_predictor = SAM2ImagePredictor(self.sam2_predictor.model)
+        replica._sam2_lock = threading.RLock()
+        replica._prompt_cache = {}
+        return replica
+
+    def _require_sam2(self) -> SAM2ImagePredictor:
+        # callers hold _sam2_lock; a box-only predictor builds SAM2 here on first use
+        if self.sam2_predictor is None:
+            print("Masks requested from a box-only predictor; loading SAM2 now")
+            self.sam2_predictor = self._timed_load("sam2", self._load_sam2, *self._sam2_source)
+            if self.precision == "int8":
+                self._quantize(self.sam2_predictor.model)
+        return self.sam2_predictor
+
+    def _inference(self) -> ExitStack:
+        stack = ExitStack()
+        stack.enter_context(torch.inference_mode())
+        if self.precision == "bf16":
+            stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+        return stack
+
+    def _timed_load(self, name: str, load_fn, *args):
+        start = time.perf_counter()
+        model = load_fn(*args)
+        self.load_times[name] = time.perf_counter() - start
+        return model
+
+    def _load_sam2(self, sam2_model_config: str, sam2_checkpoint: str) -> SAM2ImagePredictor:
         # build SAM2 image predictor
         print("Loading SAM2...")
         sam2_model = build_sam2(sam2_model_config, sam2_checkpoint, device=self.device)
-        self.sam2_predictor = SAM2ImagePredictor(sam2_model)
+        return SAM2ImagePredictor(sam2_model)
 
+    def _load_grounding_dino(self, grounding_dino_config: str, grounding_dino_checkpoint: str) -> torch.nn.Module:
         # build grounding dino model
         print("Loading Grounding DINO...")
-        self.grounding_model = load_model(
+        return load_model(
             model_config_path=grounding_dino_config, 
             model_checkpoint_path=grounding_dino_checkpoint,
             device=self.device
-        )
+        ).to(self.device)
 
-    def predict(self, image_path: str, classes: List[str], batch_size: int = 1, multimask_output: bool = False) -> Dict[str, Any]:
-        image_source, image = load_image(image_path)
+    def predict(self, image_path: str, classes: List[str], batch_size: int = 0, multimask_output: bool = False,
+                compact_masks: bool = False, outputs: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        return self.predict_batch(
+            [image_path], classes, batch_size, multimask_output, compact_masks=compact_masks, outputs=outputs
+        )[0]
+
+    def load_image(self, image_path: str) -> Tuple[np.ndarray, torch.Tensor]:
+        with self.tracer.span("load_image", image=Path(image_path).name):
+            if self.tile_size:
+                # tiles are transformed separately, so skip the full-frame resize
+                image_source, image = np.asarray(Image.open(image_path).convert("RGB")), None
+            else:
+                image_source, image = load_image(image_path)
         if image_source is None:
             raise ValueError(f"Could not load image from {image_path}")
-        
-        self.sam2_predictor.set_image(image_source)
-
-        all_boxes = []
-        all_confidences = []
-        all_labels = []
-
-        for batch_classes in self._chunk_list(classes, batch_size):
-            batch_prompt = ". ".join(batch_classes) + "."
-            
-            boxes, confidences, labels = predict(
-                model=self.grounding_model,
-                image=image,
-                caption=batch_prompt,
-                box_threshold=self.box_threshold,
-                text_threshold=self.text_threshold,
-                device=self.device
-            )
+        return image_source, image
+
+    def predict_batch(self, image_paths: List[str], classes: List[str], batch_size: int = 0, multimask_output: bool = False,
+                      images: Optional[List[Tuple[np.ndarray, torch.Tensor]]] = None,
+                      compact_masks: bool = False, outputs: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        # compact_masks returns CompactMask objects (box crops, bit-packed) instead of dense (N, H, W) arrays
+        # images can be decoded ahead of time with load_image, e.g. on a worker thread
+        # outputs defaults to the constructor's; without "masks" the results carry LazyMasks and
+        # "scores" holds detection confidences
+        outputs = self.outputs if outputs is None else tuple(outputs)
+        with self._inference():
+            return self._predict_batch(image_paths, classes, batch_size, multimask_output, images, compact_masks, outputs)
+
+    def _predict_batch(self, image_paths, classes, batch_size, multimask_output, images, compact_masks, outputs):
+        if images is None:
+            images = [self.load_image(image_path) for image_path in image_paths]
+        image_sources = [image_source for image_source, _ in images]
+        images = [image for _, image in images]
+        if self.tile_size:
+            return [
+                self._predict_tiled(image_path, image_source, classes, batch_size, multimask_output, outputs)
+                for image_path, image_source in zip(image_paths, image_sources)
+            ]
+        keys = None
+        if self.embedding_store is not None:
+            keys = [self.embedding_store.key(image_path) for image_path in image_paths]
+
+        results = self._detect_batch(image_paths, image_sources, images, classes, batch_size, keys)
+
+        # only images with detections go through the SAM2 encoder
+        detected = [i for i, result in enumerate(results) if len(result["boxes"]) > 0]
+        if "masks" not in outputs:
+            for i in detected:
+                results[i]["masks"] = LazyMasks(
+                    self._deferred(self._segment, image_sources[i], results[i]["boxes"], multimask_output, compact_masks, keys and keys[i]),
+                    len(results[i]["boxes"])
+                )
+            return results
+
+        if detected:
+            with self._sam2_lock:
+                self._require_sam2()
+                with self.tracer.span("set_image", memory=True, images=len(detected)):
+                    self._set_sam2_images([image_sources[i] for i in detected], keys and [keys[i] for i in detected])
+                with self.tracer.span("run_sam2", memory=True, images=len(detected)):
+                    sam2_outputs = self._run_sam2([results[i]["boxes"] for i in detected], multimask_output, compact_masks)
+            for i, (masks, scores) in zip(detected, sam2_outputs):
+                results[i]["masks"] = masks
+                results[i]["scores"] = scores
+
+        return results
+
+    def _deferred(self, fn, *args):
+        # called after predict_batch has returned, so it needs its own inference context
+        def run():
+            with self._inference():
+                return fn(*args)
+        return run
+
+    def _segment(self, image_source, boxes, multimask_output, compact_masks, key=None):
+        with self._sam2_lock:
+            self._require_sam2()
+            with self.tracer.span("set_image", memory=True, images=1):
+                self._set_sam2_images([image_source], key and [key])
+            with self.tracer.span("run_sam2", memory=True, images=1):
+                return self._run_sam2([boxes], multimask_output, compact_masks)[0]
+
+    def detect_batch(self, image_paths: List[str], classes: List[str], batch_size: int = 0,
+                     images: Optional[List[Tuple[np.ndarray, torch.Tensor]]] = None) -> List[Dict[str, Any]]:
+        """Grounding DINO and NMS only; "scores" holds detection confidences and "masks" stays empty."""
+        if images is None:
+            images = [self.load_image(image_path) for image_path in image_paths]
+        image_sources = [image_source for image_source, _ in images]
+        images = [image for _, image in images]
+
+        with self._inference():
+            results = self._detect_batch(image_paths, image_sources, images, classes, batch_size)
+        for result in results:
+            result.setdefault("masks", [])
+        return results
+
+    def _detect_batch(self, image_paths, image_sources, images, classes, batch_size=0, keys=None):
+        all_boxes = [[] for _ in image_paths]
+        all_confidences = [[] for _ in image_paths]
+        all_labels = [[] for _ in image_paths]
+
+        for chunk, prompt in enumerate(self._build_prompts(classes, batch_size)):
+            with self.tracer.span("detect", memory=True, chunk=chunk, images=len(images)) as span:
+                detections = self._detect(images, prompt, keys)
+                span["detections"] = sum(len(labels) for _, _, labels in detections)
+            for i, (boxes, confidences, labels) in enumerate(detections):
+                if boxes.numel() > 0:
+                    all_boxes[i].append(boxes)
+                    all_confidences[i].append(confidences)
+                    all_labels[i].extend(labels)
+
+        results = []
+        for i, image_path in enumerate(image_paths):
+            if not all_boxes[i]:
+                results.append({
+                    "boxes": [],
+                    "masks": [],
+                    "scores": [],
+                    "labels": [],
+                    "image_path": image_path,
+                    "image_shape": image_sources[i].shape[:2]
+                })
+                continue
+
+            boxes = torch.cat(all_boxes[i], dim=0)
+            confidences = torch.cat(all_confidences[i], dim=0)
+
+            with self.tracer.span("nms", image=Path(image_path).name) as span:
+                boxes_xyxy, confidences, final_labels = self._apply_nms(boxes, confidences, all_labels[i], image_sources[i].shape)
+                span["detections"] = len(final_labels)
+
+            results.append({
+                "boxes": boxes_xyxy,
+                "scores": confidences,
+                "labels": final_labels,
+                "image_shape": image_sources[i].shape[:2],
+                "image_path": image_path
+            })
+
+        return results
 
-            if boxes.numel() > 0:
-                all_boxes.append(boxes)
-                all_confidences.append(confidences)
-                all_labels.extend(labels)
+    def _tile_starts(self, length):
+        if length <= self.tile_size:
+            return [0]
+        stride = self.tile_size - self.tile_overlap
+        starts = list(range(0, length - self.tile_size + 1, stride))
+        if starts[-1] + self.tile_size < length:
+            starts.append(length - self.tile_size)
+        return starts
+
+    def _predict_tiled(self, image_path, image_source, classes, batch_size=0, multimask_output=False, outputs=OUTPUTS):
+        # masks always come back as CompactMask: dense full-frame masks are what tiling avoids
+        height, width = image_source.shape[:2]
+        tiles = [
+            (x, y, min(self.tile_size, width), min(self.tile_size, height))
+            for y in self._tile_starts(height)
+            for x in self._tile_starts(width)
+        ]
+        transform = T.Compose([
+            T.RandomResize([800], max_size=1333),
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+
+        all_boxes, all_confidences, all_labels, all_cut = [], [], [], []
+        for start in range(0, len(tiles), self.tile_batch_size):
+            tile_batch = tiles[start:start + self.tile_batch_size]
+            tile_images = [
+                transform(Image.fromarray(image_source[y:y + h, x:x + w]), None)[0]
+                for x, y, w, h in tile_batch
+            ]
+            for chunk, prompt in enumerate(self._build_prompts(classes, batch_size)):
+                with self.tracer.span("detect", memory=True, chunk=chunk, images=len(tile_images)) as span:
+                    detections = self._detect(tile_images, prompt)
+                    span["detections"] = sum(len(labels) for _, _, labels in detections)
+
+                for (x, y, w, h), (boxes, confidences, labels) in zip(tile_batch, detections):
+                    if boxes.numel() == 0:
+                        continue
+                    boxes = box_convert(boxes * boxes.new_tensor([w, h, w, h]), in_fmt="cxcywh", out_fmt="xyxy")
+                    boxes = boxes + boxes.new_tensor([x, y, x, y])
+
+                    # boxes touching a tile edge inside the frame may be fragments of a larger object
+                    cut = torch.zeros(len(boxes), dtype=torch.bool, device=boxes.device)
+                    if x > 0:
+                        cut |= boxes[:, 0] <= x + 2
+                    if y > 0:
+                        cut |= boxes[:, 1] <= y + 2
+                    if x + w < width:
+                        cut |= boxes[:, 2] >= x + w - 2
+                    if y + h < height:
+                        cut |= boxes[:, 3] >= y + h - 2
+
+                    all_boxes.append(boxes)
+                    all_confidences.append(confidences)
+                    all_labels.extend(labels)
+                    all_cut.append(cut)
 
         if not all_boxes:
             return {
-                "boxes": [], 
-                "masks": [], 
-                "scores": [], 
+                "boxes": [],
+                "masks": [],
+                "scores": [],
                 "labels": [],
                 "image_path": image_path,
                 "image_shape": image_source.shape[:2]
             }
 
-        boxes = torch.cat(all_boxes, dim=0)
-        confidences = torch.cat(all_confidences, dim=0)
-        
-        boxes_xyxy, confidences, final_labels = self._apply_nms(boxes, confidences, all_labels, image_source.shape)
-
-        masks, scores = self._run_sam2(boxes_xyxy, multimask_output)
+        with self.tracer.span("nms", image=Path(image_path).name) as span:
+            boxes, confidences, labels = self._merge_tiles(
+                torch.cat(all_boxes), torch.cat(all_confidences), all_labels, torch.cat(all_cut), width, height
+            )
+            span["detections"] = len(labels)
 
+        if "masks" in outputs or len(boxes) == 0:
+            masks, scores = self._segment_crops(image_source, boxes, multimask_output)
+        else:
+            masks = LazyMasks(self._deferred(self._segment_crops, image_source, boxes, multimask_output), len(boxes))
+            scores = confidences
         return {
-            "boxes": boxes_xyxy,
+            "boxes": boxes,
             "masks": masks,
             "scores": scores,
-            "labels": final_labels,
+            "labels": labels,
             "image_shape": image_source.shape[:2],
             "image_path": image_path
         }
 
+    def _merge_tiles(self, boxes, confidences, labels, cut, width, height, iou_threshold=0.5, containment_threshold=0.8):
+        boxes[:, 0::2] = boxes[:, 0::2].clamp(0, width)
+        boxes[:, 1::2] = boxes[:, 1::2].clamp(0, height)
+
+        # duplicates from overlapping tiles
+        keep = nms(boxes, confidences, iou_threshold)
+        boxes, confidences, cut = boxes[keep], confidences[keep], cut[keep]
+        labels = [labels[i] for i in keep.tolist()]
+
+        # drop seam fragments that lie mostly inside another box
+        if cut.any():
+            lt = torch.max(boxes[:, None, :2], boxes[None, :, :2])
+            rb = torch.min(boxes[:, None, 2:], boxes[None, :, 2:])
+            inter = (rb - lt).clamp(min=0).prod(dim=2)
+            area = (boxes[:, 2:] - boxes[:, :2]).clamp(min=0).prod(dim=1)
+            contained = inter / area.clamp(min=1e-6)[:, None]
+            contained.fill_diagonal_(0)
+            fragment = cut & (contained >= containment_threshold).any(dim=1)
+            keep = (~fragment).nonzero().flatten()
+            boxes, confidences = boxes[keep], confidences[keep]
+            labels = [labels[i] for i in keep.tolist()]
+
+        return boxes.cpu().numpy(), confidences.cpu().numpy(), labels
+
+    def _crop_windows(self, boxes, width, height):
+        # group padded boxes into windows no larger than a tile; a bigger box gets its own window
+        padded = np.asarray(boxes, dtype=np.float64).copy()
+        padded[:, :2] -= self.crop_padding
+        padded[:, 2:] += self.crop_padding
+        padded = np.clip(np.round(padded), 0, [width, height, width, height]).astype(int)
+
+        windows = []
+        for i in np.lexsort((padded[:, 0], padded[:, 1])):
+            x0, y0, x1, y1 = padded[i]
+            for window in windows:
+                wx0, wy0, wx1, wy1 = min(window[0], x0), min(window[1], y0), max(window[2], x1), max(window[3], y1)
+                if wx1 - wx0 <= self.tile_size and wy1 - wy0 <= self.tile_size:
+                    window[:4] = [wx0, wy0, wx1, wy1]
+                    window[4].append(i)
+                    break
+            else:
+                windows.append([x0, y0, x1, y1, [i]])
+        return windows
+
+    def _segment_crops(self, image_source, boxes, multimask_output):
+        height, width = image_source.shape[:2]
+        masks = [None] * len(boxes)
+        scores = np.zeros(len(boxes), dtype=np.float32)
+
+        windows = self._crop_windows(boxes, width, height)
+        with self._sam2_lock:
+            if windows:
+                self._require_sam2()
+            for start in range(0, len(windows), self.tile_batch_size):
+                window_batch = windows[start:start + self.tile_batch_size]
+                crops = [np.ascontiguousarray(image_source[y0:y1, x0:x1]) for x0, y0, x1, y1, _ in window_batch]
+                crop_boxes = [
+                    np.asarray(boxes)[members] - np.asarray([x0, y0, x0, y0], dtype=np.float32)
+                    for x0, y0, x1, y1, members in window_batch
+                ]
+
+                with self.tracer.span("set_image", memory=True, images=len(crops)):
+                    self._set_sam2_images(crops)
+                with self.tracer.span("run_sam2", memory=True, images=len(crops)):
+                    outputs = self._run_sam2(crop_boxes, multimask_output, compact_masks=True)
+
+                for (x0, y0, _, _, members), (crop_masks, crop_scores) in zip(window_batch, outputs):
+                    for i, mask, score in zip(members, crop_masks, crop_scores):
+                        # move the crop-relative mask into the full frame
+                        masks[i] = CompactMask(mask.bits, mask.crop_shape, (mask.x0 + x0, mask.y0 + y0), (height, width))
+                        scores[i] = score
+
+        return masks, scores
+
+    def _set_sam2_images(self, image_sources, keys=None):
+        if keys is None:
+            self.sam2_predictor.set_image_batch(image_sources)
+            return
+
+        features = [self.embedding_store.load(key, "sam2") for key in keys]
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            self.sam2_predictor.set_image_batch([image_sources[i] for i in missing])
+            computed = self.sam2_predictor._features
+            for j, i in enumerate(missing):
+                features[i] = {"image_embed": computed["image_embed"][j]}
+                for level, feat in enumerate(computed["high_res_feats"]):
+                    features[i][f"high_res_feats_{level}"] = feat[j]
+                features[i] = self.embedding_store.save(keys[i], "sam2", features[i])
+            if len(missing) == len(keys) and self.embedding_store.dtype is None:
+                return
+
+        # rebuild the predictor state that set_image_batch would have left behind
+        def stack(name):
+            return torch.stack([
+                f[name].to(self.device) for f in features
+            ])
+
+        num_levels = sum(1 for name in features[0] if name.startswith("high_res_feats_"))
+        self.sam2_predictor._features = {
+            "image_embed": stack("image_embed"),
+            "high_res_feats": [stack(f"high_res_feats_{level}") for level in range(num_levels)],
+        }
+        self.sam2_predictor._orig_hw = [image_source.shape[:2] for image_source in image_sources]
+        self.sam2_predictor._is_image_set = True
+        self.sam2_predictor._is_batch = True
+
     def _chunk_list(self, lst, n):
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
 
+    def _build_prompts(self, classes, batch_size=0):
+        # batch_size > 0 keeps fixed-size class chunks, otherwise pack by token budget
+        key = (tuple(classes), batch_size)
+        if key not in self._prompt_cache:
+            if batch_size > 0:
+                groups = list(self._chunk_list(classes, batch_size))
+            else:
+                groups = self._pack_classes(classes)
+            self._prompt_cache[key] = [self._encode_prompt(group) for group in groups]
+        return self._prompt_cache[key]
+
+    def _pack_classes(self, classes):
+        tokenizer = self.grounding_model.tokenizer
+        budget = self.max_text_len - 2  # [CLS] and [SEP]
+
+        groups, group, used = [], [], 0
+        for name in classes:
+            # class tokens plus the trailing "." separator
+            cost = len(tokenizer(name.strip().lower(), add_special_tokens=False)["input_ids"]) + 1
+            if group and used + cost > budget:
+                groups.append(group)
+                group, used = [], 0
+            group.append(name)
+            used += cost
+
+        if group:
+            groups.append(group)
+        return groups
+
+    def _encode_prompt(self, classes):
+        caption = ""
+        spans = []
+        for name in classes:
+            start = len(caption)
+            caption += name.strip().lower()
+            spans.append((start, len(caption)))
+            caption += ". "
+        caption = caption.strip()
+
+        # map every caption token back to the class whose characters it covers
+        tokenized = self.grounding_model.tokenizer(caption, return_offsets_mapping=True)
+        num_tokens = min(len(tokenized["input_ids"]), self.max_text_len)
+        token_class = torch.full((num_tokens,), -1, dtype=torch.long)
+        for i, (start, end) in enumerate(tokenized["offset_mapping"][:num_tokens]):
+            if end <= start:
+                continue
+            for class_idx, (class_start, class_end) in enumerate(spans):
+                if class_start <= start < class_end:
+                    token_class[i] = class_idx
+                    break
+
+        return caption, token_class.to(self.device), list(classes)
+
+    def _detect(self, images, prompt, keys=None):
+        caption, token_class, names = prompt
+
+        # pad the images into one NestedTensor; the model reads .device before it would convert a list
+        samples = nested_tensor_from_tensor_list([image.to(self.device) for image in images])
+        if keys is not None:
+            self._backbone_body.keys = keys
+        try:
+            outputs = self.grounding_model(samples, captions=[caption] * len(images))
+        finally:
+            if keys is not None:
+                self._backbone_body.keys = None
+
+        valid = token_class >= 0
+        detections = []
+        # float() undoes bf16 autocast before the numpy conversions downstream
+        for logits, boxes in zip(outputs["pred_logits"].float().sigmoid(), outputs["pred_boxes"].float()):
+            confidences = logits.max(dim=1)[0]
+            keep = confidences > self.box_threshold
+            logits, boxes, confidences = logits[keep], boxes[keep], confidences[keep]
+
+            # score each class by its strongest token and label the box with the best one
+            class_scores = logits.new_zeros((logits.shape[0], len(names)))
+            class_scores.scatter_reduce_(
+                1,
+                token_class[valid].expand(logits.shape[0], -1),
+                logits[:, :token_class.shape[0]][:, valid],
+                reduce="amax"
+            )
+            best_scores, best_classes = class_scores.max(dim=1)
+
+            matched = best_scores > self.text_threshold
+            labels = [names[i] for i in best_classes[matched].tolist()]
+            detections.append((boxes[matched], confidences[matched], labels))
+
+        return detections
+
     def _apply_nms(self, boxes, confidences, labels, image_shape, iou_threshold=0.5):
         h_img, w_img, _ = image_shape
         
@@ -101,21 +651,41 @@ class GroundedSAM2Predictor:
 
         return boxes_xyxy.cpu().numpy(), confidences.cpu().numpy(), filtered_labels
 
-    def _run_sam2(self, input_boxes, multimask_output):
-        masks, scores, _ = self.sam2_predictor.predict(
-            point_coords=None,
-            point_labels=None,
-            box=input_boxes,
-            multimask_output=multimask_output,
-        )
-
-        if multimask_output:
-            best = np.argmax(scores, axis=1)
-            masks = masks[np.arange(masks.shape[0]), best]
-            scores = scores[np.arange(scores.shape[0]), best]
-
-        if masks.ndim == 4:
-            masks = masks.squeeze(1)
-            
-        return masks, scores
-    
+    def _sam2_micro_batch(self, height, width, multimask_output):
+        # upsampled float logits plus the thresholded masks, per box and output mask
+        bytes_per_box = (3 if multimask_output else 1) * height * width * 5
+        return max(1, int(self.sam2_memory_mb * 1024 ** 2) // bytes_per_box)
+
+    def _run_sam2(self, boxes_batch, multimask_output, compact_masks=False):
+        # decode boxes in micro-batches and reduce each one (best mask, compaction) before the next,
+        # so peak memory follows sam2_memory_mb instead of the number of detections
+        outputs = []
+        for img_idx, input_boxes in enumerate(boxes_batch):
+            height, width = self.sam2_predictor._orig_hw[img_idx]
+            step = self._sam2_micro_batch(height, width, multimask_output)
+
+            masks = [] if compact_masks else np.zeros((len(input_boxes), height, width), dtype=bool)
+            scores = np.zeros(len(input_boxes), dtype=np.float32)
+            for start in range(0, len(input_boxes), step):
+                boxes = input_boxes[start:start + step]
+                _, unnorm_coords, labels, unnorm_box = self.sam2_predictor._prep_prompts(
+                    None, None, boxes, None, True, img_idx=img_idx
+                )
+                box_masks, box_scores, _ = self.sam2_predictor._predict(
+                    unnorm_coords, labels, unnorm_box, None, multimask_output, img_idx=img_idx
+                )
+
+                box_scores = box_scores.float().cpu().numpy().reshape(len(boxes), -1)
+                best = np.argmax(box_scores, axis=1)
+                box_masks = box_masks.reshape(len(boxes), -1, height, width)
+                box_masks = box_masks[torch.arange(len(boxes)), torch.as_tensor(best)].bool().cpu().numpy()
+                scores[start:start + len(boxes)] = box_scores[np.arange(len(boxes)), best]
+
+                if compact_masks:
+                    masks.extend(CompactMask.from_dense(mask) for mask in box_masks)
+                else:
+                    masks[start:start + len(boxes)] = box_masks
+
+            outputs.append((masks, scores))
+
+        return outputs
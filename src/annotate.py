@@ -1,9 +1,19 @@
 import argparse
+import hashlib
+import json
 import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
 import zipfile
-import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from cvat_sdk import make_client
+from cvat_sdk.core.helpers import expect_status
+from .manifest import DatasetManifest, add_manifest_args
+
+PROGRESS_FILE = ".cvat_upload.json"
 
 def make_client_with_auth(url: str, username: str, password: str):
     """Create a client connection to the CVAT server."""
@@ -13,145 +23,361 @@ def make_client_with_auth(url: str, username: str, password: str):
         raise ConnectionError(f"Failed to connect to CVAT server: {e}")
     return client
 
-def get_image_paths(format_name: str, dataset_dir: Path):
-    supported_extensions = {'.jpg', '.jpeg', '.png'}
-    image_paths = []
+def get_image_paths(format_name: str, dataset_dir: Path, manifest_workers: int = 16, rebuild_manifest: bool = False):
+    supported_extensions = ('.jpg', '.jpeg', '.png')
+    subdir = ""
 
-    if format_name == "pascal_voc":
-        jpeg_dir = dataset_dir / "JPEGImages"
-        search_root = jpeg_dir if jpeg_dir.exists() else dataset_dir
-    else:
-        search_root = dataset_dir
+    if format_name == "pascal_voc" and (dataset_dir / "JPEGImages").exists():
+        subdir = "JPEGImages"
 
-    print(f"[{format_name}] Scanning images: {search_root}")
+    print(f"[{format_name}] Scanning images: {dataset_dir / subdir}")
 
-    for path in search_root.rglob("*"):
-        if path.suffix.lower() in supported_extensions:
-            image_paths.append(str(path))
-    
-    image_paths.sort()
-    return image_paths
+    manifest = DatasetManifest(dataset_dir, workers=manifest_workers, rebuild=rebuild_manifest).update()
+    return [str(path) for path in manifest.images(subdir, recursive=True, extensions=supported_extensions)]
 
-def prepare_zip_for_upload(format_name: str, dataset_dir: Path) -> str:
+def prepare_zip_for_upload(format_name: str, dataset_dir: Path, work_dir: Path, image_names=None) -> str:
     """
     Prepare annotation files according to the format and return the path.
+    Files are written to work_dir; with image_names only the annotations of those images are kept.
     """
     dataset_dir = Path(dataset_dir)
-    
+    work_dir = Path(work_dir)
+    stems = None if image_names is None else {Path(name).stem for name in image_names}
+
     if format_name == "coco":
         # COCO format returns a single JSON file
         candidates = [
             dataset_dir / "annotations" / "instances.json",
             dataset_dir / "instances.json"
         ]
-        for path in candidates:
-            if path.exists():
-                return str(path)
-        
-        # Recursively search if not found
-        found = list(dataset_dir.rglob("*.json"))
-        if found:
-            return str(found[0])
-        raise FileNotFoundError(f"COCO annotation (instances.json) not found: {dataset_dir}")
+        path = next((p for p in candidates if p.exists()), None)
+        if path is None:
+            # Recursively search if not found; only the names the labelling CLIs write, so the
+            # upload progress record and the dataset manifest are never taken for annotations
+            found = sorted(dataset_dir.rglob("instances*.json"))
+            if not found:
+                raise FileNotFoundError(f"COCO annotation (instances.json) not found: {dataset_dir}")
+            path = found[0]
+        if stems is None:
+            return str(path)
+
+        coco = json.loads(path.read_text())
+        coco["images"] = [img for img in coco["images"] if Path(img["file_name"]).stem in stems]
+        image_ids = {img["id"] for img in coco["images"]}
+        coco["annotations"] = [ann for ann in coco["annotations"] if ann["image_id"] in image_ids]
+        subset_path = work_dir / path.name
+        subset_path.write_text(json.dumps(coco))
+        return str(subset_path)
 
     elif format_name == "pascal_voc":
-        zip_filename = "temp_pascal_voc_upload.zip"        
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # images are uploaded separately and the XML/TXT files are small, so deflating buys nothing
+        zip_path = work_dir / "pascal_voc_upload.zip"
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
             for root, _, files in os.walk(dataset_dir):
                 for file in files:
-                    if file.lower().endswith(('.xml', '.txt')):
-                        file_path = Path(root) / file
-                        archive_name = file_path.relative_to(dataset_dir)
+                    if not file.lower().endswith(('.xml', '.txt')):
+                        continue
+                    file_path = Path(root) / file
+                    archive_name = file_path.relative_to(dataset_dir)
+                    if stems is None:
                         zf.write(file_path, archive_name)
-        return str(Path(zip_filename).resolve())
+                    elif file.lower().endswith('.xml'):
+                        if file_path.stem in stems:
+                            zf.write(file_path, archive_name)
+                    else:
+                        # ImageSets lists start each line with the image stem
+                        lines = [line for line in file_path.read_text().splitlines() if line.split() and line.split()[0] in stems]
+                        zf.writestr(str(archive_name), "".join(f"{line}\n" for line in lines))
+        return str(zip_path)
 
     elif format_name == "cvat_xml":
         xml_files = list(dataset_dir.glob("*.xml"))
         if not xml_files:
             raise FileNotFoundError(f"CVAT XML files not found: {dataset_dir}")
-        return str(xml_files[0])
+        if stems is None:
+            return str(xml_files[0])
+
+        tree = ET.parse(xml_files[0])
+        root = tree.getroot()
+        for image in root.findall("image"):
+            if Path(image.get("name", "")).stem not in stems:
+                root.remove(image)
+        subset_path = work_dir / xml_files[0].name
+        tree.write(subset_path, encoding="utf-8", xml_declaration=True)
+        return str(subset_path)
 
     else:
         raise ValueError(f"Unsupported format: {format_name}")
 
+def split_into_tasks(image_paths, task_size: int):
+    if task_size <= 0:
+        return [image_paths]
+    return [image_paths[i:i + task_size] for i in range(0, len(image_paths), task_size)]
+
+def split_into_chunks(image_paths, chunk_bytes: int):
+    # files are grouped in order until the next one would exceed the request size;
+    # a file larger than the limit goes alone
+    chunks, current, current_size = [], [], 0
+    for path in image_paths:
+        size = os.path.getsize(path)
+        if current and current_size + size > chunk_bytes:
+            chunks.append(current)
+            current, current_size = [], 0
+        current.append(path)
+        current_size += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+class UploadProgress:
+    """
+    Local record of which tasks exist and which image chunks reached the server.
+    It is rewritten after every step, so an interrupted upload can continue with --resume.
+    """
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.state = None
+        if resume and self.path.exists():
+            self.state = json.loads(self.path.read_text())
+
+    def start(self, key, tasks):
+        if self.state is not None:
+            if self.state["key"] != key:
+                raise ValueError(
+                    f"{self.path} records a different upload ({self.state['key']['task_name']}) or the images, "
+                    "--task-size or --chunk-mb changed since; remove it or drop --resume."
+                )
+            done = sum(len(task["uploaded"]) for task in self.state["tasks"])
+            total = sum(len(task["chunks"]) for task in self.state["tasks"])
+            print(f"Resuming upload: {done}/{total} chunks already on the server")
+            return self.state["tasks"]
+
+        self.state = {"key": key, "tasks": tasks}
+        self.save()
+        return tasks
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(self.state))
+            os.replace(tmp_path, self.path)
+
+    def mark_uploaded(self, task, index):
+        with self.lock:
+            task["uploaded"].append(index)
+        self.save()
+
+def plan_digest(tasks) -> str:
+    # task names and the ordered chunk lists, so added or removed images and other --task-size/--chunk-mb change it
+    plan = [[task["name"], task["chunks"]] for task in tasks]
+    return hashlib.sha256(json.dumps(plan).encode()).hexdigest()
+
+def wait_for_data(client, cvat_task):
+    while True:
+        time.sleep(client.config.status_check_period)
+        status, _ = cvat_task.api.retrieve_status(cvat_task.id)
+        if status.state.value == "Finished":
+            return
+        if status.state.value == "Failed":
+            raise RuntimeError(f"CVAT could not create task {cvat_task.id}: {status.message}")
+
+def upload_images(client, cvat_task, task, progress: UploadProgress, workers: int = 4, image_quality: int = 70):
+    """Send the task's images as concurrent multi-file requests, then ask CVAT to build the task."""
+    url = client.api_map.make_endpoint_url(cvat_task.api.create_data_endpoint.path, kwsub={"id": cvat_task.id})
+    rest_client = client.api_client.rest_client
+
+    if not task["started"]:
+        response = rest_client.POST(url, headers={"Upload-Start": "", **client.api_client.get_common_headers()})
+        expect_status(202, response)
+        task["started"] = True
+        progress.save()
+
+    def send(index):
+        files = {
+            f"client_files[{i}]": (os.fspath(path), Path(path).read_bytes())
+            for i, path in enumerate(task["chunks"][index])
+        }
+        response = rest_client.POST(
+            url,
+            post_params={"image_quality": image_quality, **files},
+            headers={
+                "Content-Type": "multipart/form-data",
+                "Upload-Multiple": "",
+                **client.api_client.get_common_headers(),
+            },
+        )
+        expect_status(200, response)
+        # the server stores files by name, so a chunk that is sent again just overwrites itself
+        progress.mark_uploaded(task, index)
+
+    pending = [i for i in range(len(task["chunks"])) if i not in set(task["uploaded"])]
+    total = len(task["chunks"])
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(send, index) for index in pending]
+        try:
+            for future in as_completed(futures):
+                future.result()
+                print(f" -> Uploaded chunk {len(task['uploaded'])}/{total}")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if not task["finish_sent"]:
+        # chunks arrive in any order, so the frame order is given explicitly
+        fields = {
+            "image_quality": image_quality,
+            "sorting_method": "predefined",
+            "upload_file_order": [Path(path).name for chunk in task["chunks"] for path in chunk],
+        }
+        response = rest_client.POST(url, headers={"Upload-Finish": "", **client.api_client.get_common_headers()}, post_params=fields)
+        expect_status(202, response)
+        task["finish_sent"] = True
+        progress.save()
+
+    print("Waiting for CVAT to process the images...")
+    wait_for_data(client, cvat_task)
+    task["data_done"] = True
+    progress.save()
+
 def main():
     parser = argparse.ArgumentParser(description="CVAT Dataset Uploader (Multi-Format Support)")
-    
+
     parser.add_argument("-u", "--cvat-url", type=str, required=True, help="CVAT server URL")
     parser.add_argument("-U", "--username", type=str, required=True, help="Username")
     parser.add_argument("-P", "--password", type=str, required=True, help="Password")
-    
+
     parser.add_argument("--format", type=str, required=True, choices=["coco", "pascal_voc", "cvat_xml"], help="Dataset format")
     parser.add_argument("--dataset-dir", type=str, required=True, help="Dataset directory path")
-    
+
     parser.add_argument("--task-name", type=str, required=True, help="Task name to create")
     parser.add_argument("--labels", type=str, nargs='+', help="List of label names (e.g., --labels car person)")
-    
+
+    upload = parser.add_argument_group("upload")
+    upload.add_argument("--chunk-mb", type=float, default=32, help="Image bytes per upload request")
+    upload.add_argument("--upload-workers", type=int, default=4, help="Upload requests in flight at once")
+    upload.add_argument("--image-quality", type=int, default=70, help="Quality of the compressed chunks CVAT builds from the images")
+    upload.add_argument("--segment-size", type=int, default=0, help="Images per CVAT job (0 keeps the server default)")
+    upload.add_argument("--task-size", type=int, default=0, help="Images per CVAT task; larger datasets become several numbered tasks (0 creates one task)")
+    upload.add_argument("--progress-file", type=str, default=None, help=f"Upload progress record (default: <dataset-dir>/{PROGRESS_FILE})")
+    upload.add_argument("--resume", action="store_true", help="Continue an interrupted upload from the progress record")
+    add_manifest_args(parser)
+
     args = parser.parse_args()
-    
+
     dataset_dir = Path(args.dataset_dir)
     if not dataset_dir.exists():
         print(f"Error: Directory not found: {dataset_dir}")
         return
 
     # 1. Get image list according to format
-    image_paths = get_image_paths(args.format, dataset_dir)
+    image_paths = get_image_paths(args.format, dataset_dir, args.manifest_workers, args.rebuild_manifest)
     if not image_paths:
         print(f"Error: No images found.")
         return
 
-    # 2. Prepare annotation files
+    if not args.labels:
+        print("Error: --labels is required for creating a new task.")
+        return
+
+    # 2. Plan tasks and upload chunks, or pick up the recorded plan
+    groups = split_into_tasks(image_paths, args.task_size)
+    tasks = [
+        {
+            "name": args.task_name if len(groups) == 1 else f"{args.task_name}_{i + 1:03d}",
+            "id": None,
+            "segment_size": args.segment_size,
+            "chunks": split_into_chunks(group, int(args.chunk_mb * 2**20)),
+            "uploaded": [],
+            "started": False,
+            "finish_sent": False,
+            "data_done": False,
+            "annotations_done": False,
+        }
+        for i, group in enumerate(groups)
+    ]
+    progress = UploadProgress(args.progress_file or dataset_dir / PROGRESS_FILE, resume=args.resume)
     try:
-        upload_file_path = prepare_zip_for_upload(args.format, dataset_dir)
+        key = {
+            "cvat_url": args.cvat_url,
+            "task_name": args.task_name,
+            "format": args.format,
+            "dataset_dir": str(dataset_dir.resolve()),
+            "plan": plan_digest(tasks),
+        }
+        tasks = progress.start(key, tasks)
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+
+    # 3. Prepare annotation files in a temporary directory
+    work_dir = tempfile.TemporaryDirectory()
+    try:
+        upload_file_path = prepare_zip_for_upload(args.format, dataset_dir, work_dir.name)
     except Exception as e:
         print(f"Error: Failed to prepare annotations: {e}")
+        work_dir.cleanup()
         return
 
-    # 3. CVAT operations
+    cvat_format_map = {
+        "coco": "COCO 1.0",
+        "pascal_voc": "PASCAL VOC 1.1",
+        "cvat_xml": "CVAT for Images 1.1"
+    }
+    target_format = cvat_format_map[args.format]
+
+    # 4. CVAT operations
     print(f"Connecting to CVAT: {args.cvat_url}...")
-    with make_client_with_auth(args.cvat_url, args.username, args.password) as client:
+    with work_dir, make_client_with_auth(args.cvat_url, args.username, args.password) as client:
         try:
-            if not args.labels:
-                print("Error: --labels is required for creating a new task.")
-                return
-
             # Configure default detection type (Bbox)
             labels_spec = [
                 {"name": name, "type": "rectangle"} for name in args.labels
             ]
 
-            print(f"Creating task: '{args.task_name}' (Number of images: {len(image_paths)})")
-            task = client.tasks.create(
-                spec={
-                    "name": args.task_name,
-                    "labels": labels_spec,
-                },
-            )
-            print(f" -> Task created successfully! ID: {task.id}")
-
-            # Upload images
-            print("Uploading images...")
-            task.upload_data(resources=image_paths)
-
-            # Import annotations
-            cvat_format_map = {
-                "coco": "COCO 1.0",
-                "pascal_voc": "PASCAL VOC 1.1",
-                "cvat_xml": "CVAT for Images 1.1"
-            }
-            target_format = cvat_format_map[args.format]
-
-            print(f"Importing annotations ({target_format})...")
-            task.import_annotations(
-                format_name=target_format,
-                filename=upload_file_path,
-            )
-            
+            for task in tasks:
+                image_names = [Path(path).name for chunk in task["chunks"] for path in chunk]
+                if task["id"] is None:
+                    print(f"Creating task: '{task['name']}' (Number of images: {len(image_names)})")
+                    spec = {"name": task["name"], "labels": labels_spec}
+                    if task["segment_size"] > 0:
+                        spec["segment_size"] = task["segment_size"]
+                    cvat_task = client.tasks.create(spec=spec)
+                    task["id"] = cvat_task.id
+                    progress.save()
+                    print(f" -> Task created successfully! ID: {task['id']}")
+                else:
+                    cvat_task = client.tasks.retrieve(task["id"])
+
+                # Upload images
+                if not task["data_done"]:
+                    print(f"Uploading images ({len(task['chunks'])} chunks, {args.upload_workers} at a time)...")
+                    upload_images(client, cvat_task, task, progress, workers=args.upload_workers, image_quality=args.image_quality)
+
+                # Import annotations
+                if not task["annotations_done"]:
+                    task_file_path = upload_file_path
+                    if len(tasks) > 1:
+                        # CVAT rejects annotations for images that are not in the task
+                        task_dir = Path(work_dir.name) / str(task["id"])
+                        task_dir.mkdir(exist_ok=True)
+                        task_file_path = prepare_zip_for_upload(args.format, dataset_dir, task_dir, image_names=image_names)
+                    print(f"Importing annotations ({target_format})...")
+                    cvat_task.import_annotations(
+                        format_name=target_format,
+                        filename=task_file_path,
+                    )
+                    task["annotations_done"] = True
+                    progress.save()
+
+                print(f"Access URL: {args.cvat_url}/tasks/{task['id']}")
+
             print("Success!")
-            print(f"Access URL: {args.cvat_url}/tasks/{task.id}")
 
         except Exception as e:
             print(f"\nAn error occurred: {e}")
+            print(f"Progress is saved in {progress.path}; rerun with --resume to continue.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
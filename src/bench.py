@@ -0,0 +1,299 @@
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+import torch
+from pathlib import Path
+from contextlib import redirect_stdout
+from typing import Dict, List
+from . import exporters
+from .GroundedSAM2Predictor import GroundedSAM2Predictor
+from .profiler import Tracer, peak_rss_mb
+
+
+class StubTokenizer:
+    """Word-level stand-in for the BERT tokenizer: one token per word or punctuation mark."""
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        spans = [m.span() for m in re.finditer(r"\w+|[^\w\s]", text)]
+        input_ids = [zlib.crc32(text[start:end].encode()) % 28000 + 1000 for start, end in spans]
+        if add_special_tokens:
+            input_ids = [101] + input_ids + [102]
+            spans = [(0, 0)] + spans + [(0, 0)]
+
+        encoded = {"input_ids": input_ids}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = spans
+        return encoded
+
+
+class StubGroundingDINO(torch.nn.Module):
+    """
+    Deterministic Grounding DINO stand-in. For every image it returns boxes_per_image
+    confident queries, each matched to one class word of the caption, and low logits elsewhere.
+    """
+    def __init__(self, boxes_per_image: int = 10, box_size=(0.05, 0.3), num_queries: int = 900, max_text_len: int = 256):
+        super().__init__()
+        self.tokenizer = StubTokenizer()
+        self.boxes_per_image = boxes_per_image
+        self.box_size = box_size
+        self.num_queries = num_queries
+        self.max_text_len = max_text_len
+
+    def forward(self, samples, captions):
+        tensors, _ = samples.decompose()
+        batch_size = tensors.shape[0]
+        logits = torch.full((batch_size, self.num_queries, self.max_text_len), -10.0)
+        boxes = torch.full((batch_size, self.num_queries, 4), 0.5)
+
+        for b, caption in enumerate(captions):
+            # seed from the caption and a coarse sample of the pixels so results repeat per image
+            seed = zlib.crc32(caption.encode()) ^ int(tensors[b, :, ::32, ::32].abs().sum().item() * 1000)
+            g = torch.Generator().manual_seed(seed)
+
+            offsets = self.tokenizer(caption, return_offsets_mapping=True)["offset_mapping"]
+            words = [i for i, (start, end) in enumerate(offsets) if end > start and caption[start:end] != "."]
+            n = min(self.boxes_per_image, self.num_queries)
+            if not words or n == 0:
+                continue
+
+            token = torch.tensor(words)[torch.randint(len(words), (n,), generator=g)]
+            logits[b, torch.arange(n), token] = 10.0
+
+            low, high = self.box_size
+            wh = low + (high - low) * torch.rand((n, 2), generator=g)
+            center = wh / 2 + (1 - wh) * torch.rand((n, 2), generator=g)
+            boxes[b, :n] = torch.cat([center, wh], dim=1)
+
+        return {"pred_logits": logits, "pred_boxes": boxes}
+
+
+class StubSAM2Predictor:
+    """SAM2ImagePredictor stand-in that returns an ellipse inscribed in every prompt box."""
+    def __init__(self, num_multimask: int = 3):
+        self.num_multimask = num_multimask
+        self._orig_hw = []
+        self._features = None
+        self._is_image_set = False
+        self._is_batch = False
+
+    def set_image_batch(self, image_list: List[np.ndarray]):
+        self._orig_hw = [image.shape[:2] for image in image_list]
+        self._features = {
+            "image_embed": torch.zeros((len(image_list), 1, 1, 1)),
+            "high_res_feats": [torch.zeros((len(image_list), 1, 1, 1))],
+        }
+        self._is_image_set = True
+        self._is_batch = True
+
+    def _prep_prompts(self, point_coords, point_labels, box, mask_logits, normalize_coords, img_idx=-1):
+        return None, None, None, torch.as_tensor(box, dtype=torch.float32).reshape(-1, 4)
+
+    def _predict(self, point_coords, point_labels, boxes=None, mask_input=None, multimask_output=True,
+                 return_logits=False, img_idx=-1):
+        height, width = self._orig_hw[img_idx]
+        num_masks = self.num_multimask if multimask_output else 1
+        ys = torch.arange(height, dtype=torch.float32)[:, None] + 0.5
+        xs = torch.arange(width, dtype=torch.float32)[None, :] + 0.5
+
+        masks = torch.zeros((len(boxes), num_masks, height, width), dtype=torch.bool)
+        for i, (x1, y1, x2, y2) in enumerate(boxes.tolist()):
+            cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+            rx, ry = max((x2 - x1) / 2, 1.0), max((y2 - y1) / 2, 1.0)
+            for k in range(num_masks):
+                scale = 1.0 - 0.1 * k
+                masks[i, k] = ((xs - cx) / (rx * scale)) ** 2 + ((ys - cy) / (ry * scale)) ** 2 <= 1.0
+
+        scores = torch.linspace(0.9, 0.5, num_masks)[None].repeat(len(boxes), 1)
+        return masks, scores, None
+
+
+class StubPredictor(GroundedSAM2Predictor):
+    """GroundedSAM2Predictor with the stub models; prompts, NMS and mask post-processing are the real code."""
+    def __init__(self, boxes_per_image: int = 10, box_size=(0.05, 0.3), **kwargs):
+        self._stub_options = {"boxes_per_image": boxes_per_image, "box_size": box_size}
+        super().__init__(
+            sam2_model_config="stub", sam2_checkpoint="stub",
+            grounding_dino_config="stub", grounding_dino_checkpoint="stub",
+            device="cpu", **kwargs
+        )
+
+    def _load_sam2(self, sam2_model_config, sam2_checkpoint):
+        return StubSAM2Predictor()
+
+    def _load_grounding_dino(self, grounding_dino_config, grounding_dino_checkpoint):
+        return StubGroundingDINO(**self._stub_options)
+
+
+def make_dataset(root: Path, num_images: int, width: int, height: int, seed: int) -> List[Path]:
+    """Write synthetic JPEGs to root/images and hard-link them into root/JPEGImages."""
+    rng = np.random.default_rng(seed)
+    images_dir = root / "images"
+    voc_images_dir = root / "JPEGImages"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    voc_images_dir.mkdir(parents=True, exist_ok=True)
+
+    # smooth noise compresses and decodes like a photo rather than like white noise
+    image_files = []
+    for i in range(num_images):
+        small = rng.integers(0, 256, size=(max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+        image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        path = images_dir / f"{i:06d}.jpg"
+        cv2.imwrite(str(path), image)
+        link = voc_images_dir / path.name
+        if not link.exists():
+            try:
+                link.hardlink_to(path)
+            except OSError:
+                shutil.copy2(path, link)
+        image_files.append(path)
+    return image_files
+
+
+def run_benchmark(args) -> Dict:
+    torch.manual_seed(args.seed)
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="gsam2_bench_"))
+    width, height = args.image_size
+    classes = [f"class{i}" for i in range(args.num_classes)]
+    class_id_map = {name: i + 1 for i, name in enumerate(classes)}
+    colormap = [(0, 0, 0)] + [tuple(int(v) for v in np.random.default_rng(i).integers(0, 256, 3)) for i in range(args.num_classes)]
+
+    # the predictor's own spans (detect, nms, set_image, run_sam2) time the model stages
+    tracer = Tracer(args.trace)
+    try:
+        with tracer.span("dataset"):
+            image_files = make_dataset(work_dir, args.num_images, width, height, args.seed)
+
+        predictor = StubPredictor(boxes_per_image=args.boxes_per_image, box_size=tuple(args.box_size))
+        predictor.tracer = tracer
+
+        coco = exporters.COCOExporter(
+            categories=classes,
+            output_path=str(work_dir / "annotations" / "instances.json"),
+            seg_encoding=args.seg_encoding
+        )
+        voc = exporters.PascalVOCExporter(input_dir=str(work_dir))
+
+        start = time.perf_counter()
+        num_detections = 0
+        for i in range(0, len(image_files), args.image_batch_size):
+            batch = [str(path) for path in image_files[i:i + args.image_batch_size]]
+            with tracer.span("decode"):
+                images = [predictor.load_image(path) for path in batch]
+            with tracer.span("predict"):
+                results = predictor.predict_batch(
+                    batch, classes, batch_size=args.batch_size, multimask_output=args.multimask_output,
+                    images=images, compact_masks=args.compact_masks
+                )
+
+            for result in results:
+                num_detections += len(result["labels"])
+                with tracer.span("coco_export"):
+                    # one entry per image; segmentation annotations carry the bbox as well
+                    coco.add(result, task="segmentation" if args.segmentation else "detection")
+                with tracer.span("voc_export"):
+                    voc.save(result, class_id_map=class_id_map, task="detection")
+                    if args.segmentation:
+                        voc.save(result, class_id_map=class_id_map, colormap=colormap, task="segmentation")
+
+        with tracer.span("coco_save"):
+            coco.save()
+        with tracer.span("voc_save"):
+            voc.close()
+        annotate_seconds = time.perf_counter() - start
+
+        visualize = "skipped" if args.skip_visualize else "ok"
+        if not args.skip_visualize:
+            try:
+                from .visualize import Visulizer
+            except ImportError as e:
+                visualize = f"skipped ({e})"
+            else:
+                visualizer = Visulizer(datasetdir=str(work_dir), output_dir=str(work_dir / "visualizations"))
+                with tracer.span("visualize_load"):
+                    dataset = visualizer.load_dataset(format="coco", task="seg" if args.segmentation else "bbox")
+                with tracer.span("visualize_draw"):
+                    if args.segmentation:
+                        visualizer.visualize_mask(dataset)
+                    else:
+                        visualizer.visualize_bbox(dataset)
+    finally:
+        tracer.close()
+        if not args.keep_outputs and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "config": {
+            "num_images": args.num_images,
+            "image_size": [width, height],
+            "num_classes": args.num_classes,
+            "boxes_per_image": args.boxes_per_image,
+            "box_size": list(args.box_size),
+            "image_batch_size": args.image_batch_size,
+            "batch_size": args.batch_size,
+            "multimask_output": args.multimask_output,
+            "compact_masks": args.compact_masks,
+            "segmentation": args.segmentation,
+            "seg_encoding": args.seg_encoding,
+            "seed": args.seed,
+        },
+        "images": len(image_files),
+        "detections": num_detections,
+        "annotate_seconds": round(annotate_seconds, 6),
+        "images_per_sec": round(len(image_files) / annotate_seconds, 3) if annotate_seconds > 0 else None,
+        "stages": tracer.stats(),
+        "visualize": visualize,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _image_size(value: str):
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got '{value}'")
+    return width, height
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="CPU benchmark of the annotation pipeline with stub Grounding DINO and SAM2 models")
+    parser.add_argument('--num-images', type=int, default=50)
+    parser.add_argument('--image-size', type=_image_size, default=(1280, 720), help="WIDTHxHEIGHT of the synthetic images")
+    parser.add_argument('--num-classes', type=int, default=20)
+    parser.add_argument('--boxes-per-image', type=int, default=10)
+    parser.add_argument('--box-size', type=float, nargs=2, default=[0.05, 0.3], metavar=("MIN", "MAX"), help="Box side as a fraction of the image side")
+    parser.add_argument('--image-batch-size', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=0, help="Classes per prompt (0 packs by token budget)")
+    parser.add_argument('--multimask-output', action="store_true")
+    parser.add_argument('--compact-masks', action="store_true")
+    parser.add_argument('--segmentation', action="store_true")
+    parser.add_argument('--seg-encoding', choices=["polygon", "rle"], default="polygon")
+    parser.add_argument('--skip-visualize', action="store_true")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help="Where to write the synthetic dataset and outputs (default: a temporary directory)")
+    parser.add_argument('--keep-outputs', action="store_true", help="Keep the temporary work directory")
+    parser.add_argument('--output', default=None, help="Write the JSON report here instead of stdout")
+    parser.add_argument('--trace', default=None, help="Also write the per-span records to this JSONL file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    # keep stdout for the report; progress messages from the pipeline go to stderr
+    with redirect_stdout(sys.stderr):
+        report = run_benchmark(args)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Benchmark report saved to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
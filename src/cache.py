@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .mask_utils import CompactMask
+
+
+def add_cache_args(parser):
+    group = parser.add_argument_group("result cache")
+    group.add_argument('--cache-dir', default=None, help="Directory for cached inference results (disabled if not set)")
+    group.add_argument('--cache-size-gb', type=float, default=10.0, help="Evict least recently used results beyond this size")
+    add_embedding_args(group)
+    return parser
+
+
+def add_embedding_args(parser):
+    parser.add_argument('--embedding-dir', default=None, help="Directory for reusable image-encoder outputs, shared across class lists and thresholds (disabled if not set)")
+    parser.add_argument('--embedding-dtype', choices=["native", "float16"], default="native", help="Storage dtype for --embedding-dir; float16 halves the footprint but rounds the features")
+    return parser
+
+
+def file_identity(path: str) -> List[Any]:
+    """Cheap identity for a checkpoint: resolved path, size and mtime."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [str(path)]
+    return [str(Path(path).resolve()), st.st_size, int(st.st_mtime)]
+
+
+def settings_hash(settings: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def model_settings(args) -> Dict[str, Any]:
+    """The models, thresholds and execution profile a predictor was built with."""
+    return {
+        "box_threshold": args.box_threshold,
+        "text_threshold": args.text_threshold,
+        "tiling": [args.tile_size, args.tile_overlap, args.crop_padding] if getattr(args, "tile_size", 0) else None,
+        "sam2": [args.sam2_model_config, file_identity(args.sam2_checkpoint)],
+        "grounding_dino": [file_identity(args.grounding_dino_config), file_identity(args.grounding_dino_checkpoint)],
+        "precision": getattr(args, "precision", "fp32"),
+        "embedding_dtype": getattr(args, "embedding_dtype", "native") if getattr(args, "embedding_dir", None) else None,
+    }
+
+
+def inference_settings(args, classes: List[str], outputs=("boxes", "masks")) -> Dict[str, Any]:
+    """Everything besides the image itself that changes a predictor result."""
+    if getattr(args, "server", None):
+        # a remote predictor runs with the server's models and thresholds, not this CLI's flags
+        from .server import server_settings
+        models = server_settings(args.server)
+    else:
+        models = model_settings(args)
+    return {
+        "classes": list(classes),
+        "batch_size": args.batch_size,
+        "multimask_output": args.multimask_output,
+        "outputs": list(outputs),
+        **models,
+    }
+
+
+class ResultCache:
+    """
+    Content-addressed store of predictor results.
+    Keys hash the image content digest together with everything that changes the output
+    (classes, thresholds, prompt batching, multimask_output, checkpoints); values are
+    compressed .npz files holding boxes, scores, labels and bit-packed mask crops.
+    The digest comes from the dataset manifest when one is given, so images are not read twice.
+    """
+    def __init__(self, cache_dir: str, settings: Dict[str, Any], max_bytes: int = 10 * 1024 ** 3, manifest=None):
+        self.cache_dir = Path(cache_dir)
+        self.manifest = manifest
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.settings_hash = settings_hash(settings)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = sum(path.stat().st_size for path in self._entries())
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    @classmethod
+    def from_args(cls, args, classes: List[str], outputs=("boxes", "masks"), manifest=None) -> Optional["ResultCache"]:
+        if not args.cache_dir:
+            return None
+        return cls(args.cache_dir, inference_settings(args, classes, outputs), max_bytes=int(args.cache_size_gb * 1024 ** 3), manifest=manifest)
+
+    def _entries(self):
+        return self.cache_dir.glob("*/*.npz")
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.npz"
+
+    def key(self, image_path: str) -> str:
+        digest = self.manifest.digest(image_path) if self.manifest is not None else None
+        if digest is None:
+            h = hashlib.sha256()
+            with open(image_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+        return hashlib.sha256(f"{self.settings_hash}:{digest}".encode()).hexdigest()
+
+    def get(self, key: str, image_path: str, compact_masks: bool = False) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = self._decode(data, image_path, compact_masks)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **self._encode(result))
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += path.stat().st_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # drop least recently used entries until 90% of the budget is free
+        entries = []
+        for path in self._entries():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._total_bytes = total
+
+    @staticmethod
+    def _encode(result: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        # box-only results are stored without masks rather than running SAM2 for the cache
+        masks = result["masks"] if getattr(result["masks"], "resolved", True) else []
+        masks = [m if isinstance(m, CompactMask) else CompactMask.from_dense(m) for m in masks]
+        return {
+            "image_shape": np.asarray(result["image_shape"], dtype=np.int64),
+            "boxes": np.asarray(result["boxes"], dtype=np.float32).reshape(-1, 4),
+            "scores": np.asarray(result["scores"], dtype=np.float32).reshape(-1),
+            "labels": np.asarray(result["labels"], dtype=str),
+            "mask_bits": np.concatenate([m.bits for m in masks]) if masks else np.zeros(0, dtype=np.uint8),
+            # per mask: packed length, crop height, crop width, x0, y0
+            "mask_meta": np.asarray([[m.bits.size, *m.crop_shape, m.x0, m.y0] for m in masks], dtype=np.int64).reshape(-1, 5),
+        }
+
+    @staticmethod
+    def _decode(data, image_path: str, compact_masks: bool) -> Dict[str, Any]:
+        image_shape = tuple(int(v) for v in data["image_shape"])
+        labels = [str(label) for label in data["labels"]]
+        if not labels:
+            return {
+                "boxes": [],
+                "masks": [],
+                "scores": [],
+                "labels": [],
+                "image_path": image_path,
+                "image_shape": image_shape
+            }
+
+        bits = data["mask_bits"]
+        masks = []
+        offset = 0
+        for size, crop_h, crop_w, x0, y0 in data["mask_meta"]:
+            mask = CompactMask(bits[offset:offset + size], (crop_h, crop_w), (x0, y0), image_shape)
+            masks.append(mask if compact_masks else mask.to_dense())
+            offset += size
+
+        return {
+            "boxes": data["boxes"],
+            "masks": masks if compact_masks or not masks else np.stack(masks),
+            "scores": data["scores"],
+            "labels": labels,
+            "image_shape": image_shape,
+            "image_path": image_path
+        }
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        print(f"[Cache] {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {self._total_bytes / 1024 ** 2:.1f} MB in {self.cache_dir}")
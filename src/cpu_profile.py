@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from typing import Any, Dict, List
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def add_cpu_args(parser):
+    group = parser.add_argument_group("CPU inference")
+    group.add_argument('--precision', choices=PRECISIONS, default="fp32", help="CPU execution profile: int8 quantizes the linear layers dynamically, bf16 runs under autocast")
+    group.add_argument('--cpu-threads', type=int, default=0, help="Intra-op threads (0 keeps torch's default, or splits the available cores across --replicas)")
+    group.add_argument('--interop-threads', type=int, default=0, help="Inter-op threads (0 keeps torch's default)")
+    group.add_argument('--accuracy-sample', type=int, default=0, help="Annotate the first N images in fp32 and in --precision and report the difference")
+    return parser
+
+
+def validate_cpu_args(args):
+    if args.precision != "fp32" and not str(args.device).startswith("cpu"):
+        raise ValueError(f"--precision {args.precision} is a CPU profile and needs --device cpu")
+
+
+def thread_count(args) -> int:
+    if args.cpu_threads or getattr(args, "replicas", 1) <= 1:
+        return args.cpu_threads
+    # each replica gets an equal share of the cores this process may run on
+    return max(1, len(os.sched_getaffinity(0)) // args.replicas)
+
+
+def _box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = np.clip(a[:, 2:] - a[:, :2], 0, None).prod(axis=1)
+    area_b = np.clip(b[:, 2:] - b[:, :2], 0, None).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def _mask_iou(a, b) -> float:
+    a, b = np.asarray(a, dtype=bool), np.asarray(b, dtype=bool)
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def precision_drift(reference: List[Dict[str, Any]], candidate: List[Dict[str, Any]], iou_threshold: float = 0.5) -> Dict[str, float]:
+    """Match each image's detections to the fp32 ones (same label, greedy by box IoU) and summarize the differences."""
+    stats = {"reference": 0, "candidate": 0, "matched": 0, "box_iou": [], "mask_iou": [], "score_delta": []}
+    for ref, cand in zip(reference, candidate):
+        stats["reference"] += len(ref["labels"])
+        stats["candidate"] += len(cand["labels"])
+        if not ref["labels"] or not cand["labels"]:
+            continue
+
+        # box-only predictions leave their masks unresolved; do not run SAM2 just to compare them
+        has_masks = getattr(ref["masks"], "resolved", True) and getattr(cand["masks"], "resolved", True)
+        iou = _box_iou(np.asarray(ref["boxes"], dtype=np.float64), np.asarray(cand["boxes"], dtype=np.float64))
+        used_ref, used_cand = set(), set()
+        for flat in np.argsort(-iou, axis=None):
+            i, j = divmod(int(flat), iou.shape[1])
+            if iou[i, j] < iou_threshold:
+                break
+            if i in used_ref or j in used_cand or ref["labels"][i] != cand["labels"][j]:
+                continue
+            used_ref.add(i)
+            used_cand.add(j)
+            stats["matched"] += 1
+            stats["box_iou"].append(iou[i, j])
+            if has_masks:
+                stats["mask_iou"].append(_mask_iou(ref["masks"][i], cand["masks"][j]))
+            stats["score_delta"].append(abs(float(ref["scores"][i]) - float(cand["scores"][j])))
+
+    for name in ("box_iou", "mask_iou", "score_delta"):
+        stats[name] = float(np.mean(stats[name])) if stats[name] else float("nan")
+    return stats
+
+
+def compare_precision(predictor, image_files, classes: List[str], args):
+    """Annotate a sample in fp32, switch the predictor to args.precision, annotate it again and print the drift."""
+    paths = [str(path) for path in image_files[:args.accuracy_sample]]
+    if args.precision == "fp32" or not paths:
+        predictor.set_precision(args.precision)
+        return
+
+    kwargs = {"batch_size": args.batch_size, "multimask_output": args.multimask_output, "compact_masks": True}
+    reference = [predictor.predict(path, classes, **kwargs) for path in paths]
+    predictor.set_precision(args.precision)
+    candidate = [predictor.predict(path, classes, **kwargs) for path in paths]
+
+    stats = precision_drift(reference, candidate)
+    matched = stats["matched"] / stats["reference"] if stats["reference"] else 1.0
+    print(
+        f"[CPU] {args.precision} vs fp32 on {len(paths)} images: detections {stats['reference']} -> {stats['candidate']}, "
+        f"matched {matched:.1%}, mean box IoU {stats['box_iou']:.3f}, mean mask IoU {stats['mask_iou']:.3f}, "
+        f"mean score delta {stats['score_delta']:.4f}"
+    )
@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+import torch
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from groundingdino.util.misc import NestedTensor
+
+STORE_VERSION = 2
+EMBEDDING_DTYPES = {"native": None, "float16": torch.float16}
+
+
+class EmbeddingStore:
+    """
+    Per-image image-encoder outputs on disk, one .npy per tensor, read back with mmap.
+    Entries are keyed by image content and model identity, so changing classes or
+    thresholds reuses them and only the prompt-dependent heads run again. The content
+    digest comes from a dataset manifest when one covers the image.
+    Features keep the encoder's dtype unless a storage dtype is given; fresh features are then
+    rounded the same way, so a warm store gives the same results as a cold one.
+    """
+    def __init__(self, store_dir: str, model_id, dtype: Optional[torch.dtype] = None, manifest=None):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype
+        self.manifest = manifest
+        self.model_hash = hashlib.sha256(
+            json.dumps([STORE_VERSION, model_id, str(dtype)], sort_keys=True).encode()
+        ).hexdigest()
+
+    def key(self, image_path: str) -> str:
+        digest = self.manifest.digest(image_path) if self.manifest is not None else None
+        if digest is None:
+            h = hashlib.sha256()
+            with open(image_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+        return hashlib.sha256(f"{self.model_hash}:{digest}".encode()).hexdigest()
+
+    def _dir(self, key: str, name: str) -> Path:
+        return self.store_dir / key[:2] / key / name
+
+    def load(self, key: str, name: str) -> Optional[Dict[str, torch.Tensor]]:
+        """
+        CPU tensors in the dtype the encoder produced them in, or None if the entry is missing.
+        They are backed by the copy-on-write memory map, so pages are read when the caller
+        first copies them (to the device or into a batch), not here.
+        """
+        entry_dir = self._dir(key, name)
+        if not entry_dir.is_dir():
+            return None
+        dtypes = json.loads((entry_dir / "dtypes.json").read_text())
+        return {
+            path.stem: torch.from_numpy(np.load(path, mmap_mode="c")).to(getattr(torch, dtypes[path.stem]))
+            for path in sorted(entry_dir.glob("*.npy"))
+        }
+
+    def save(self, key: str, name: str, tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Store the tensors and return them as load() will give them back."""
+        if self.dtype is not None:
+            tensors = {tensor_name: tensor.to(self.dtype).to(tensor.dtype) for tensor_name, tensor in tensors.items()}
+
+        entry_dir = self._dir(key, name)
+        if entry_dir.is_dir():
+            return tensors
+
+        # write into a private directory and rename it into place so readers never see half an entry
+        tmp_dir = entry_dir.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for tensor_name, tensor in tensors.items():
+            data = tensor.detach().to("cpu", self.dtype or tensor.dtype)
+            if data.dtype == torch.bfloat16:
+                data = data.float()  # numpy has no bfloat16; the upcast is exact
+            np.save(tmp_dir / f"{tensor_name}.npy", data.numpy())
+        dtypes = {tensor_name: str(tensor.dtype).replace("torch.", "") for tensor_name, tensor in tensors.items()}
+        (tmp_dir / "dtypes.json").write_text(json.dumps(dtypes))
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return tensors
+
+
+class CachedBackboneBody(torch.nn.Module):
+    """
+    Drop-in for the image backbone inside Grounding DINO's Joiner.
+    When keys are set, each image's multi-scale features come from the store (or are
+    computed on the unpadded image and saved), then are padded back into a batch with
+    matching masks; the Joiner still adds the positional encodings.
+
+    Features are therefore those of the image run on its own, whichever batch it arrives in.
+    The plain batched path runs the backbone on the padded batch instead, so near the right
+    and bottom edges of an image smaller than its batch the padding enters the receptive
+    field. Same-size batches (no padding) give the same features either way, and
+    --image-batch-size 1 matches the store exactly.
+    """
+    def __init__(self, body: torch.nn.Module, store: EmbeddingStore):
+        super().__init__()
+        self.body = body
+        self.store = store
+        # per thread, so predictor replicas can share the model
+        self._local = threading.local()
+
+    @property
+    def keys(self) -> Optional[List[str]]:
+        return getattr(self._local, "keys", None)
+
+    @keys.setter
+    def keys(self, keys: Optional[List[str]]):
+        self._local.keys = keys
+
+    def forward(self, tensor_list: NestedTensor):
+        if self.keys is None:
+            return self.body(tensor_list)
+
+        tensors, mask = tensor_list.decompose()
+        per_image = []
+        for i, key in enumerate(self.keys):
+            features = self.store.load(key, "grounding_dino")
+            if features is None:
+                valid = ~mask[i]
+                h = int(valid.any(dim=1).sum())
+                w = int(valid.any(dim=0).sum())
+                out = self.body(NestedTensor(tensors[i:i + 1, :, :h, :w], mask[i:i + 1, :h, :w]))
+                features = OrderedDict((name, x.tensors[0]) for name, x in out.items())
+                features = OrderedDict(self.store.save(key, "grounding_dino", features))
+            else:
+                features = OrderedDict(
+                    (name, x.to(tensors.device))
+                    for name, x in sorted(features.items(), key=lambda item: int(item[0]))
+                )
+            per_image.append(features)
+
+        out = OrderedDict()
+        for name in per_image[0]:
+            level = [features[name] for features in per_image]
+            height = max(x.shape[-2] for x in level)
+            width = max(x.shape[-1] for x in level)
+
+            batch = level[0].new_zeros((len(level), level[0].shape[0], height, width))
+            batch_mask = torch.ones((len(level), height, width), dtype=torch.bool, device=batch.device)
+            for b, x in enumerate(level):
+                batch[b, :, :x.shape[-2], :x.shape[-1]] = x
+                batch_mask[b, :x.shape[-2], :x.shape[-1]] = False
+            out[name] = NestedTensor(batch, batch_mask)
+        return out
@@ -1,12 +1,101 @@
 import cv2
+import os
 import json
 import datetime
+import threading
 from typing import List
 import numpy as np
 from typing import Dict, Any
 from pathlib import Path
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from PIL import Image
+from . import mask_utils
+
+VOID_INDEX = 255
+VOID_COLOR = (224, 224, 192)
+
+# same layout minidom's toprettyxml(indent="    ") produced for the ElementTree version
+VOC_ANNOTATION_TEMPLATE = """<?xml version="1.0" ?>
+<annotation>
+    <folder>images</folder>
+    <filename>{filename}</filename>
+    <source>
+        <database>Unknown</database>
+    </source>
+    <size>
+        <width>{width}</width>
+        <height>{height}</height>
+        <depth>3</depth>
+    </size>
+    <segmented>0</segmented>
+{objects}</annotation>
+"""
+
+VOC_OBJECT_TEMPLATE = """    <object>
+        <name>{name}</name>
+        <pose>Unspecified</pose>
+        <truncated>0</truncated>
+        <difficult>0</difficult>
+        <bndbox>
+            <xmin>{xmin}</xmin>
+            <ymin>{ymin}</ymin>
+            <xmax>{xmax}</xmax>
+            <ymax>{ymax}</ymax>
+        </bndbox>
+{attributes}    </object>
+"""
+
+# CVAT-style object attributes, written for sequence results
+VOC_TRACK_TEMPLATE = """        <attributes>
+            <attribute>
+                <name>track_id</name>
+                <value>{track_id}</value>
+            </attribute>
+        </attributes>
+"""
+
+def _xml_text(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class MaskGeometry:
+    """
+    Data derived from one result's masks: bounding-box crops, largest external contours and RLEs.
+    Each is computed on first use and kept on the result, so every exporter it is sent to shares it.
+    """
+    def __init__(self, masks):
+        self.masks = masks
+        self._crops = {}
+        self._contours = {}
+        self._rles = {}
+
+    @classmethod
+    def of(cls, result: Dict[str, Any]) -> "MaskGeometry":
+        geometry = result.get("geometry")
+        if geometry is None:
+            geometry = result["geometry"] = cls(result["masks"])
+        return geometry
+
+    def crop(self, i: int):
+        if i not in self._crops:
+            self._crops[i] = mask_utils.crop_mask(self.masks[i])
+        return self._crops[i]
+
+    def contour(self, i: int):
+        """Largest external contour in image coordinates, or None for an empty mask."""
+        if i not in self._contours:
+            contour = None
+            crop, x0, y0 = self.crop(i)
+            if crop.size:
+                contours, _ = cv2.findContours(np.ascontiguousarray(crop, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+                if contours:
+                    contour = max(contours, key=cv2.contourArea)
+            self._contours[i] = contour
+        return self._contours[i]
+
+    def rle(self, i: int) -> Dict[str, Any]:
+        if i not in self._rles:
+            self._rles[i] = mask_utils.encode_rle(self.masks[i])
+        return self._rles[i]
+
 
 class BaseExporter:
     def __init__(self, input_dir: str):
@@ -14,7 +103,10 @@ class BaseExporter:
         self.input_dir.mkdir(parents=True, exist_ok=True)    
     
 class COCOExporter:
-    def __init__(self, categories: List[str], output_path: str):
+    def __init__(self, categories: List[str], output_path: str, seg_encoding: str = "polygon"):
+        if seg_encoding not in ("polygon", "rle"):
+            raise ValueError(f"Unknown segmentation encoding: {seg_encoding}")
+        self.seg_encoding = seg_encoding
         self.output_path = Path(output_path)
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
         
@@ -40,69 +132,171 @@ class COCOExporter:
             })
 
         self.annotation_id = 1
+        self._lock = threading.Lock()
+
+    def add(self, result: Dict[str, Any], task: str = 'detection') -> Dict[str, Any]:
+        record = self.encode(result, task)
+        self.add_record(record)
+        return record
 
-    def add(self, result: Dict[str, Any], task: str = 'detection'):
+    def encode(self, result: Dict[str, Any], task: str = 'detection') -> Dict[str, Any]:
+        """Build the image entry and its annotations without assigning ids."""
         image_path = Path(result["image_path"])
         height, width = result["image_shape"]
 
-        image_id = len(self.coco_format["images"]) + 1
-        
-        self.coco_format["images"].append({
-            "id": image_id,
+        image_info = {
             "file_name": image_path.name,
-            "height": height,
-            "width": width,
+            "height": int(height),
+            "width": int(width),
             "date_captured": datetime.datetime.now().isoformat()
-        })
+        }
 
-        for label, mask in zip(result["labels"], result["masks"]):
+        # sequence mode tags every object with a track id that is stable across frames
+        track_ids = result.get("track_ids") or [None] * len(result["labels"])
+        geometry = MaskGeometry.of(result)
+
+        annotations = []
+        for i, (label, track_id) in enumerate(zip(result["labels"], track_ids)):
             clean_label = label.strip()
             category_id = self.class_map.get(clean_label)
             
             if category_id is None:
                 continue
 
-            mask_uint8 = mask.astype(np.uint8)
-            contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if not contours:
-                continue
-                
-            c = max(contours, key=cv2.contourArea)
-            area = float(cv2.contourArea(c))
-            
-            x, y, w, h = cv2.boundingRect(c)
-            bbox = [float(x), float(y), float(w), float(h)]
-            
-            segmentation = []
-            if task == 'segmentation':
-                poly = c.flatten().tolist()
-                if len(poly) >= 6:
-                    segmentation = [poly]
-                else:
+            if task == 'detection':
+                # the detector's box as is, so bbox-only exports never need masks
+                x1, y1, x2, y2 = (float(v) for v in result["boxes"][i])
+                bbox = [x1, y1, x2 - x1, y2 - y1]
+                area = bbox[2] * bbox[3]
+                if area <= 0:
                     continue
-            else:
                 segmentation = []
-            
-            self.coco_format["annotations"].append({
-                "id": self.annotation_id,
-                "image_id": image_id,
+            elif self.seg_encoding == "rle":
+                # lossless: keeps holes and disconnected parts
+                rle = geometry.rle(i)
+                area = float(mask_utils.rle_area(rle))
+                if area == 0:
+                    continue
+                bbox = mask_utils.rle_to_bbox(rle)
+                segmentation = rle
+            else:
+                segmentation, area, bbox = self._polygon(geometry.contour(i), task)
+                if segmentation is None:
+                    continue
+
+            annotation = {
                 "category_id": category_id,
                 "segmentation": segmentation,
                 "area": area,
                 "bbox": bbox,
                 "iscrowd": 0
-            })
-            
-            self.annotation_id += 1
+            }
+            if track_id is not None:
+                annotation["attributes"] = {"track_id": int(track_id)}
+            annotations.append(annotation)
+
+        return {"image": image_info, "annotations": annotations}
+
+    def _polygon(self, contour, task):
+        if contour is None:
+            return None, 0.0, None
+
+        area = float(cv2.contourArea(contour))
+
+        x, y, w, h = cv2.boundingRect(contour)
+        bbox = [float(x), float(y), float(w), float(h)]
+
+        segmentation = []
+        if task == 'segmentation':
+            poly = contour.flatten().tolist()
+            if len(poly) < 6:
+                return None, area, bbox
+            segmentation = [poly]
+
+        return segmentation, area, bbox
+
+    def add_record(self, record: Dict[str, Any]):
+        with self._lock:
+            image_id = len(self.coco_format["images"]) + 1
+            self.coco_format["images"].append({"id": image_id, **record["image"]})
+
+            for annotation in record["annotations"]:
+                self.coco_format["annotations"].append({
+                    "id": self.annotation_id,
+                    "image_id": image_id,
+                    **annotation
+                })
+                self.annotation_id += 1
 
     def save(self):
-        with open(self.output_path, "w") as f:
+        tmp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
             json.dump(self.coco_format, f, indent=4)
+        os.replace(tmp_path, self.output_path)
+        print(f"[COCO] Saved annotations to {self.output_path}")
+
+class StreamingCOCOExporter(COCOExporter):
+    """
+    COCOExporter that spills images and annotations to JSONL files as they arrive
+    and assembles a compact instances.json in one streaming pass on save(),
+    so memory stays flat regardless of dataset size.
+    """
+    def __init__(self, categories: List[str], output_path: str, seg_encoding: str = "polygon"):
+        super().__init__(categories, output_path, seg_encoding)
+        self.image_id = 1
+
+        self.images_spill = self.output_path.with_name(self.output_path.name + ".images.jsonl")
+        self.annotations_spill = self.output_path.with_name(self.output_path.name + ".annotations.jsonl")
+        self._images_file = open(self.images_spill, "w")
+        self._annotations_file = open(self.annotations_spill, "w")
+
+    def add_record(self, record: Dict[str, Any]):
+        with self._lock:
+            image_id = self.image_id
+            self.image_id += 1
+            self._images_file.write(self._dumps({"id": image_id, **record["image"]}) + "\n")
+
+            for annotation in record["annotations"]:
+                self._annotations_file.write(self._dumps({
+                    "id": self.annotation_id,
+                    "image_id": image_id,
+                    **annotation
+                }) + "\n")
+                self.annotation_id += 1
+
+    @staticmethod
+    def _dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+    def _copy_spill(self, out, spill_path):
+        with open(spill_path, "r") as f:
+            for i, line in enumerate(f):
+                if i:
+                    out.write(",")
+                out.write(line.rstrip("\n"))
+
+    def save(self):
+        with self._lock:
+            self._images_file.close()
+            self._annotations_file.close()
+
+            tmp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+            with open(tmp_path, "w") as out:
+                out.write('{"info":' + self._dumps(self.coco_format["info"]))
+                out.write(',"licenses":' + self._dumps(self.coco_format["licenses"]))
+                out.write(',"images":[')
+                self._copy_spill(out, self.images_spill)
+                out.write('],"annotations":[')
+                self._copy_spill(out, self.annotations_spill)
+                out.write('],"categories":' + self._dumps(self.coco_format["categories"]) + "}")
+            os.replace(tmp_path, self.output_path)
+
+            self.images_spill.unlink()
+            self.annotations_spill.unlink()
         print(f"[COCO] Saved annotations to {self.output_path}")
 
 class PascalVOCExporter(BaseExporter):
-    def __init__(self, input_dir: str):
+    def __init__(self, input_dir: str, flush_every: int = 1000):
         super().__init__(input_dir)
         self.xml_dir = self.input_dir / "Annotations"
         self.xml_dir.mkdir(parents=True, exist_ok=True)
@@ -128,6 +322,11 @@ class PascalVOCExporter(BaseExporter):
 
         self.processed_files = set()
         self.processed_seg_files = set()
+        self._lock = threading.Lock()
+
+        # ImageSets lines are buffered and appended every flush_every images, on flush() and on close()
+        self.flush_every = flush_every
+        self._pending = {self.list_file: [], self.segmentation_list_file: []}
 
     def save(self, result: Dict[str, Any], class_id_map: Dict[str, int], colormap: list = None, task: str = "detection"):
         if task == "detection":
@@ -139,82 +338,102 @@ class PascalVOCExporter(BaseExporter):
         else:
             raise ValueError(f"Unknown task: {task}")
 
+    def mark_done(self, stem: str, task: str):
+        """Add an image to the ImageSets list for the task, e.g. when restoring from a journal."""
+        if task == "detection":
+            list_file, processed = self.list_file, self.processed_files
+        else:
+            list_file, processed = self.segmentation_list_file, self.processed_seg_files
+
+        with self._lock:
+            if stem not in processed:
+                processed.add(stem)
+                self._pending[list_file].append(stem)
+                if len(self._pending[list_file]) >= self.flush_every:
+                    self._flush_list(list_file)
+
+    def _flush_list(self, list_file: Path):
+        stems = self._pending[list_file]
+        if stems:
+            with open(list_file, "a") as f:
+                f.write("".join(f"{stem}\n" for stem in stems))
+            stems.clear()
+
+    def flush(self):
+        with self._lock:
+            for list_file in self._pending:
+                self._flush_list(list_file)
+
+    def close(self):
+        self.flush()
+
     def _save_xml(self, result: Dict[str, Any], class_id_map: Dict[str, int]):
         img_path = Path(result["image_path"])
         xml_path = self.xml_dir / f"{img_path.stem}.xml"
         height, width = result["image_shape"]
 
-        annotation = ET.Element('annotation')
-        
-        ET.SubElement(annotation, 'folder').text = 'images'
-        ET.SubElement(annotation, 'filename').text = img_path.name
-        
-        source = ET.SubElement(annotation, 'source')
-        ET.SubElement(source, 'database').text = 'Unknown'
-
-        size = ET.SubElement(annotation, 'size')
-        ET.SubElement(size, 'width').text = str(width)
-        ET.SubElement(size, 'height').text = str(height)
-        ET.SubElement(size, 'depth').text = '3'
+        track_ids = result.get("track_ids") or [None] * len(result["labels"])
 
-        ET.SubElement(annotation, 'segmented').text = '0'
-
-        for label, box in zip(result["labels"], result["boxes"]):
+        objects = []
+        for label, box, track_id in zip(result["labels"], result["boxes"], track_ids):
             clean_label = label.strip()
             if clean_label not in class_id_map:
                 continue
 
             x1, y1, x2, y2 = box
-            
-            obj = ET.SubElement(annotation, 'object')
-            ET.SubElement(obj, 'name').text = clean_label
-            ET.SubElement(obj, 'pose').text = 'Unspecified'
-            ET.SubElement(obj, 'truncated').text = '0'
-            ET.SubElement(obj, 'difficult').text = '0'
-
-            bndbox = ET.SubElement(obj, 'bndbox')
-            ET.SubElement(bndbox, 'xmin').text = str(int(x1))
-            ET.SubElement(bndbox, 'ymin').text = str(int(y1))
-            ET.SubElement(bndbox, 'xmax').text = str(int(x2))
-            ET.SubElement(bndbox, 'ymax').text = str(int(y2))
-
-        xml_str = minidom.parseString(ET.tostring(annotation)).toprettyxml(indent="    ")
+            objects.append(VOC_OBJECT_TEMPLATE.format(
+                name=_xml_text(clean_label),
+                xmin=int(x1), ymin=int(y1), xmax=int(x2), ymax=int(y2),
+                attributes="" if track_id is None else VOC_TRACK_TEMPLATE.format(track_id=int(track_id))
+            ))
+
+        xml_str = VOC_ANNOTATION_TEMPLATE.format(
+            filename=_xml_text(img_path.name),
+            width=width, height=height,
+            objects="".join(objects)
+        )
         with open(xml_path, "w") as f:
             f.write(xml_str)
         
-        if img_path.stem not in self.processed_files:
-            with open(self.list_file, "a") as f:
-                f.write(f"{img_path.stem}\n")
-            self.processed_files.add(img_path.stem)
+        self.mark_done(img_path.stem, "detection")
 
     def _save_mask(self, result: Dict[str, Any], class_id_map: Dict[str, int], colormap: list):
         img_path = Path(result["image_path"])
         png_path = self.seg_dir / f"{img_path.stem}.png"
         
         height, width = result["image_shape"]
-        seg_map = np.zeros((height, width, 3), dtype=np.uint8)
-
-        void_color_rgb = [224, 224, 192] 
-        void_color_bgr = void_color_rgb[::-1]
-        kernel = np.ones((3, 3), np.uint8)
-
-        for label, mask in zip(result["labels"], result["masks"]):
-            clean_label = label.strip()
-            class_id = class_id_map.get(clean_label, -1)
-            
-            if class_id > 0 and class_id < len(colormap):
-                color_rgb = colormap[class_id]
-                color_bgr = color_rgb[::-1]
-
-                mask_uint8 = mask.astype(np.uint8)
-
-                dilated_mask = cv2.dilate(mask_uint8, kernel, iterations=20)
-                seg_map[dilated_mask.astype(bool)] = void_color_bgr
-
-                seg_map[mask.astype(bool)] = color_bgr
-
-        cv2.imwrite(str(png_path), seg_map)
-        if img_path.stem not in self.processed_seg_files:
-            with open(self.segmentation_list_file, "a") as f:
-                f.write(f"{img_path.stem}\n")
-            self.processed_seg_files.add(img_path.stem)
+        if len(colormap) > VOID_INDEX:
+            raise ValueError(f"Colormap has {len(colormap)} entries; palette index {VOID_INDEX} is reserved for void.")
+
+        # label image holding 1 + the index of the last mask drawn at each pixel
+        labels = np.zeros((height, width), dtype=np.uint16)
+        class_ids = [0]
+        geometry = MaskGeometry.of(result)
+        for i, label in enumerate(result["labels"]):
+            class_id = class_id_map.get(label.strip(), -1)
+            if not (class_id > 0 and class_id < len(colormap)):
+                continue
+            crop, x0, y0 = geometry.crop(i)
+            if crop.size == 0:
+                continue
+            class_ids.append(class_id)
+            labels[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]][crop] = len(class_ids) - 1
+
+        # masks are drawn in order, each as a 20px void border followed by its class pixels,
+        # so a pixel belongs to the last mask whose border reaches it: a 41x41 max filter of
+        # the label image. It takes that mask's class if it lies inside the mask, else void.
+        seg_map = np.zeros((height, width), dtype=np.uint8)
+        if len(class_ids) > 1:
+            nearest = cv2.dilate(labels, np.ones((41, 41), np.uint8))
+            class_lut = np.asarray(class_ids, dtype=np.uint8)
+            seg_map = np.where(labels == nearest, class_lut[labels], VOID_INDEX).astype(np.uint8)
+            seg_map[nearest == 0] = 0
+
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        palette[1:len(colormap)] = np.asarray(colormap[1:], dtype=np.uint8).reshape(-1, 3)
+        palette[VOID_INDEX] = VOID_COLOR
+
+        image = Image.fromarray(seg_map)
+        image.putpalette(palette.ravel().tolist())
+        image.save(png_path)
+        self.mark_done(img_path.stem, "segmentation")
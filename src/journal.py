@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+from .cache import settings_hash
+
+
+class Journal:
+    """
+    Append-only JSONL log of finished images.
+    Each line is written and flushed as soon as an image is exported, so a killed run
+    can be resumed from the journal and loses at most the images still in flight.
+    The first line holds a hash of the run settings; resuming with different settings is refused.
+    Once the exporters have saved, remove() deletes it so finished datasets do not keep a second copy.
+    """
+    def __init__(self, path: str, resume: bool = False, sync_every: int = 1, settings: Optional[Dict[str, Any]] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.sync_every = max(1, sync_every)
+        self.settings_hash = settings_hash(settings or {})
+
+        self.done = set()
+        if resume and self.path.exists() and self.path.stat().st_size:
+            self._recover()
+        else:
+            self.path.write_text(json.dumps({"settings": self.settings_hash}) + "\n")
+
+        self._file = open(self.path, "a")
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+    @staticmethod
+    def key(image_path) -> str:
+        return str(Path(image_path).resolve())
+
+    def __contains__(self, image_path) -> bool:
+        return self.key(image_path) in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def _recover(self):
+        # a crash can leave a partial last line; keep everything before it
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            try:
+                recorded = json.loads(header).get("settings") if header.endswith(b"\n") else None
+            except (ValueError, AttributeError):
+                recorded = None
+            if recorded != self.settings_hash:
+                raise ValueError(
+                    f"{self.path} was written with different settings (classes, thresholds, models or outputs). "
+                    "Rerun without --resume to start over."
+                )
+
+            valid_size = len(header)
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.done.add(entry["image_path"])
+                valid_size += len(line)
+
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_size)
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            self._file.flush()
+        with open(self.path, "r") as f:
+            f.readline()  # settings header
+            for line in f:
+                yield json.loads(line)
+
+    def append(self, image_path, record: Dict[str, Any]):
+        line = json.dumps({"image_path": self.key(image_path), **record}, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.done.add(self.key(image_path))
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
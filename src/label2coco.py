@@ -1,43 +1,116 @@
 import argparse
 import yaml
-from tqdm import tqdm
 from pathlib import Path
 from . import exporters
-from .GroundedSAM2Predictor import GroundedSAM2Predictor as Predictor
+from .cache import ResultCache, add_cache_args, inference_settings
+from .cpu_profile import add_cpu_args
+from .journal import Journal
+from .manifest import DatasetManifest, add_manifest_args
+from .pipeline import AnnotationPipeline, add_pipeline_args
+from .profiler import add_trace_args
+from .sequence import add_sequence_args
+from .server import add_server_args
+from .startup import add_model_args, build_predictor, predictor_outputs, validate_args
+from .shard import LeaseQueue, add_queue_args
 
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-dir', default=None, help="Directory path containing images")
-    parser.add_argument('--sam2-checkpoint', default="Grounded-SAM-2/checkpoints/sam2.1_hiera_large.pt")
-    parser.add_argument('--sam2-model-config', default="configs/sam2.1/sam2.1_hiera_l.yaml")
-    parser.add_argument('--grounding-dino-config', default="Grounded-SAM-2/grounding_dino/groundingdino/config/GroundingDINO_SwinT_OGC.py")
-    parser.add_argument('--grounding-dino-checkpoint', default="Grounded-SAM-2/gdino_checkpoints/groundingdino_swint_ogc.pth")
-    parser.add_argument('--box-threshold', type=float, default=0.35)
-    parser.add_argument('--text-threshold', type=float, default=0.35)
-    parser.add_argument('--device', default="cuda")
+    parser.add_argument('--img-path', default=None, help="Single image path (used when --input-dir is not given)")
+    parser.add_argument('--output-dir', default=None, help="Directory for instances.json (default: <input-dir>/annotations)")
     parser.add_argument('--dump-json-results', action="store_true")
-    parser.add_argument('--multimask-output', action="store_true")
-    parser.add_argument('--batch-size', type=int, default=1)
+    add_model_args(parser)
 
     parser.add_argument('--coco-config', type=str, default="configs/coco.yaml")
     parser.add_argument('--segmentation', action='store_true', help="Enable segmentation output for COCO format.")
-    
+    parser.add_argument('--seg-encoding', choices=["polygon", "rle"], default="polygon", help="Segmentation format: largest external contour polygon or lossless compressed RLE.")
+    parser.add_argument('--streaming', action='store_true', help="Spill annotations to disk and write a compact instances.json with bounded memory.")
+    add_pipeline_args(parser)
+    add_queue_args(parser)
+    add_cache_args(parser)
+    add_trace_args(parser)
+    add_sequence_args(parser)
+    add_server_args(parser)
+    add_cpu_args(parser)
+    add_manifest_args(parser)
+
     return parser
 
+def annotate(args, predictor, image_files, exporter, classes, journal=None, cache=None):
+    def export(result):
+        # segmentation annotations carry the bbox too, so each image is added once
+        records = [exporter.add(result, task='segmentation' if args.segmentation else 'detection')]
+        if journal is not None:
+            journal.append(result["image_path"], {"records": records})
+
+    if args.sequence:
+        from .sequence import SequenceAnnotator
+
+        # frames in order; the per-image pipeline and result cache do not apply
+        SequenceAnnotator.from_args(predictor, args).run(
+            image_files,
+            export,
+            classes=classes,
+            batch_size=args.batch_size,
+            compact_masks=args.compact_masks
+        )
+        return
+
+    pipeline = AnnotationPipeline.from_args(predictor, export, args, cache=cache)
+    pipeline.run(
+        image_files,
+        image_batch_size=args.image_batch_size,
+        classes=classes,
+        batch_size=args.batch_size,
+        multimask_output=args.multimask_output,
+        compact_masks=args.compact_masks
+    )
+
+def run_queue_worker(args, image_files, classes, manifest=None):
+    # each claimed chunk becomes <output-dir>/parts/chunk_NNNNN.json; combine them with src.merge
+    queue = LeaseQueue.from_args(args).create(image_files, args.chunk_size)
+    parts_dir = args.output_dir / "parts"
+    exporter_cls = exporters.StreamingCOCOExporter if args.streaming else exporters.COCOExporter
+    outputs = predictor_outputs(args, needs_masks=args.segmentation)
+    predictor = build_predictor(args, outputs, image_files, classes, manifest)
+    cache = ResultCache.from_args(args, classes, outputs, manifest=manifest)
+
+    for chunk_name, chunk_files in queue.claim_all():
+        print(f"[{queue.worker_id}] Processing {chunk_name} ({len(chunk_files)} images)")
+        exporter = exporter_cls(
+            categories=classes,
+            output_path=str(parts_dir / f"{chunk_name}.json"),
+            seg_encoding=args.seg_encoding
+        )
+        annotate(args, predictor, [Path(f) for f in chunk_files], exporter, classes, cache=cache)
+        with predictor.tracer.span("save", chunk=chunk_name):
+            exporter.save()
+
+    if cache is not None:
+        cache.report()
+    predictor.tracer.close()
+
+    print(f"All chunks done. Merge with: python -m src.merge --format coco --inputs {parts_dir} --output {args.output_dir / 'instances.json'}")
+    return parts_dir
+
 def run_inference(args):
-    args.output_dir = Path(args.output_dir)
-    args.output_dir.mkdir(parents=True, exist_ok=True)
+    validate_args(args)
 
     image_files = []
+    manifest = None
 
     if args.input_dir:
-        input_path = Path(args.input_dir) / "images"
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-            image_files.extend(input_path.glob(ext))
+        manifest = DatasetManifest.from_args(args, args.input_dir)
+        image_files = manifest.images("images")
     elif args.img_path:
         image_files.append(Path(args.img_path))
     else:
         raise ValueError("Either --input-dir or --img-path must be specified.")
+
+    if args.output_dir is None:
+        args.output_dir = Path(args.input_dir or Path(args.img_path).parent) / "annotations"
+    args.output_dir = Path(args.output_dir)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
     
     try:
         coco_data = yaml.safe_load(open(args.coco_config, 'r'))
@@ -58,44 +131,53 @@ def run_inference(args):
     except Exception as e:
         raise ValueError(f"Error loading COCO config file: {e}")
 
-    predictor = Predictor(
-        sam2_model_config=args.sam2_model_config,
-        sam2_checkpoint=args.sam2_checkpoint,
-        grounding_dino_config=args.grounding_dino_config,
-        grounding_dino_checkpoint=args.grounding_dino_checkpoint,
-        device=args.device,
-        box_threshold=args.box_threshold,
-        text_threshold=args.text_threshold
-    )
-
+    if args.queue_dir:
+        if args.sequence:
+            raise ValueError("--sequence cannot be combined with --queue-dir: a sequence is tracked by one worker.")
+        return run_queue_worker(args, image_files, COCO_CLASSES, manifest)
 
     json_path = args.output_dir / "instances.json"
 
-    exporter = exporters.COCOExporter(
+    outputs = predictor_outputs(args, needs_masks=args.segmentation)
+
+    # opened before the exporter so a refused --resume leaves the previous outputs alone
+    settings = {
+        **inference_settings(args, COCO_CLASSES, outputs),
+        "task": "segmentation" if args.segmentation else "detection",
+        "seg_encoding": args.seg_encoding,
+    }
+    journal = Journal(args.output_dir / "journal.jsonl", resume=args.resume, sync_every=args.image_batch_size, settings=settings)
+
+    exporter_cls = exporters.StreamingCOCOExporter if args.streaming else exporters.COCOExporter
+    exporter = exporter_cls(
         categories=COCO_CLASSES,
-        output_path=str(json_path)
+        output_path=str(json_path),
+        seg_encoding=args.seg_encoding
     )
+    for entry in journal.replay():
+        for record in entry["records"]:
+            exporter.add_record(record)
+    if len(journal):
+        print(f"Resuming: {len(journal)} images already annotated")
+        image_files = [img_file for img_file in image_files if img_file not in journal]
+
+    predictor = build_predictor(args, outputs, image_files, COCO_CLASSES, manifest)
+    cache = ResultCache.from_args(args, COCO_CLASSES, outputs, manifest=manifest)
 
     print("Processing images...")
 
-    for img_file in tqdm(image_files):
-        try:
-            result = predictor.predict(
-                image_path=str(img_file),
-                classes=COCO_CLASSES,
-                batch_size=args.batch_size,
-                multimask_output=args.multimask_output
-            )
-
-            exporter.add(result, task='detection')
-            if args.segmentation:
-                exporter.add(result, task='segmentation')
-            
-        except Exception as e:
-            print(f"Error processing {img_file.name}: {e}")
-            continue
-
-    exporter.save()
+    try:
+        annotate(args, predictor, image_files, exporter, COCO_CLASSES, journal, cache)
+    finally:
+        journal.close()
+
+    if cache is not None:
+        cache.report()
+
+    with predictor.tracer.span("save"):
+        exporter.save()
+    journal.remove()
+    predictor.tracer.close()
     print(f"COCO annotations saved to {json_path}")
     return json_path
 
@@ -0,0 +1,177 @@
+import argparse
+import yaml
+from pathlib import Path
+from . import exporters
+from .cache import ResultCache, add_cache_args, inference_settings
+from .cpu_profile import add_cpu_args
+from .journal import Journal
+from .manifest import DatasetManifest, add_manifest_args
+from .pipeline import AnnotationPipeline, add_pipeline_args
+from .profiler import add_trace_args
+from .sequence import add_sequence_args
+from .server import add_server_args
+from .startup import add_model_args, build_predictor, predictor_outputs, validate_args
+
+# COCO formats get their own instances file; VOC formats write into the dataset directory like label2pascal
+COCO_FORMATS = {"coco-det": ("detection", "instances_det.json"), "coco-seg": ("segmentation", "instances_seg.json")}
+VOC_FORMATS = {"voc-xml": "detection", "voc-mask": "segmentation"}
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Run the models once per image and write any set of COCO and Pascal VOC outputs")
+    parser.add_argument('--input-dir', default=None, help="Dataset directory; images are read from <input-dir>/images, or <input-dir>/JPEGImages if there is none")
+    parser.add_argument('--img-path', default=None, help="Single image path (used when --input-dir is not given)")
+    parser.add_argument('--output-dir', default=None, help="Directory for the COCO instances files (default: <input-dir>/annotations)")
+    parser.add_argument('--formats', nargs='+', choices=[*COCO_FORMATS, *VOC_FORMATS], default=["coco-det"], help="Outputs to write from each result")
+    add_model_args(parser)
+
+    parser.add_argument('--coco-config', type=str, default="configs/coco.yaml", help="Classes when only COCO formats are written")
+    parser.add_argument('--pascal-config', type=str, default="configs/pascal_voc.yaml", help="Classes and colormap when a VOC format is written")
+    parser.add_argument('--seg-encoding', choices=["polygon", "rle"], default="polygon", help="COCO segmentation format: largest external contour polygon or lossless compressed RLE.")
+    parser.add_argument('--streaming', action='store_true', help="Spill COCO annotations to disk and write compact instances files with bounded memory.")
+    add_pipeline_args(parser)
+    add_cache_args(parser)
+    add_trace_args(parser)
+    add_sequence_args(parser)
+    add_server_args(parser)
+    add_cpu_args(parser)
+    add_manifest_args(parser)
+
+    return parser
+
+def load_classes(args):
+    """Inference classes, plus the VOC id map and colormap (None when no VOC format is written)."""
+    if any(fmt in VOC_FORMATS for fmt in args.formats):
+        try:
+            pascal_data = yaml.safe_load(open(args.pascal_config, 'r'))
+        except Exception as e:
+            raise ValueError(f"Error loading Pascal VOC config file: {e}")
+        names = [item['name'] for item in pascal_data['colors']]
+        id_map = {name: i + 1 for i, name in enumerate(names)}
+        colormap = [tuple(item['rgb']) for item in pascal_data['colors']]
+        print(f"Loaded {len(names)} classes from {args.pascal_config}")
+        return [name for name in names if name != 'background'], id_map, colormap
+
+    try:
+        raw_names = yaml.safe_load(open(args.coco_config, 'r')).get('names')
+    except Exception as e:
+        raise ValueError(f"Error loading COCO config file: {e}")
+    if isinstance(raw_names, dict):
+        classes = [raw_names[i] for i in range(len(raw_names))]
+    elif isinstance(raw_names, list) and raw_names:
+        classes = raw_names
+    else:
+        raise ValueError(f"'names' in {args.coco_config} must be a non-empty list or dict.")
+    print(f"Loaded {len(classes)} classes from {args.coco_config}")
+    return classes, None, None
+
+def annotate(args, predictor, image_files, export, classes, cache=None):
+    if args.sequence:
+        from .sequence import SequenceAnnotator
+
+        # frames in order; the per-image pipeline and result cache do not apply
+        SequenceAnnotator.from_args(predictor, args).run(
+            image_files,
+            export,
+            classes=classes,
+            batch_size=args.batch_size,
+            compact_masks=args.compact_masks
+        )
+        return
+
+    pipeline = AnnotationPipeline.from_args(predictor, export, args, cache=cache)
+    pipeline.run(
+        image_files,
+        image_batch_size=args.image_batch_size,
+        classes=classes,
+        batch_size=args.batch_size,
+        multimask_output=args.multimask_output,
+        compact_masks=args.compact_masks
+    )
+
+def run_inference(args):
+    validate_args(args)
+
+    image_files = []
+    manifest = None
+    if args.input_dir:
+        manifest = DatasetManifest.from_args(args, args.input_dir)
+        image_files = manifest.images("images" if (Path(args.input_dir) / "images").is_dir() else "JPEGImages")
+    elif args.img_path:
+        image_files.append(Path(args.img_path))
+    else:
+        raise ValueError("Either --input-dir or --img-path must be specified.")
+
+    dataset_dir = Path(args.input_dir or Path(args.img_path).parent)
+    args.output_dir = Path(args.output_dir or dataset_dir / "annotations")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    classes, class_id_map, colormap = load_classes(args)
+
+    outputs = predictor_outputs(args, needs_masks=any(fmt in ("coco-seg", "voc-mask") for fmt in args.formats))
+
+    # opened before the exporters so a refused --resume leaves the previous outputs alone
+    settings = {
+        **inference_settings(args, classes, outputs),
+        "formats": sorted(args.formats),
+        "seg_encoding": args.seg_encoding,
+        "colormap": colormap,
+    }
+    journal = Journal(args.output_dir / "journal.jsonl", resume=args.resume, sync_every=args.image_batch_size, settings=settings)
+
+    exporter_cls = exporters.StreamingCOCOExporter if args.streaming else exporters.COCOExporter
+    coco_exporters = {
+        fmt: exporter_cls(categories=classes, output_path=str(args.output_dir / filename), seg_encoding=args.seg_encoding)
+        for fmt, (_, filename) in COCO_FORMATS.items() if fmt in args.formats
+    }
+    voc_tasks = [task for fmt, task in VOC_FORMATS.items() if fmt in args.formats]
+    voc_exporter = exporters.PascalVOCExporter(input_dir=str(dataset_dir)) if voc_tasks else None
+    for entry in journal.replay():
+        for fmt, record in entry["records"].items():
+            if fmt in coco_exporters:
+                coco_exporters[fmt].add_record(record)
+        if voc_exporter is not None:
+            for task in entry["tasks"]:
+                voc_exporter.mark_done(entry["stem"], task)
+    if len(journal):
+        print(f"Resuming: {len(journal)} images already annotated")
+        image_files = [img_file for img_file in image_files if img_file not in journal]
+
+    def export(result):
+        # every exporter gets the same result, so mask contours, RLEs and crops are derived once
+        records = {
+            fmt: exporter.add(result, task=COCO_FORMATS[fmt][0])
+            for fmt, exporter in coco_exporters.items()
+        }
+        for task in voc_tasks:
+            voc_exporter.save(result, class_id_map=class_id_map, colormap=colormap, task=task)
+        journal.append(result["image_path"], {"stem": Path(result["image_path"]).stem, "records": records, "tasks": voc_tasks})
+
+    predictor = build_predictor(args, outputs, image_files, classes, manifest)
+    cache = ResultCache.from_args(args, classes, outputs, manifest=manifest)
+
+    print(f"Processing images for {', '.join(args.formats)}...")
+    try:
+        annotate(args, predictor, image_files, export, classes, cache)
+    finally:
+        if voc_exporter is not None:
+            voc_exporter.close()
+        journal.close()
+
+    if cache is not None:
+        cache.report()
+
+    with predictor.tracer.span("save"):
+        for exporter in coco_exporters.values():
+            exporter.save()
+    journal.remove()
+    predictor.tracer.close()
+    if voc_exporter is not None:
+        print(f"Pascal VOC annotations saved to {dataset_dir}")
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    run_inference(args)
+
+if __name__ == "__main__":
+    main()
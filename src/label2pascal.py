@@ -1,29 +1,105 @@
 import yaml
 import argparse
-from tqdm import tqdm
 from pathlib import Path
 from . import exporters
-from .GroundedSAM2Predictor import GroundedSAM2Predictor as Predictor
+from .cache import ResultCache, add_cache_args, inference_settings
+from .cpu_profile import add_cpu_args
+from .journal import Journal
+from .manifest import DatasetManifest, add_manifest_args
+from .pipeline import AnnotationPipeline, add_pipeline_args
+from .profiler import add_trace_args
+from .sequence import add_sequence_args
+from .server import add_server_args
+from .startup import add_model_args, build_predictor, predictor_outputs, validate_args
+from .shard import LeaseQueue, add_queue_args
 
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-dir', default=None, help="Directory path containing images")
-    parser.add_argument('--sam2-checkpoint', default="/home/appuser/Grounded-SAM-2/checkpoints/sam2.1_hiera_large.pt")
-    parser.add_argument('--sam2-model-config', default="configs/sam2.1/sam2.1_hiera_l.yaml")
-    parser.add_argument('--grounding-dino-config', default="/home/appuser/Grounded-SAM-2/grounding_dino/groundingdino/config/GroundingDINO_SwinT_OGC.py")
-    parser.add_argument('--grounding-dino-checkpoint', default="/home/appuser/Grounded-SAM-2/gdino_checkpoints/groundingdino_swint_ogc.pth")
-    parser.add_argument('--box-threshold', type=float, default=0.5)
-    parser.add_argument('--text-threshold', type=float, default=0.35)
-    parser.add_argument('--device', default="cuda")
+    parser.add_argument('--img-path', default=None, help="Single image path (used when --input-dir is not given)")
     parser.add_argument('--dump-json-results', action="store_true")
-    parser.add_argument('--multimask-output', action="store_true")
-    parser.add_argument('--batch-size', type=int, default=1)
+    add_model_args(parser)
+    parser.set_defaults(
+        sam2_checkpoint="/home/appuser/Grounded-SAM-2/checkpoints/sam2.1_hiera_large.pt",
+        grounding_dino_config="/home/appuser/Grounded-SAM-2/grounding_dino/groundingdino/config/GroundingDINO_SwinT_OGC.py",
+        grounding_dino_checkpoint="/home/appuser/Grounded-SAM-2/gdino_checkpoints/groundingdino_swint_ogc.pth",
+        box_threshold=0.5
+    )
 
     parser.add_argument('--pascal-config', type=str, default="configs/pascal_voc.yaml")
     parser.add_argument('--segmentation', action='store_true', help="Enable segmentation output for Pascal VOC format.")
+    add_pipeline_args(parser)
+    add_queue_args(parser)
+    add_cache_args(parser)
+    add_trace_args(parser)
+    add_sequence_args(parser)
+    add_server_args(parser)
+    add_cpu_args(parser)
+    add_manifest_args(parser)
 
     return parser
+
+def annotate(args, predictor, image_files, exporter, classes, class_id_map, colormap, journal=None, cache=None):
+    def export(result):
+        tasks = ['detection']
+        exporter.save(result, class_id_map=class_id_map, task='detection')
+
+        if args.segmentation:
+            exporter.save(result, class_id_map=class_id_map, colormap=colormap, task='segmentation')
+            tasks.append('segmentation')
+        if journal is not None:
+            journal.append(result["image_path"], {"stem": Path(result["image_path"]).stem, "tasks": tasks})
+
+    if args.sequence:
+        from .sequence import SequenceAnnotator
+
+        # frames in order; the per-image pipeline and result cache do not apply
+        SequenceAnnotator.from_args(predictor, args).run(
+            image_files,
+            export,
+            classes=classes,
+            batch_size=args.batch_size,
+            compact_masks=args.compact_masks
+        )
+        return
+
+    pipeline = AnnotationPipeline.from_args(predictor, export, args, cache=cache)
+    pipeline.run(
+        image_files,
+        image_batch_size=args.image_batch_size,
+        classes=classes,
+        batch_size=args.batch_size,
+        multimask_output=args.multimask_output,
+        compact_masks=args.compact_masks
+    )
+
+def run_queue_worker(args, image_files, classes, class_id_map, colormap, manifest=None):
+    # each claimed chunk is written to <input-dir>/parts/chunk_NNNNN/; combine them with src.merge
+    queue = LeaseQueue.from_args(args).create(image_files, args.chunk_size)
+    dataset_dir = Path(args.input_dir or Path(args.img_path).parent)
+    parts_dir = dataset_dir / "parts"
+    outputs = predictor_outputs(args, needs_masks=args.segmentation)
+    predictor = build_predictor(args, outputs, image_files, classes, manifest)
+    cache = ResultCache.from_args(args, classes, outputs, manifest=manifest)
+
+    for chunk_name, chunk_files in queue.claim_all():
+        print(f"[{queue.worker_id}] Processing {chunk_name} ({len(chunk_files)} images)")
+        exporter = exporters.PascalVOCExporter(input_dir=str(parts_dir / chunk_name))
+        try:
+            annotate(args, predictor, [Path(f) for f in chunk_files], exporter, classes, class_id_map, colormap, cache=cache)
+        finally:
+            exporter.close()
+
+    if cache is not None:
+        cache.report()
+    predictor.tracer.close()
+
+    print(f"All chunks done. Merge with: python -m src.merge --format pascal_voc --inputs {parts_dir} --output {dataset_dir}")
+    return parts_dir
+
 def run_inference(args):
+    validate_args(args)
+
     try:
         pascal_data = yaml.safe_load(open(args.pascal_config, 'r'))
     except Exception as e:
@@ -39,44 +115,52 @@ def run_inference(args):
     print(f"classes: {VOC_CLASSES}")
 
     image_files = []
+    manifest = None
     if args.input_dir:
-        input_path = Path(args.input_dir) / "JPEGImages"
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-            image_files.extend(input_path.glob(ext))
+        manifest = DatasetManifest.from_args(args, args.input_dir)
+        image_files = manifest.images("JPEGImages")
     elif args.img_path:
         image_files.append(Path(args.img_path))
     else:
         raise ValueError("Either --input-dir or --img-path must be specified.")
-    
-    predictor = Predictor(
-        sam2_model_config=args.sam2_model_config,
-        sam2_checkpoint=args.sam2_checkpoint,
-        grounding_dino_config=args.grounding_dino_config,
-        grounding_dino_checkpoint=args.grounding_dino_checkpoint,
-        device=args.device,
-        box_threshold=args.box_threshold,
-        text_threshold=args.text_threshold
-    )
 
-    exporter = exporters.PascalVOCExporter(input_dir=str(args.input_dir))
+    if args.queue_dir:
+        if args.sequence:
+            raise ValueError("--sequence cannot be combined with --queue-dir: a sequence is tracked by one worker.")
+        return run_queue_worker(args, image_files, INFERENCE_CLASSES, VOC_ID_MAP, VOC_COLORMAP, manifest)
 
-    for img_file in tqdm(image_files):
-        try:
-            result = predictor.predict(
-                image_path=str(img_file),
-                classes=INFERENCE_CLASSES,
-                batch_size=args.batch_size,
-                multimask_output=args.multimask_output
-            )
-            exporter.save(result, class_id_map=VOC_ID_MAP, task='detection')
-            
-            if args.segmentation:
-                exporter.save(result, class_id_map=VOC_ID_MAP, colormap=VOC_COLORMAP, task='segmentation')
-                
-        except Exception as e:
-            print(f"\nError processing {img_file.name}: {e}")
-            continue
-    print(f"Pascal VOC annotations saved to {args.input_dir}")
+    dataset_dir = Path(args.input_dir or Path(args.img_path).parent)
+    outputs = predictor_outputs(args, needs_masks=args.segmentation)
+
+    # the exporter starts fresh ImageSets lists, so the journal is checked first and then replayed into them
+    settings = {
+        **inference_settings(args, INFERENCE_CLASSES, outputs),
+        "tasks": ["detection", "segmentation"] if args.segmentation else ["detection"],
+        "colormap": VOC_COLORMAP,
+    }
+    journal = Journal(dataset_dir / "journal.jsonl", resume=args.resume, sync_every=args.image_batch_size, settings=settings)
+    exporter = exporters.PascalVOCExporter(input_dir=str(dataset_dir))
+    for entry in journal.replay():
+        for task in entry["tasks"]:
+            exporter.mark_done(entry["stem"], task)
+    if len(journal):
+        print(f"Resuming: {len(journal)} images already annotated")
+        image_files = [img_file for img_file in image_files if img_file not in journal]
+
+    predictor = build_predictor(args, outputs, image_files, INFERENCE_CLASSES, manifest)
+    cache = ResultCache.from_args(args, INFERENCE_CLASSES, outputs, manifest=manifest)
+
+    try:
+        annotate(args, predictor, image_files, exporter, INFERENCE_CLASSES, VOC_ID_MAP, VOC_COLORMAP, journal, cache)
+    finally:
+        exporter.close()
+        journal.close()
+    journal.remove()
+
+    if cache is not None:
+        cache.report()
+    predictor.tracer.close()
+    print(f"Pascal VOC annotations saved to {dataset_dir}")
 
 def main():
     parser = get_parser()
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image
+
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# label maps written next to the images; they are outputs, not inputs
+SKIP_DIRS = {"SegmentationClass", "SegmentationObject"}
+
+
+def add_manifest_args(parser):
+    group = parser.add_argument_group("dataset manifest")
+    group.add_argument('--manifest-workers', type=int, default=16, help="Threads for scanning directories and probing new or changed images")
+    group.add_argument('--rebuild-manifest', action='store_true', help=f"Ignore the existing {MANIFEST_NAME} and index the dataset from scratch")
+    return parser
+
+
+def _scan_dir(path: str) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+    files, subdirs = {}, []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    subdirs.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                st = entry.stat()
+                files[entry.path] = (st.st_size, st.st_mtime_ns)
+    return files, subdirs
+
+
+def _probe(path: str) -> Tuple[int, int, str]:
+    # PIL only parses the header for .size; the pixels are never decoded
+    with Image.open(path) as img:
+        width, height = img.size
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return width, height, h.hexdigest()
+
+
+class DatasetManifest:
+    """
+    Index of the images under a dataset directory, kept in <root>/.manifest.json.
+
+    Each entry maps the path relative to root to [size, mtime_ns, width, height, sha256].
+    update() lists the tree with parallel os.scandir and only re-probes files whose size
+    or mtime changed, so a rerun on an unchanged dataset costs one directory walk.
+    """
+    def __init__(self, root: str, workers: int = 16, rebuild: bool = False):
+        self.root = Path(root)
+        self.path = self.root / MANIFEST_NAME
+        self.workers = max(1, workers)
+        self.entries: Dict[str, List[Any]] = {}
+        self._by_name: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+        if not rebuild and self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data["entries"]
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+    @classmethod
+    def from_args(cls, args, root: str) -> "DatasetManifest":
+        return cls(root, workers=args.manifest_workers, rebuild=args.rebuild_manifest).update()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        root = str(self.root)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(_scan_dir, root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_files, subdirs = future.result()
+                    for path, stat in dir_files.items():
+                        files[Path(os.path.relpath(path, root)).as_posix()] = stat
+                    pending.update(pool.submit(_scan_dir, subdir) for subdir in subdirs)
+        return files
+
+    def update(self) -> "DatasetManifest":
+        start = time.perf_counter()
+        files = self._scan()
+
+        removed = [rel for rel in self.entries if rel not in files]
+        for rel in removed:
+            del self.entries[rel]
+
+        stale = [
+            rel for rel, (size, mtime_ns) in files.items()
+            if rel not in self.entries or self.entries[rel][:2] != [size, mtime_ns]
+        ]
+        added = sum(rel not in self.entries for rel in stale)
+
+        def probe(rel):
+            try:
+                return rel, _probe(str(self.root / rel))
+            except OSError as e:
+                print(f"[Manifest] Skipping unreadable image {rel}: {e}")
+                return rel, None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for rel, probed in pool.map(probe, stale):
+                if probed is None:
+                    self.entries.pop(rel, None)
+                else:
+                    self.entries[rel] = [*files[rel], *probed]
+
+        self._by_name = None
+        if stale or removed:
+            self.save()
+        print(f"[Manifest] {len(self.entries)} images under {self.root} "
+              f"({added} new, {len(stale) - added} changed, {len(removed)} removed) in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def save(self):
+        with self._lock:
+            data = {"version": MANIFEST_VERSION, "entries": dict(sorted(self.entries.items()))}
+            tmp_path = self.path.with_name(f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+            try:
+                tmp_path.write_text(json.dumps(data, separators=(",", ":")))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # a read-only dataset still works, it is just indexed again next time
+                tmp_path.unlink(missing_ok=True)
+                print(f"[Manifest] Could not write {self.path}: {e}")
+
+    def images(self, subdir: str = "", recursive: bool = False, extensions=IMAGE_EXTENSIONS) -> List[Path]:
+        """Sorted image paths under root/subdir (directly inside it unless recursive)."""
+        prefix = f"{Path(subdir).as_posix()}/" if subdir and subdir != "." else ""
+        paths = []
+        for rel in sorted(self.entries):
+            if not rel.startswith(prefix) or not rel.lower().endswith(tuple(extensions)):
+                continue
+            if not recursive and "/" in rel[len(prefix):]:
+                continue
+            paths.append(self.root / rel)
+        return paths
+
+    def _relative(self, path) -> Optional[str]:
+        try:
+            return Path(os.path.abspath(path)).relative_to(self.root.absolute()).as_posix()
+        except ValueError:
+            return None
+
+    def entry(self, path) -> Optional[Dict[str, Any]]:
+        rel = self._relative(path)
+        values = self.entries.get(rel) if rel is not None else None
+        if values is None:
+            return None
+        size, mtime_ns, width, height, sha256 = values
+        return {"path": rel, "size": size, "mtime_ns": mtime_ns, "width": width, "height": height, "sha256": sha256}
+
+    def digest(self, path) -> Optional[str]:
+        entry = self.entry(path)
+        return entry["sha256"] if entry is not None else None
+
+    def find(self, name: str, subdirs=("",)) -> Optional[Path]:
+        """Resolve an image reference (relative path or bare file name) without touching the filesystem."""
+        for subdir in subdirs:
+            rel = (Path(subdir) / name).as_posix()
+            if rel in self.entries:
+                return self.root / rel
+        rel = self._relative(name)
+        if rel in self.entries:
+            return self.root / rel
+
+        if self._by_name is None:
+            self._by_name = {}
+            for rel in sorted(self.entries):
+                self._by_name.setdefault(rel.rsplit("/", 1)[-1], rel)
+        rel = self._by_name.get(Path(name).name)
+        return self.root / rel if rel is not None else None
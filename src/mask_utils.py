@@ -0,0 +1,212 @@
+import numpy as np
+from typing import Dict, Any, List, Tuple
+
+
+class CompactMask:
+    """
+    Binary mask kept as the bit-packed crop of its bounding box inside an (H, W) frame.
+    The full-size array is only built when asked for with to_dense() or np.asarray().
+    """
+    def __init__(self, bits: np.ndarray, crop_shape: Tuple[int, int], offset: Tuple[int, int], shape: Tuple[int, int]):
+        self.bits = bits
+        self.crop_shape = tuple(int(v) for v in crop_shape)
+        self.x0, self.y0 = (int(v) for v in offset)
+        self.shape = tuple(int(v) for v in shape)
+
+    @classmethod
+    def from_dense(cls, mask: np.ndarray) -> "CompactMask":
+        crop, x0, y0 = crop_mask(mask)
+        return cls(np.packbits(crop, axis=None), crop.shape, (x0, y0), mask.shape[-2:])
+
+    @property
+    def crop(self) -> np.ndarray:
+        h, w = self.crop_shape
+        return np.unpackbits(self.bits, count=h * w).reshape(h, w).view(bool)
+
+    @property
+    def box(self) -> Tuple[int, int, int, int]:
+        h, w = self.crop_shape
+        return self.x0, self.y0, self.x0 + w, self.y0 + h
+
+    @property
+    def area(self) -> int:
+        return int(np.bitwise_count(self.bits).sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros(self.shape, dtype=bool)
+        x0, y0, x1, y1 = self.box
+        dense[y0:y1, x0:x1] = self.crop
+        return dense
+
+    def astype(self, dtype) -> np.ndarray:
+        return self.to_dense().astype(dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+
+def crop_mask(mask) -> Tuple[np.ndarray, int, int]:
+    """Return the boolean bounding-box crop of a dense or compact mask and its (x0, y0) offset."""
+    if isinstance(mask, CompactMask):
+        return mask.crop, mask.x0, mask.y0
+
+    mask = np.asarray(mask).astype(bool, copy=False)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return np.zeros((0, 0), dtype=bool), 0, 0
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1], int(cols[0]), int(rows[0])
+
+
+def _runs(mask) -> np.ndarray:
+    # COCO RLE runs over the column-major flattening and always starts with a run of zeros.
+    # Only the columns spanned by the crop are expanded; the rest are all-zero runs.
+    h, w = mask.shape[-2:]
+    crop, x0, y0 = crop_mask(mask)
+    if crop.size == 0:
+        return np.asarray([h * w] if h * w else [], dtype=np.int64)
+
+    band = np.zeros((h, crop.shape[1]), dtype=bool)
+    band[y0:y0 + crop.shape[0]] = crop
+    flat = band.T.ravel()
+
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds).astype(np.int64)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+
+    counts[0] += x0 * h
+    trailing = (w - x0 - crop.shape[1]) * h
+    if trailing:
+        if counts.size % 2:
+            counts[-1] += trailing
+        else:
+            counts = np.concatenate((counts, [trailing]))
+    return counts
+
+
+def _compress_counts(counts: np.ndarray) -> str:
+    # same LEB128-style string as pycocotools' rleToString, built for all counts at once
+    x = counts.astype(np.int64).copy()
+    if x.size > 3:
+        x[3:] -= counts[1:-2]
+
+    chars = []
+    valid = []
+    active = np.ones(x.size, dtype=bool)
+    while active.any():
+        c = x & 0x1f
+        x >>= 5
+        more = np.where(c & 0x10, x != -1, x != 0)
+        chars.append((c | np.where(more, 0x20, 0)) + 48)
+        valid.append(active.copy())
+        active &= more
+
+    if not chars:
+        return ""
+    chars = np.stack(chars, axis=1).astype(np.uint8)
+    valid = np.stack(valid, axis=1)
+    return chars[valid].tobytes().decode("ascii")
+
+
+def _decompress_counts(s: str) -> np.ndarray:
+    counts = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return np.asarray(counts, dtype=np.int64)
+
+
+def _counts(rle: Dict[str, Any]) -> np.ndarray:
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        return _decompress_counts(counts.decode("ascii") if isinstance(counts, bytes) else counts)
+    return np.asarray(counts, dtype=np.int64)
+
+
+def encode_rle(mask) -> Dict[str, Any]:
+    """Encode a binary (H, W) mask, dense or CompactMask, as compressed COCO RLE."""
+    h, w = mask.shape[:2]
+    return {"size": [int(h), int(w)], "counts": _compress_counts(_runs(mask))}
+
+
+def decode_rle(rle: Dict[str, Any]) -> np.ndarray:
+    h, w = rle["size"]
+    counts = _counts(rle)
+    values = np.zeros(counts.size, dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, counts)
+    return flat.reshape(w, h).T
+
+
+def decode_rle_compact(rle: Dict[str, Any]) -> CompactMask:
+    """Decode RLE into a CompactMask; only the columns the foreground spans are expanded."""
+    h, w = rle["size"]
+    counts = _counts(rle)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    starts, ends = starts[1::2], ends[1::2]
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if starts.size == 0:
+        return CompactMask(np.zeros(0, dtype=np.uint8), (0, 0), (0, 0), (h, w))
+
+    x0 = int(starts[0] // h)
+    x1 = int((ends[-1] - 1) // h) + 1
+    offset = x0 * h
+    delta = np.zeros((x1 - x0) * h + 1, dtype=np.int32)
+    np.add.at(delta, starts - offset, 1)
+    np.add.at(delta, ends - offset, -1)
+    band = (np.cumsum(delta[:-1]) > 0).reshape(x1 - x0, h).T
+
+    rows = np.flatnonzero(band.any(axis=1))
+    crop = band[rows[0]:rows[-1] + 1]
+    return CompactMask(np.packbits(crop, axis=None), crop.shape, (x0, int(rows[0])), (h, w))
+
+
+def rle_area(rle: Dict[str, Any]) -> int:
+    return int(_counts(rle)[1::2].sum())
+
+
+def rle_to_bbox(rle: Dict[str, Any]) -> List[float]:
+    """[x, y, w, h] of the foreground, computed from the runs like pycocotools' rleToBbox."""
+    h = rle["size"][0]
+    counts = _counts(rle)
+    m = (counts.size // 2) * 2
+    if m == 0:
+        return [0.0, 0.0, 0.0, 0.0]
+
+    ends = np.cumsum(counts[:m])
+    first = ends[0::2]
+    last = ends[1::2] - 1
+
+    first_x, first_y = np.divmod(first, h)
+    last_x, last_y = np.divmod(last, h)
+
+    xs, xe = first_x.min(), last_x.max()
+    if np.any(last_x > first_x):
+        # a run that wraps into the next column covers the full height
+        ys, ye = 0, h - 1
+    else:
+        ys, ye = min(first_y.min(), last_y.min()), max(first_y.max(), last_y.max())
+
+    return [float(xs), float(ys), float(xe - xs + 1), float(ye - ys + 1)]
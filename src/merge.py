@@ -0,0 +1,106 @@
+import json
+import shutil
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from typing import List
+from . import exporters
+
+
+def _expand(inputs: List[str], pattern: str, is_partial) -> List[Path]:
+    # accept partial results directly or directories that contain them
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if is_partial(path):
+            paths.append(path)
+        else:
+            paths.extend(sorted(p for p in path.glob(pattern) if is_partial(p)))
+    return paths
+
+
+def merge_coco(inputs: List[Path], output_path: Path):
+    """Concatenate partial COCO files, renumbering image and annotation ids and mapping categories by name."""
+    exporter = None
+    for path in inputs:
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        category_names = {c["id"]: c["name"] for c in data["categories"]}
+        if exporter is None:
+            exporter = exporters.StreamingCOCOExporter(
+                categories=[c["name"] for c in sorted(data["categories"], key=lambda c: c["id"])],
+                output_path=str(output_path)
+            )
+
+        annotations_by_image = defaultdict(list)
+        for annotation in data["annotations"]:
+            annotations_by_image[annotation["image_id"]].append(annotation)
+
+        for image in data["images"]:
+            annotations = []
+            for annotation in annotations_by_image[image["id"]]:
+                name = category_names[annotation["category_id"]]
+                category_id = exporter.class_map.get(name)
+                if category_id is None:
+                    raise ValueError(f"Category '{name}' in {path} is not in {inputs[0]}")
+                annotations.append({
+                    **{k: v for k, v in annotation.items() if k not in ("id", "image_id")},
+                    "category_id": category_id
+                })
+
+            exporter.add_record({
+                "image": {k: v for k, v in image.items() if k != "id"},
+                "annotations": annotations
+            })
+
+    if exporter is None:
+        raise ValueError("No partial COCO files to merge.")
+    exporter.save()
+
+
+def merge_pascal_voc(inputs: List[Path], output_dir: Path):
+    """Copy partial VOC directories into one dataset and combine their ImageSets lists."""
+    output_dir = Path(output_dir)
+    for sub in ["Annotations", "SegmentationClass"]:
+        (output_dir / sub).mkdir(parents=True, exist_ok=True)
+
+    lists = {
+        Path("ImageSets") / "Main" / "default.txt": [],
+        Path("ImageSets") / "Segmentation" / "default.txt": [],
+    }
+
+    for part_dir in inputs:
+        for sub in ["Annotations", "SegmentationClass"]:
+            for path in sorted((part_dir / sub).glob("*")):
+                shutil.copy2(path, output_dir / sub / path.name)
+
+        for list_path, stems in lists.items():
+            if (part_dir / list_path).exists():
+                stems.extend((part_dir / list_path).read_text().split())
+
+    for list_path, stems in lists.items():
+        (output_dir / list_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_dir / list_path, "w") as f:
+            for stem in dict.fromkeys(stems):
+                f.write(f"{stem}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge partial results written by work-queue workers")
+    parser.add_argument("--format", required=True, choices=["coco", "pascal_voc"], help="Dataset format")
+    parser.add_argument("--inputs", nargs='+', required=True, help="Partial results, or directories containing them (e.g. <output-dir>/parts)")
+    parser.add_argument("--output", required=True, help="Merged instances.json (coco) or dataset directory (pascal_voc)")
+    args = parser.parse_args()
+
+    if args.format == "coco":
+        inputs = _expand(args.inputs, "chunk_*.json", lambda p: p.is_file())
+        merge_coco(inputs, Path(args.output))
+    else:
+        inputs = _expand(args.inputs, "chunk_*", lambda p: (p / "Annotations").is_dir())
+        merge_pascal_voc(inputs, Path(args.output))
+    print(f"Merged {len(inputs)} partial results into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
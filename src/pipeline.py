@@ -0,0 +1,191 @@
+import queue
+import threading
+from pathlib import Path
+from collections import deque
+from typing import Any, Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from .profiler import NULL_TRACER
+
+
+def add_pipeline_args(parser):
+    group = parser.add_argument_group("pipeline")
+    group.add_argument('--decode-workers', type=int, default=4, help="Threads decoding and preprocessing images")
+    group.add_argument('--decode-queue', type=int, default=16, help="Max decoded images waiting for inference")
+    group.add_argument('--export-workers', type=int, default=1, help="Threads writing annotations")
+    group.add_argument('--export-queue', type=int, default=16, help="Max results waiting for export")
+    group.add_argument('--replicas', type=int, default=1, help="Predictor replicas sharing the model weights, each running batches on its own thread")
+    group.add_argument('--resume', action='store_true', help="Skip images already recorded in the run journal")
+    return parser
+
+
+class AnnotationPipeline:
+    """
+    Runs decode -> infer -> export as overlapping stages connected by bounded queues.
+    Decoding happens on a thread pool and exporting on background threads, so the
+    model only waits when the decode stage cannot keep up. With replicas > 1, whole
+    batches are handed to that many predictor replicas on their own threads.
+    """
+    def __init__(self, predictor, export_fn: Callable[[Dict[str, Any]], None],
+                 decode_workers: int = 4, decode_queue: int = 16,
+                 export_workers: int = 1, export_queue: int = 16, cache=None, tracer=None, replicas: int = 1):
+        self.predictor = predictor
+        self.predictors = [predictor] + [predictor.replicate() for _ in range(replicas - 1)]
+        self.export_fn = export_fn
+        self.cache = cache
+        self.tracer = tracer or getattr(predictor, "tracer", NULL_TRACER)
+        self.decode_workers = max(1, decode_workers)
+        self.decode_queue = max(1, decode_queue)
+        self.export_workers = max(1, export_workers)
+        self.export_queue = max(1, export_queue)
+
+    @classmethod
+    def from_args(cls, predictor, export_fn, args, cache=None, tracer=None):
+        return cls(
+            predictor,
+            export_fn,
+            decode_workers=args.decode_workers,
+            decode_queue=args.decode_queue,
+            export_workers=args.export_workers,
+            export_queue=args.export_queue,
+            cache=cache,
+            tracer=tracer,
+            replicas=getattr(args, "replicas", 1)
+        )
+
+    def run(self, image_files: List[Path], image_batch_size: int = 1, **predict_kwargs):
+        export_queue = queue.Queue(maxsize=self.export_queue)
+        export_threads = [
+            threading.Thread(target=self._export_worker, args=(export_queue,), daemon=True)
+            for _ in range(self.export_workers)
+        ]
+        for thread in export_threads:
+            thread.start()
+
+        compact_masks = predict_kwargs.get("compact_masks", False)
+        try:
+            with tqdm(total=len(image_files)) as pbar:
+                infer_queue = queue.Queue(maxsize=len(self.predictors))
+                infer_threads = []
+                if len(self.predictors) > 1:
+                    infer_threads = [
+                        threading.Thread(
+                            target=self._infer_worker,
+                            args=(predictor, infer_queue, export_queue, predict_kwargs, pbar),
+                            daemon=True
+                        )
+                        for predictor in self.predictors
+                    ]
+                for thread in infer_threads:
+                    thread.start()
+
+                def infer(batch):
+                    if infer_threads:
+                        infer_queue.put(batch)
+                    else:
+                        self._infer(self.predictor, batch, export_queue, predict_kwargs)
+                        pbar.update(len(batch))
+
+                try:
+                    batch = []
+                    for img_file, loaded in self._decode(image_files, compact_masks):
+                        if loaded is None:
+                            pbar.update(1)
+                            continue
+
+                        key, cached, image = loaded
+                        if cached is not None:
+                            # cache hit: skip both models
+                            export_queue.put((None, cached))
+                            pbar.update(1)
+                            continue
+
+                        batch.append((img_file, key, image))
+                        if len(batch) >= image_batch_size:
+                            infer(batch)
+                            batch = []
+
+                    if batch:
+                        infer(batch)
+                finally:
+                    for _ in infer_threads:
+                        infer_queue.put(None)
+                    for thread in infer_threads:
+                        thread.join()
+        finally:
+            for _ in export_threads:
+                export_queue.put(None)
+            for thread in export_threads:
+                thread.join()
+
+    def _load(self, img_file, compact_masks):
+        key = None
+        if self.cache is not None:
+            with self.tracer.span("cache_get", image=Path(img_file).name) as span:
+                key = self.cache.key(str(img_file))
+                cached = self.cache.get(key, str(img_file), compact_masks)
+                span["hit"] = cached is not None
+            if cached is not None:
+                return key, cached, None
+        return key, None, self.predictor.load_image(str(img_file))
+
+    def _decode(self, image_files, compact_masks=False):
+        # keep at most decode_queue images in flight, yielded in input order
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+            pending = deque()
+            files = iter(image_files)
+
+            for img_file in files:
+                pending.append((img_file, pool.submit(self._load, img_file, compact_masks)))
+                if len(pending) >= self.decode_queue:
+                    break
+
+            while pending:
+                img_file, future = pending.popleft()
+                next_file = next(files, None)
+                if next_file is not None:
+                    pending.append((next_file, pool.submit(self._load, next_file, compact_masks)))
+
+                try:
+                    yield img_file, future.result()
+                except Exception as e:
+                    print(f"\nError loading {Path(img_file).name}: {e}")
+                    yield img_file, None
+
+    def _infer_worker(self, predictor, infer_queue, export_queue, predict_kwargs, pbar):
+        while True:
+            batch = infer_queue.get()
+            if batch is None:
+                break
+            self._infer(predictor, batch, export_queue, predict_kwargs)
+            pbar.update(len(batch))
+
+    def _infer(self, predictor, batch, export_queue, predict_kwargs):
+        try:
+            results = predictor.predict_batch(
+                image_paths=[str(img_file) for img_file, _, _ in batch],
+                images=[image for _, _, image in batch],
+                **predict_kwargs
+            )
+        except Exception as e:
+            print(f"\nError processing {', '.join(Path(img_file).name for img_file, _, _ in batch)}: {e}")
+            return
+
+        for (_, key, _), result in zip(batch, results):
+            export_queue.put((key, result))
+
+    def _export_worker(self, export_queue):
+        while True:
+            item = export_queue.get()
+            if item is None:
+                break
+
+            key, result = item
+            try:
+                if key is not None:
+                    with self.tracer.span("cache_put", image=Path(result["image_path"]).name):
+                        self.cache.put(key, result)
+                with self.tracer.span("export", image=Path(result["image_path"]).name, detections=len(result["labels"])):
+                    self.export_fn(result)
+            except Exception as e:
+                print(f"\nError exporting {Path(result['image_path']).name}: {e}")
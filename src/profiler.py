@@ -0,0 +1,145 @@
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+import numpy as np
+
+
+def add_trace_args(parser):
+    group = parser.add_argument_group("tracing")
+    group.add_argument('--trace', default=None, help="Write per-stage timings to this JSONL file and print a summary at exit")
+    group.add_argument('--profile', action='store_true', help="Print the per-stage summary at exit without writing a trace file")
+    return parser
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+class Tracer:
+    """
+    Per-stage wall time, detection counts and memory high-water marks.
+    Every span becomes one JSONL record; close() prints a summary table and runs at exit
+    at the latest, so a failed or interrupted run still reports and flushes its trace.
+    A disabled tracer hands out a shared null context, so instrumented code costs one call.
+    """
+    def __init__(self, path: Optional[str] = None, enabled: bool = True, device: str = "cpu"):
+        self.enabled = enabled or path is not None
+        self.path = path
+        self._file = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, "w")
+        self._lock = threading.Lock()
+        self._null = nullcontext({})
+        self._start = time.perf_counter()
+        self._durations = defaultdict(list)
+        self._counts = defaultdict(int)
+        self._cuda = False
+        if self.enabled and str(device).startswith("cuda"):
+            import torch
+            self._cuda = torch.cuda.is_available()
+        if self._cuda:
+            # the peak counter is shared by every thread, so it is reset once per run, never per span
+            torch.cuda.reset_peak_memory_stats()
+        self._closed = not self.enabled
+        if self.enabled:
+            atexit.register(self.close)
+
+    @classmethod
+    def from_args(cls, args) -> "Tracer":
+        return cls(args.trace, enabled=args.profile, device=getattr(args, "device", "cpu"))
+
+    def span(self, stage: str, memory: bool = False, **fields):
+        """Time a block; the yielded dict can take extra fields, e.g. detection counts."""
+        if not self.enabled:
+            return self._null
+        return self._span(stage, memory, fields)
+
+    @contextmanager
+    def _span(self, stage: str, memory: bool, record: Dict[str, Any]):
+        track_memory = memory and self._cuda
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            duration = time.perf_counter() - start
+            record = {
+                "stage": stage,
+                "start_s": round(start - self._start, 6),
+                "duration_ms": round(duration * 1000, 3),
+                "thread": threading.current_thread().name,
+                **record
+            }
+            if track_memory:
+                # high-water mark of the run so far, as of the end of this span
+                record["device_peak_mb"] = round(self.peak_device_mb(), 1)
+
+            with self._lock:
+                self._durations[stage].append(duration)
+                for name, value in record.items():
+                    if name in ("detections", "images") and isinstance(value, int):
+                        self._counts[f"{stage}.{name}"] += value
+                if self._file is not None:
+                    self._file.write(json.dumps(record) + "\n")
+
+    def peak_device_mb(self) -> float:
+        if not self._cuda:
+            return 0.0
+        import torch
+        return torch.cuda.max_memory_allocated() / 1024 ** 2
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-stage call count, total seconds and mean/p50/p95/max milliseconds."""
+        with self._lock:
+            durations = {stage: list(values) for stage, values in self._durations.items()}
+        stats = {}
+        for stage, values in durations.items():
+            ms = np.asarray(values) * 1000
+            stats[stage] = {
+                "calls": len(values),
+                "total_s": round(float(ms.sum() / 1000), 6),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "max_ms": round(float(ms.max()), 3),
+            }
+        return stats
+
+    def summary(self) -> str:
+        lines = [f"{'stage':<16}{'calls':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for stage, s in self.stats().items():
+            lines.append(
+                f"{stage:<16}{s['calls']:>8}{s['total_s']:>10.2f}{s['mean_ms']:>10.2f}"
+                f"{s['p95_ms']:>10.2f}{s['max_ms']:>10.2f}"
+            )
+        for name, value in sorted(self._counts.items()):
+            lines.append(f"{name}: {value}")
+
+        lines.append(f"peak RSS: {peak_rss_mb():.1f} MB")
+        if self._cuda:
+            lines.append(f"peak device memory: {self.peak_device_mb():.1f} MB")
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        atexit.unregister(self.close)
+        print("[Trace] per-stage summary" + (f" (records in {self.path})" if self.path else ""))
+        print(self.summary())
+
+
+NULL_TRACER = Tracer(enabled=False)
@@ -0,0 +1,205 @@
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from tqdm import tqdm
+from .mask_utils import CompactMask
+
+
+def add_sequence_args(parser):
+    group = parser.add_argument_group("sequence mode")
+    group.add_argument('--sequence', action='store_true', help="Treat the images as ordered video frames: detect on keyframes and propagate masks with SAM2")
+    group.add_argument('--keyframe-interval', type=int, default=10, help="Run Grounding DINO at least every N frames")
+    group.add_argument('--min-track-confidence', type=float, default=0.5, help="Start a new keyframe early when a tracked mask's confidence drops below this")
+    group.add_argument('--offload-video-to-cpu', action='store_true', help="Keep the SAM2 frame cache in host memory")
+    return parser
+
+
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", Path(path).name)]
+
+
+class SequenceAnnotator:
+    """
+    Keyframe detection plus SAM2 video propagation for ordered frames.
+
+    The frames are cut into segments that start at a keyframe. Grounding DINO runs on the
+    keyframe, its boxes prompt the SAM2 video predictor, and the masks are propagated
+    through the segment. A segment ends after keyframe_interval frames, or earlier when a
+    tracked object's mask confidence falls below min_confidence; that frame becomes the next
+    keyframe. Detections on a new keyframe take over the track id of the previous segment's
+    object with the same label and the highest box IoU.
+    """
+    def __init__(self, predictor, sam2_model_config: str, sam2_checkpoint: str, device: str = "cuda",
+                 keyframe_interval: int = 10, min_confidence: float = 0.5, offload_video_to_cpu: bool = False,
+                 iou_threshold: float = 0.5):
+        if getattr(predictor, "tile_size", 0):
+            raise ValueError("Sequence mode does not support tiled inference.")
+        self.predictor = predictor
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.min_confidence = min_confidence
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.iou_threshold = iou_threshold
+
+        # imported here so the CLIs can parse arguments without loading torch
+        from sam2.build_sam import build_sam2_video_predictor
+
+        print("Loading SAM2 video predictor...")
+        self.video_predictor = build_sam2_video_predictor(sam2_model_config, sam2_checkpoint, device=device)
+
+        self.next_track_id = 1
+        self._last_tracks = []  # (box, label, track_id) on the last emitted frame
+
+    @classmethod
+    def from_args(cls, predictor, args):
+        return cls(
+            predictor,
+            sam2_model_config=args.sam2_model_config,
+            sam2_checkpoint=args.sam2_checkpoint,
+            device=args.device,
+            keyframe_interval=args.keyframe_interval,
+            min_confidence=args.min_track_confidence,
+            offload_video_to_cpu=args.offload_video_to_cpu
+        )
+
+    def run(self, image_files: List[Path], export_fn: Callable[[Dict[str, Any]], None], classes: List[str],
+            batch_size: int = 0, compact_masks: bool = False, **kwargs):
+        frames = sorted((str(f) for f in image_files), key=_natural_key)
+        keyframes = 0
+        with tqdm(total=len(frames)) as pbar:
+            start = 0
+            while start < len(frames):
+                results = self._run_segment(frames[start:start + self.keyframe_interval], classes, batch_size, compact_masks)
+                for result in results:
+                    export_fn(result)
+                keyframes += 1
+                start += len(results)
+                pbar.update(len(results))
+        print(f"[Sequence] {len(frames)} frames, {keyframes} keyframes, {self.next_track_id - 1} tracks")
+
+    def _run_segment(self, segment: List[str], classes, batch_size, compact_masks) -> List[Dict[str, Any]]:
+        import torch
+
+        keyframe = self.predictor.detect_batch([segment[0]], classes, batch_size)[0]
+        height, width = keyframe["image_shape"]
+        if len(keyframe["boxes"]) == 0:
+            # nothing to track: the rest of the segment stays empty until the next keyframe
+            self._last_tracks = []
+            return [self._result(path, (height, width), [], [], [], [], compact_masks) for path in segment]
+
+        track_ids = self._assign_tracks(keyframe["boxes"], keyframe["labels"])
+        labels = dict(zip(track_ids, keyframe["labels"]))
+
+        results = []
+        with tempfile.TemporaryDirectory(prefix="gsam2_segment_") as frame_dir:
+            self._link_frames(segment, frame_dir)
+            with torch.inference_mode():
+                state = self.video_predictor.init_state(video_path=frame_dir, offload_video_to_cpu=self.offload_video_to_cpu)
+                for track_id, box in zip(track_ids, keyframe["boxes"]):
+                    self.video_predictor.add_new_points_or_box(state, frame_idx=0, obj_id=track_id, box=box)
+
+                for frame_idx, obj_ids, mask_logits in self.video_predictor.propagate_in_video(state):
+                    masks = (mask_logits[:, 0] > 0.0)
+                    # mean foreground probability of each mask, 0 for a lost object
+                    probs = torch.sigmoid(mask_logits[:, 0].float())
+                    areas = masks.flatten(1).sum(dim=1)
+                    confidences = (probs * masks).flatten(1).sum(dim=1) / areas.clamp(min=1)
+
+                    if frame_idx > 0 and bool((confidences < self.min_confidence).any()):
+                        break
+
+                    results.append(self._frame_result(
+                        segment[frame_idx], (height, width), obj_ids, masks, confidences, labels, compact_masks
+                    ))
+                self.video_predictor.reset_state(state)
+
+        return results
+
+    def _frame_result(self, path, image_shape, obj_ids, masks, confidences, labels, compact_masks):
+        masks = masks.cpu().numpy()
+        confidences = confidences.float().cpu().numpy()
+
+        keep, boxes = [], []
+        for i, mask in enumerate(masks):
+            rows = np.flatnonzero(mask.any(axis=1))
+            if rows.size == 0:
+                continue
+            cols = np.flatnonzero(mask.any(axis=0))
+            keep.append(i)
+            boxes.append([cols[0], rows[0], cols[-1] + 1, rows[-1] + 1])
+
+        result = self._result(
+            path, image_shape,
+            np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+            masks[keep],
+            confidences[keep],
+            [obj_ids[i] for i in keep],
+            compact_masks,
+            labels
+        )
+        self._last_tracks = list(zip(result["boxes"], result["labels"], result["track_ids"]))
+        return result
+
+    def _result(self, path, image_shape, boxes, masks, scores, track_ids, compact_masks, labels=None):
+        if len(track_ids) == 0:
+            return {
+                "boxes": [],
+                "masks": [],
+                "scores": [],
+                "labels": [],
+                "track_ids": [],
+                "image_path": path,
+                "image_shape": image_shape
+            }
+        return {
+            "boxes": boxes,
+            "masks": [CompactMask.from_dense(mask) for mask in masks] if compact_masks else masks,
+            "scores": scores,
+            "labels": [labels[track_id] for track_id in track_ids],
+            "track_ids": [int(track_id) for track_id in track_ids],
+            "image_path": path,
+            "image_shape": image_shape
+        }
+
+    def _assign_tracks(self, boxes, labels) -> List[int]:
+        import torch
+        from torchvision.ops import box_iou
+
+        # greedy matching against the previous segment's last frame, best IoU first
+        track_ids: List[Optional[int]] = [None] * len(boxes)
+        if self._last_tracks:
+            prev_boxes = torch.as_tensor(np.asarray([box for box, _, _ in self._last_tracks]), dtype=torch.float32)
+            iou = box_iou(torch.as_tensor(np.asarray(boxes), dtype=torch.float32), prev_boxes)
+            used = set()
+            for flat in torch.argsort(iou.flatten(), descending=True).tolist():
+                i, j = divmod(flat, len(self._last_tracks))
+                if iou[i, j] < self.iou_threshold:
+                    break
+                _, prev_label, prev_id = self._last_tracks[j]
+                if track_ids[i] is None and j not in used and prev_label == labels[i]:
+                    track_ids[i] = prev_id
+                    used.add(j)
+
+        for i, track_id in enumerate(track_ids):
+            if track_id is None:
+                track_ids[i] = self.next_track_id
+                self.next_track_id += 1
+        return track_ids
+
+    def _link_frames(self, segment: List[str], frame_dir: str):
+        # the SAM2 video loader reads <index>.jpg files from one directory
+        for i, path in enumerate(segment):
+            target = os.path.join(frame_dir, f"{i:05d}.jpg")
+            if Path(path).suffix.lower() in (".jpg", ".jpeg"):
+                try:
+                    os.symlink(os.path.abspath(path), target)
+                    continue
+                except OSError:
+                    shutil.copy2(path, target)
+                    continue
+            Image.open(path).convert("RGB").save(target, quality=95)
+
@@ -0,0 +1,332 @@
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from . import mask_utils
+from .cache import add_embedding_args, model_settings
+from .cpu_profile import add_cpu_args, validate_cpu_args
+from .profiler import NULL_TRACER
+from .startup import add_model_args, check_model_files, load_predictor
+
+def add_server_args(parser):
+    group = parser.add_argument_group("annotation server")
+    group.add_argument('--server', default=None, help="Send images to a running `python -m src.server` at this URL instead of loading the models (e.g. http://127.0.0.1:8765)")
+    return parser
+
+
+def request_json(url: str, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+    data = None if payload is None else json.dumps(payload).encode()
+    request = urllib.request.Request(url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        # the server answered; report its own error message rather than a connection failure
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except (ValueError, AttributeError):
+            message = e.reason
+        raise ValueError(f"Annotation server at {url} rejected {method} {path} ({e.code}): {message}")
+    except OSError as e:
+        raise ValueError(f"Annotation server at {url} is not reachable: {e}")
+
+
+def server_settings(url: str) -> Dict[str, Any]:
+    """The models and thresholds a running server annotates with, for cache keys and journals."""
+    health = request_json(url.rstrip("/"), "GET", "/health")
+    if "settings" not in health:
+        raise ValueError(f"Annotation server at {url} does not report its settings; restart it with this version")
+    return health["settings"]
+
+
+class BatchScheduler:
+    """
+    Coalesces single-image requests into predict_batch calls.
+    Requests with the same options (classes, prompt batching, multimask_output) are
+    grouped until max_batch_size images are waiting or the oldest has waited max_latency seconds.
+    """
+    def __init__(self, predictor, max_batch_size: int = 8, max_latency: float = 0.05, decode_workers: int = 4):
+        self.predictor = predictor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max_latency
+        self.batches = 0
+        self.images = 0
+
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, decode_workers))
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, image_path: str, options: Tuple) -> Future:
+        future = Future()
+        self._queue.put((time.monotonic(), image_path, options, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+    def _loop(self):
+        held = deque()  # requests with other options, served by later batches
+        while True:
+            item = held.popleft() if held else self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            options = item[2]
+            for other in list(held):
+                if len(batch) < self.max_batch_size and other[2] == options:
+                    batch.append(other)
+                    held.remove(other)
+
+            stop = False
+            deadline = item[0] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    other = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if other is None:
+                    stop = True
+                    break
+                if other[2] == options:
+                    batch.append(other)
+                else:
+                    held.append(other)
+
+            self._run(batch, options)
+            if stop:
+                return
+
+    def _load(self, image_path):
+        return self.predictor.load_image(image_path)
+
+    def _run(self, batch, options):
+        classes, batch_size, multimask_output, outputs = options
+        loaded = []
+        for (_, image_path, _, future), decoded in zip(batch, [self._pool.submit(self._load, item[1]) for item in batch]):
+            try:
+                loaded.append((image_path, future, decoded.result()))
+            except Exception as e:
+                future.set_exception(e)
+        if not loaded:
+            return
+
+        try:
+            results = self.predictor.predict_batch(
+                [image_path for image_path, _, _ in loaded],
+                list(classes),
+                batch_size=batch_size,
+                multimask_output=multimask_output,
+                images=[image for _, _, image in loaded],
+                compact_masks=True,
+                outputs=outputs
+            )
+        except Exception as e:
+            for _, future, _ in loaded:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.images += len(loaded)
+        for (_, future, _), result in zip(loaded, results):
+            future.set_result(result)
+
+
+def encode_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    # masks travel as compressed COCO RLE
+    return {
+        "boxes": np.asarray(result["boxes"], dtype=np.float32).reshape(-1, 4).tolist(),
+        "scores": np.asarray(result["scores"], dtype=np.float32).reshape(-1).tolist(),
+        "labels": list(result["labels"]),
+        "masks": [mask_utils.encode_rle(mask) for mask in result["masks"]] if getattr(result["masks"], "resolved", True) else [],
+        "image_path": str(result["image_path"]),
+        "image_shape": [int(v) for v in result["image_shape"]],
+    }
+
+
+def decode_result(data: Dict[str, Any], compact_masks: bool = False) -> Dict[str, Any]:
+    if "error" in data:
+        raise ValueError(f"{Path(data['image_path']).name}: {data['error']}")
+
+    image_shape = tuple(data["image_shape"])
+    if not data["labels"]:
+        return {
+            "boxes": [],
+            "masks": [],
+            "scores": [],
+            "labels": [],
+            "image_path": data["image_path"],
+            "image_shape": image_shape
+        }
+
+    # box-only requests come back without masks; compact masks are decoded straight into their box crop
+    if compact_masks:
+        masks = [mask_utils.decode_rle_compact(rle) for rle in data["masks"]]
+    else:
+        masks = [mask_utils.decode_rle(rle) for rle in data["masks"]]
+    return {
+        "boxes": np.asarray(data["boxes"], dtype=np.float32),
+        "masks": masks if compact_masks or not masks else np.stack(masks),
+        "scores": np.asarray(data["scores"], dtype=np.float32),
+        "labels": data["labels"],
+        "image_shape": image_shape,
+        "image_path": data["image_path"]
+    }
+
+
+class RemotePredictor:
+    """Client with the predict/predict_batch interface of GroundedSAM2Predictor, served by a running src.server."""
+    def __init__(self, url: str, timeout: Optional[float] = None, outputs: Tuple[str, ...] = ("boxes", "masks")):
+        self.url = url.rstrip("/")
+        self.outputs = tuple(outputs)
+        self.timeout = timeout
+        self.tracer = NULL_TRACER
+        self.tile_size = 0
+
+        health = self._request("GET", "/health")
+        print(f"Using annotation server at {self.url} (device: {health['device']})")
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return request_json(self.url, method, path, payload, timeout=self.timeout)
+
+    def replicate(self) -> "RemotePredictor":
+        # requests are independent, so replicas just send concurrently and the server batches them
+        return self
+
+    def load_image(self, image_path: str):
+        # the server decodes images itself from the shared filesystem
+        return None, None
+
+    def predict(self, image_path: str, classes: List[str], batch_size: int = 0, multimask_output: bool = False,
+                compact_masks: bool = False, outputs: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        return self.predict_batch(
+            [image_path], classes, batch_size, multimask_output, compact_masks=compact_masks, outputs=outputs
+        )[0]
+
+    def predict_batch(self, image_paths: List[str], classes: List[str], batch_size: int = 0, multimask_output: bool = False,
+                      images=None, compact_masks: bool = False, outputs: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        response = self._request("POST", "/predict", {
+            "image_paths": [str(Path(image_path).resolve()) for image_path in image_paths],
+            "classes": list(classes),
+            "batch_size": batch_size,
+            "multimask_output": multimask_output,
+            "outputs": list(self.outputs if outputs is None else outputs),
+        })
+        results = [decode_result(data, compact_masks) for data in response["results"]]
+        # report the paths the caller used
+        for result, image_path in zip(results, image_paths):
+            result["image_path"] = str(image_path)
+        return results
+
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+    scheduler: BatchScheduler = None
+    device: str = ""
+    settings: Dict[str, Any] = {}
+
+    def _send(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send(200, {
+            "status": "ok",
+            "device": self.device,
+            "settings": self.settings,
+            "batches": self.scheduler.batches,
+            "images": self.scheduler.images
+        })
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            image_paths = list(request.get("image_paths", []))
+            options = (
+                tuple(request["classes"]),
+                int(request.get("batch_size", 0)),
+                bool(request.get("multimask_output", False)),
+                tuple(request.get("outputs", ["boxes", "masks"]))
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": f"Bad request: {e}"})
+            return
+
+        futures = [self.scheduler.submit(image_path, options) for image_path in image_paths]
+        results = []
+        for image_path, future in zip(image_paths, futures):
+            try:
+                results.append(encode_result(future.result()))
+            except Exception as e:
+                results.append({"image_path": image_path, "error": str(e)})
+        self._send(200, {"results": results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Keep GroundedSAM2Predictor loaded and serve annotation requests over localhost HTTP")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=8, help="Images per coalesced forward pass")
+    parser.add_argument('--max-latency-ms', type=float, default=50, help="Longest a request waits for others to join its batch")
+    parser.add_argument('--decode-workers', type=int, default=4, help="Threads decoding images")
+    # --batch-size, --multimask-output and --compact-masks are sent with each request, and
+    # --max-batch-size replaces --image-batch-size, so those flags of the group are not used here
+    add_model_args(parser)
+    add_embedding_args(parser)
+    add_cpu_args(parser)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    check_model_files(args)
+    validate_cpu_args(args)
+    predictor = load_predictor(args)
+
+    scheduler = BatchScheduler(predictor, args.max_batch_size, args.max_latency_ms / 1000, args.decode_workers)
+    AnnotationHandler.scheduler = scheduler
+    AnnotationHandler.device = args.device
+    AnnotationHandler.settings = model_settings(args)
+
+    server = ThreadingHTTPServer((args.host, args.port), AnnotationHandler)
+    print(f"Annotation server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+
+def add_queue_args(parser):
+    group = parser.add_argument_group("work queue")
+    group.add_argument('--queue-dir', default=None, help="Shared directory for chunk leases; enables multi-worker mode")
+    group.add_argument('--chunk-size', type=int, default=100, help="Images per work-queue chunk")
+    group.add_argument('--lease-timeout', type=float, default=600, help="Seconds without a heartbeat before a chunk can be re-claimed")
+    group.add_argument('--worker-id', default=None, help="Name of this worker (default: <hostname>-<pid>)")
+    return parser
+
+
+class LeaseQueue:
+    """
+    Work queue shared between workers through a directory on a common filesystem.
+
+    The image list is split into chunks once (chunks.json). A worker claims a chunk by
+    atomically creating chunk_NNNNN.lease, refreshes its mtime while working, and writes
+    chunk_NNNNN.done when the chunk's partial result is saved. Leases that are not
+    refreshed within lease_timeout seconds are taken over by other workers.
+    """
+    def __init__(self, queue_dir: str, worker_id: Optional[str] = None,
+                 lease_timeout: float = 600, poll_interval: float = 10):
+        self.queue_dir = Path(queue_dir)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.poll_interval = min(poll_interval, lease_timeout / 3)
+        self.manifest_path = self.queue_dir / "chunks.json"
+        self.chunks: List[List[str]] = []
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.queue_dir, worker_id=args.worker_id, lease_timeout=args.lease_timeout)
+
+    def create(self, items: List[str], chunk_size: int):
+        """Write the chunk list unless another worker already did, then load it."""
+        if not self.manifest_path.exists():
+            items = sorted(str(item) for item in items)
+            chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+            tmp_path = self.queue_dir / f"chunks.{self.worker_id}.tmp"
+            tmp_path.write_text(json.dumps(chunks))
+            try:
+                # link fails if the manifest exists, so exactly one worker publishes it
+                os.link(tmp_path, self.manifest_path)
+            except FileExistsError:
+                pass
+            finally:
+                tmp_path.unlink()
+
+        self.chunks = json.loads(self.manifest_path.read_text())
+        return self
+
+    def chunk_name(self, index: int) -> str:
+        return f"chunk_{index:05d}"
+
+    def _lease_path(self, index: int) -> Path:
+        return self.queue_dir / f"{self.chunk_name(index)}.lease"
+
+    def _done_path(self, index: int) -> Path:
+        return self.queue_dir / f"{self.chunk_name(index)}.done"
+
+    def _owner(self, index: int) -> Optional[str]:
+        # a worker checking an expired-looking lease moves it aside for a moment, so retry briefly
+        for _ in range(3):
+            try:
+                return self._lease_path(index).read_text()
+            except FileNotFoundError:
+                time.sleep(0.1)
+        return None
+
+    def _expired(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime > self.lease_timeout
+        except FileNotFoundError:
+            return True
+
+    def _try_claim(self, index: int) -> bool:
+        lease = self._lease_path(index)
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._expired(lease):
+                return False
+
+            # move the stale lease aside; only one worker's rename can succeed
+            stale = lease.with_name(f"{lease.name}.{self.worker_id}.stale")
+            try:
+                os.rename(lease, stale)
+            except FileNotFoundError:
+                return False
+            if not self._expired(stale):
+                # someone renewed it between our check and the rename; put it back
+                try:
+                    os.link(stale, lease)
+                except FileExistsError:
+                    pass
+                stale.unlink()
+                return False
+            stale.unlink()
+
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+
+        with os.fdopen(fd, "w") as f:
+            f.write(self.worker_id)
+        return True
+
+    def claim(self) -> Tuple[Optional[int], bool]:
+        """Return (chunk index or None, whether unfinished chunks are still leased by others)."""
+        waiting = False
+        for index in range(len(self.chunks)):
+            if self._done_path(index).exists():
+                continue
+            if self._try_claim(index):
+                return index, True
+            waiting = True
+        return None, waiting
+
+    def claim_all(self) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (chunk name, items) until every chunk is done, waiting on chunks other workers hold."""
+        while True:
+            index, waiting = self.claim()
+            if index is not None:
+                with self._hold(index):
+                    yield self.chunk_name(index), self.chunks[index]
+                continue
+            if not waiting:
+                return
+            time.sleep(self.poll_interval)
+
+    @contextmanager
+    def _hold(self, index: int):
+        lease = self._lease_path(index)
+        stop = threading.Event()
+
+        def heartbeat():
+            # keep beating through transient misses; only the owner's lease is refreshed
+            while not stop.wait(self.lease_timeout / 3):
+                if self._owner(index) == self.worker_id:
+                    try:
+                        os.utime(lease)
+                    except FileNotFoundError:
+                        pass
+
+        def release(done: bool):
+            stop.set()
+            if self._owner(index) != self.worker_id:
+                # the lease expired and another worker re-claimed the chunk; its result and .done are theirs
+                print(f"[{self.worker_id}] Lost the lease on {self.chunk_name(index)} to another worker")
+                return
+            if done:
+                self._done_path(index).write_text(self.worker_id)
+            lease.unlink(missing_ok=True)
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        except BaseException:
+            release(done=False)
+            raise
+        else:
+            release(done=True)
+        finally:
+            thread.join()
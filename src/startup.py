@@ -0,0 +1,117 @@
+import os
+import time
+from pathlib import Path
+from .cpu_profile import compare_precision, thread_count, validate_cpu_args
+from .profiler import Tracer
+
+# module import time stands in for process start: the CLIs import this before parsing arguments
+_PROCESS_START = time.perf_counter()
+
+
+def add_model_args(parser):
+    group = parser.add_argument_group("models")
+    group.add_argument('--sam2-checkpoint', default="Grounded-SAM-2/checkpoints/sam2.1_hiera_large.pt")
+    group.add_argument('--sam2-model-config', default="configs/sam2.1/sam2.1_hiera_l.yaml")
+    group.add_argument('--grounding-dino-config', default="Grounded-SAM-2/grounding_dino/groundingdino/config/GroundingDINO_SwinT_OGC.py")
+    group.add_argument('--grounding-dino-checkpoint', default="Grounded-SAM-2/gdino_checkpoints/groundingdino_swint_ogc.pth")
+    group.add_argument('--box-threshold', type=float, default=0.35)
+    group.add_argument('--text-threshold', type=float, default=0.35)
+    group.add_argument('--device', default="cuda")
+    group.add_argument('--multimask-output', action="store_true")
+    group.add_argument('--batch-size', type=int, default=0, help="Classes per Grounding DINO prompt (0 packs as many as fit in the text encoder's token limit)")
+    group.add_argument('--compact-masks', action="store_true", help="Keep masks as bit-packed box crops instead of full-resolution arrays")
+    group.add_argument('--sam2-memory-mb', type=float, default=1024, help="Memory budget for SAM2 mask decoding; boxes are decoded in micro-batches that fit it")
+    group.add_argument('--tile-size', type=int, default=0, help="Detect on overlapping tiles of this size for high-resolution images (0 disables tiling)")
+    group.add_argument('--tile-overlap', type=int, default=256, help="Overlap between neighbouring tiles in pixels")
+    group.add_argument('--crop-padding', type=int, default=64, help="Context in pixels around detections for the SAM2 crops in tiled mode")
+    group.add_argument('--tile-batch-size', type=int, default=4, help="Tiles (and SAM2 crops) per batched forward pass in tiled mode")
+    group.add_argument('--image-batch-size', type=int, default=1, help="Number of images per batched forward pass")
+    return parser
+
+
+def validate_args(args):
+    """Fail on bad paths before anything heavy is imported or loaded."""
+    if args.input_dir and not Path(args.input_dir).is_dir():
+        raise ValueError(f"Input directory not found: {args.input_dir}")
+    if not args.input_dir and args.img_path and not Path(args.img_path).is_file():
+        raise ValueError(f"Image not found: {args.img_path}")
+    if not args.server:
+        check_model_files(args)
+    validate_cpu_args(args)
+
+
+def check_model_files(args):
+    # sam2_model_config is a hydra config name resolved inside the sam2 package, so it is not checked here
+    missing = [
+        f"--{name.replace('_', '-')} {getattr(args, name)}"
+        for name in ("sam2_checkpoint", "grounding_dino_config", "grounding_dino_checkpoint")
+        if not os.path.isfile(getattr(args, name))
+    ]
+    if missing:
+        raise ValueError("Model files not found: " + ", ".join(missing))
+
+
+def load_predictor(args, image_files=(), classes=(), outputs=("boxes", "masks"), manifest=None):
+    """
+    Import the model stack and build GroundedSAM2Predictor from CLI args, reporting startup time per phase.
+    With --accuracy-sample the predictor starts in fp32 and is switched to --precision after the comparison.
+    """
+    setup_done = time.perf_counter()
+    from .GroundedSAM2Predictor import GroundedSAM2Predictor
+    imports_done = time.perf_counter()
+
+    predictor = GroundedSAM2Predictor(
+        sam2_model_config=args.sam2_model_config,
+        sam2_checkpoint=args.sam2_checkpoint,
+        grounding_dino_config=args.grounding_dino_config,
+        grounding_dino_checkpoint=args.grounding_dino_checkpoint,
+        device=args.device,
+        box_threshold=args.box_threshold,
+        text_threshold=args.text_threshold,
+        embedding_dir=args.embedding_dir,
+        embedding_dtype=args.embedding_dtype,
+        sam2_memory_mb=args.sam2_memory_mb,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        crop_padding=args.crop_padding,
+        tile_batch_size=args.tile_batch_size,
+        precision="fp32" if args.accuracy_sample else args.precision,
+        num_threads=thread_count(args),
+        interop_threads=args.interop_threads,
+        outputs=outputs,
+        manifest=manifest
+    )
+    models_done = time.perf_counter()
+
+    loads = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in predictor.load_times.items())
+    if len(predictor.load_times) > 1:
+        loads += ", in parallel"
+    print(
+        f"[Startup] setup {setup_done - _PROCESS_START:.2f}s | imports {imports_done - setup_done:.2f}s"
+        f" | models {models_done - imports_done:.2f}s ({loads})"
+        f" | total {models_done - _PROCESS_START:.2f}s"
+    )
+
+    if args.accuracy_sample:
+        compare_precision(predictor, list(image_files), list(classes), args)
+    return predictor
+
+
+def predictor_outputs(args, needs_masks: bool):
+    # SAM2 is only built when an output needs masks; sequence mode propagates its own masks
+    if needs_masks and not args.sequence:
+        return ("boxes", "masks")
+    return ("boxes",)
+
+
+def build_predictor(args, outputs, image_files=(), classes=(), manifest=None):
+    if args.server:
+        # models, thresholds and tiling are those the server was started with
+        if args.sequence:
+            raise ValueError("--sequence cannot be combined with --server: SAM2 video propagation runs locally.")
+        from .server import RemotePredictor
+        predictor = RemotePredictor(args.server, outputs=outputs)
+    else:
+        predictor = load_predictor(args, image_files, classes, outputs, manifest)
+    predictor.tracer = Tracer.from_args(args)
+    return predictor
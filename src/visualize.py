@@ -1,141 +1,458 @@
+import os
 import cv2
+import json
+import zlib
+import random
 import argparse
-from pathlib import Path
+import numpy as np
 import supervision
-from typing import Optional
+import xml.etree.ElementTree as ET
+from array import array
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from tqdm import tqdm
+from PIL import Image
+from .manifest import IMAGE_EXTENSIONS
+from .exporters import VOID_COLOR, VOID_INDEX
+from .mask_utils import decode_rle
+
+
+class JsonArrayReader:
+    """
+    Walks the top level of a large JSON object without loading it.
+    Array members are yielded one item at a time together with the item's byte span, so
+    a later reader can seek straight to it. The file is read as latin-1, which maps every
+    byte to one character; that keeps string offsets equal to file offsets.
+    """
+    def __init__(self, path: str, chunk_size: int = 1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.file.read(self.chunk_size)
+        self.base += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"{self.path}: expected '{char}' at byte {self.base + self.pos}")
+        self.pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # the value runs past the buffered text
+                if not self._fill():
+                    raise
+                continue
+            # a number ending exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[Tuple[str, int, int, Any]]:
+        """Yield (key, offset, length, value) for scalars and objects, and per item for arrays."""
+        with open(self.path, "r", encoding="latin-1") as self.file:
+            self.buf, self.pos, self.base = "", 0, 0
+            self._expect("{")
+            while self._peek() != "}":
+                if self._peek() == ",":
+                    self.pos += 1
+                    continue
+                key = self._value()
+                self._expect(":")
+                if self._peek() != "[":
+                    start = self.base + self.pos
+                    value = self._value()
+                    yield key, start, self.base + self.pos - start, value
+                    continue
+
+                self.pos += 1
+                while self._peek() != "]":
+                    if self._peek() == ",":
+                        self.pos += 1
+                        continue
+                    start = self.base + self.pos
+                    item = self._value()
+                    yield key, start, self.base + self.pos - start, item
+                self.pos += 1
+
+
+def _text(value: str) -> str:
+    # undo the latin-1 reading for names that are shown or used as paths;
+    # characters written as \u escapes were already decoded correctly
+    try:
+        return value.encode("latin-1").decode("utf-8")
+    except UnicodeError:
+        return value
+
+
+def _sample(items: List[Any], max_images: int, sample: str, seed: int) -> List[Any]:
+    if max_images <= 0 or len(items) <= max_images:
+        return items
+    if sample == "random":
+        indices = sorted(random.Random(seed).sample(range(len(items)), max_images))
+        return [items[i] for i in indices]
+    return items[:max_images]
+
+
+class VisualizationSet:
+    """Render jobs for the selected images; annotations stay on disk until a worker needs them."""
+    def __init__(self, format: str, jobs: List[Dict[str, Any]], classes: Optional[Dict[int, str]] = None,
+                 annotations_path: Optional[str] = None, total: int = 0):
+        self.format = format
+        self.jobs = jobs
+        self.classes = classes
+        self.annotations_path = annotations_path
+        self.total = total
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(state: Dict[str, Any]):
+    _WORKER.clear()
+    _WORKER.update(state)
+    _WORKER["class_index"] = {cat_id: i for i, cat_id in enumerate(state["classes"] or {})}
+    if state["mode"] == "bbox":
+        _WORKER["box_annotator"] = supervision.BoxAnnotator()
+        _WORKER["label_annotator"] = supervision.LabelAnnotator()
+    else:
+        _WORKER["mask_annotator"] = supervision.MaskAnnotator()
+
+
+def _read_scaled(path: str, size: Optional[Tuple[int, int]], max_size: int):
+    """Read an image no larger than max_size on its long side; returns (image, (orig_w, orig_h))."""
+    flags = cv2.IMREAD_COLOR
+    if max_size > 0 and not size and path.lower().endswith((".jpg", ".jpeg")):
+        # PIL only parses the header for .size
+        with Image.open(path) as img:
+            size = img.size
+    if max_size > 0 and size and path.lower().endswith((".jpg", ".jpeg")):
+        # libjpeg can decode at 1/2, 1/4 or 1/8 scale, which skips most of the IDCT work
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) / factor >= max_size:
+                flags = reduced
+                break
+
+    image = cv2.imread(path, flags)
+    if image is None:
+        return None, None
+    if flags == cv2.IMREAD_COLOR or not size:
+        size = (image.shape[1], image.shape[0])
+
+    if max_size > 0 and max(image.shape[:2]) > max_size:
+        scale = max_size / max(size)
+        target = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        image = cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+    return image, size
+
+
+def _scaled_mask(mask: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    if mask.shape == shape:
+        return mask.astype(bool, copy=False)
+    return cv2.resize(mask.astype(np.uint8), (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+
+def _coco_mask(segmentation, orig_size: Tuple[int, int], shape: Tuple[int, int]) -> np.ndarray:
+    mask = np.zeros(shape, dtype=np.uint8)
+    if isinstance(segmentation, dict) and "counts" in segmentation:
+        return _scaled_mask(decode_rle(segmentation), shape)
+    if isinstance(segmentation, list) and segmentation:
+        sx, sy = shape[1] / orig_size[0], shape[0] / orig_size[1]
+        polygons = segmentation if isinstance(segmentation[0], list) else [segmentation]
+        points = [
+            np.round(np.asarray(polygon, dtype=np.float64).reshape(-1, 2) * (sx, sy)).astype(np.int32)
+            for polygon in polygons if len(polygon) >= 6
+        ]
+        if points:
+            cv2.fillPoly(mask, points, 1)
+    return mask.astype(bool)
+
+
+def _coco_objects(job: Dict[str, Any], orig_size, shape, with_masks: bool):
+    if "annotations_file" not in _WORKER:
+        _WORKER["annotations_file"] = open(_WORKER["annotations_path"], "rb")
+    f = _WORKER["annotations_file"]
+    classes = _WORKER["classes"]
+    class_index = _WORKER["class_index"]
+    sx, sy = shape[1] / orig_size[0], shape[0] / orig_size[1]
+
+    xyxy, class_ids, names, masks = [], [], [], []
+    spans = job["spans"]
+    for offset, length in zip(spans[0::2], spans[1::2]):
+        f.seek(offset)
+        annotation = json.loads(f.read(length))
+        x, y, w, h = annotation["bbox"]
+        xyxy.append([x * sx, y * sy, (x + w) * sx, (y + h) * sy])
+        class_ids.append(class_index.get(annotation["category_id"], 0))
+        names.append(classes.get(annotation["category_id"], str(annotation["category_id"])))
+        if with_masks:
+            masks.append(_coco_mask(annotation.get("segmentation"), orig_size, shape))
+    return xyxy, class_ids, names, masks
+
+
+def _voc_objects(job: Dict[str, Any], orig_size, shape, with_masks: bool):
+    xyxy, class_ids, names, polygons = [], [], [], []
+    if job["xml_path"] is not None:
+        root = ET.parse(job["xml_path"]).getroot()
+        for obj in root.findall("object"):
+            name = obj.findtext("name")
+            box = obj.find("bndbox")
+            # read as written: PascalVOCExporter stores pixel coordinates without a 1-based offset
+            x0, y0, x1, y1 = (float(box.findtext(tag)) for tag in ("xmin", "ymin", "xmax", "ymax"))
+            xyxy.append([min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)])
+            names.append(name)
+            # a stable id per class name keeps colors consistent across worker processes
+            class_ids.append(zlib.crc32(name.encode()) & 0x7fffffff)
+            points = []
+            for polygon in obj.findall("polygon"):
+                values = [float(element.text) for element in polygon]
+                points.append(np.asarray(values).reshape(-1, 2))
+            polygons.append(points)
+
+    sx, sy = shape[1] / orig_size[0], shape[0] / orig_size[1]
+    xyxy = [[x0 * sx, y0 * sy, x1 * sx, y1 * sy] for x0, y0, x1, y1 in xyxy]
+    masks = []
+    if with_masks:
+        label_map, void = None, None
+        if job["label_path"] is not None and not any(polygons):
+            with Image.open(job["label_path"]) as label_img:
+                if label_img.mode in ("P", "L"):
+                    label_map, void = np.asarray(label_img), VOID_INDEX
+                else:
+                    # label maps from before the palettized exporter are RGB; one packed value per color
+                    rgb = np.asarray(label_img.convert("RGB")).astype(np.int32)
+                    label_map = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+                    void = (VOID_COLOR[0] << 16) | (VOID_COLOR[1] << 8) | VOID_COLOR[2]
+            label_map = cv2.resize(label_map, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+        for box, points in zip(xyxy, polygons):
+            mask = np.zeros(shape, dtype=np.uint8)
+            x0, y0, x1, y1 = (int(round(v)) for v in box)
+            if points:
+                cv2.fillPoly(mask, [np.round(p * (sx, sy)).astype(np.int32) for p in points], 1)
+            elif label_map is not None:
+                # SegmentationClass holds one class per pixel; take the dominant
+                # foreground value inside the box as this object's region
+                region = label_map[max(y0, 0):y1 + 1, max(x0, 0):x1 + 1]
+                values, counts = np.unique(region[(region != 0) & (region != void)], return_counts=True)
+                if values.size:
+                    mask[max(y0, 0):y1 + 1, max(x0, 0):x1 + 1] = region == values[counts.argmax()]
+            else:
+                # no polygon and no label map: show the box, as the supervision loader did with force_masks
+                mask[max(y0, 0):y1 + 1, max(x0, 0):x1 + 1] = 1
+            masks.append(mask.astype(bool))
+    return xyxy, class_ids, names, masks
+
+
+def _render(job: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    mode = _WORKER["mode"]
+    image, orig_size = _read_scaled(job["image_path"], job.get("size"), _WORKER["max_size"])
+    if image is None:
+        return job["name"], f"could not read {job['image_path']}"
+
+    shape = image.shape[:2]
+    objects = _coco_objects if _WORKER["format"] == "coco" else _voc_objects
+    xyxy, class_ids, names, masks = objects(job, orig_size, shape, with_masks=(mode == "seg"))
+
+    detections = supervision.Detections(
+        xyxy=np.asarray(xyxy, dtype=np.float32).reshape(-1, 4),
+        class_id=np.asarray(class_ids, dtype=int),
+        mask=np.asarray(masks, dtype=bool).reshape(-1, *shape) if mode == "seg" else None
+    )
+
+    if mode == "bbox":
+        annotated_frame = _WORKER["box_annotator"].annotate(scene=image.copy(), detections=detections)
+        annotated_frame = _WORKER["label_annotator"].annotate(scene=annotated_frame, detections=detections, labels=names)
+    else:
+        annotated_frame = _WORKER["mask_annotator"].annotate(scene=image.copy(), detections=detections)
+
+    cv2.imwrite(str(Path(_WORKER["output_dir"]) / Path(job["name"]).name), annotated_frame)
+    return job["name"], None
+
 
 class Visulizer:
-    def __init__(self, datasetdir: str, output_dir: str):
+    def __init__(self, datasetdir: str, output_dir: str, workers: int = 0, max_size: int = 0):
         self.datasetdir = Path(datasetdir)
         if not self.datasetdir.exists():
             raise ValueError(f"Dataset directory {datasetdir} does not exist.")
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        
+        self.workers = workers if workers > 0 else os.cpu_count() or 1
+        self.max_size = max_size
+
         self.current_images_dir: Optional[Path] = None
-    
-    def load_dataset(self, format: str, task) -> supervision.DetectionDataset:
+        self._image_names: Optional[set] = None
+
+    def load_dataset(self, format: str, max_images: int = 0, sample: str = "first", seed: int = 0) -> VisualizationSet:
         print(f"Loading dataset in {format} format...")
         try:
             if format.lower() == "coco":
                 self.current_images_dir = self.datasetdir / "images"
-                ds = supervision.DetectionDataset.from_coco(
-                    images_directory_path=str(self.current_images_dir),
-                    annotations_path = str(self.datasetdir / "annotations" / "instances.json")
-                )
+                ds = self._load_coco(self.datasetdir / "annotations" / "instances.json", max_images, sample, seed)
             elif format.lower() == "pascal_voc":
                 self.current_images_dir = self.datasetdir / "JPEGImages"
-                ds = supervision.DetectionDataset.from_pascal_voc(
-                    images_directory_path=str(self.current_images_dir),
-                    annotations_directory_path=str(self.datasetdir / "Annotations"),
-                    force_masks= (task == "seg")
-                )
+                ds = self._load_pascal_voc(max_images, sample, seed)
             else:
                 raise ValueError(f"Unknown format: {format}")
         except Exception as e:
             print(f"Error loading dataset: {e}")
             raise e
-        
-        print(f"Loaded dataset with {len(ds)} images and {len(ds.classes)} classes.")
+
+        classes = f" and {len(ds.classes)} classes" if ds.classes is not None else ""
+        print(f"Selected {len(ds)} of {ds.total} images{classes}.")
         return ds
-    
-    def _read_image(self, image_name: str) -> tuple[Optional[cv2.Mat], str]:
-        candidates = []
-        
-        if self.current_images_dir:
-            candidates.append(self.current_images_dir / image_name)
-            candidates.append(self.current_images_dir / Path(image_name).name)
 
-        candidates.append(Path(image_name))
-        
-        candidates.append(self.datasetdir / image_name)
+    def _listing(self, directory: Path) -> set:
+        try:
+            with os.scandir(directory) as it:
+                return {entry.name for entry in it}
+        except FileNotFoundError:
+            return set()
 
-        print(f"Trying to load image for key '{image_name}' from paths: {[str(path) for path in candidates]}")
+    def _resolve(self, image_name: str) -> Optional[Path]:
+        # the key is tried relative to the images directory, by file name, as given and relative
+        # to the dataset; one listing of the images directory answers the common cases without a stat
+        candidates = [Path(image_name), self.datasetdir / image_name]
+        if self.current_images_dir:
+            if self._image_names is None:
+                self._image_names = self._listing(self.current_images_dir)
+            candidates[:0] = [self.current_images_dir / image_name, self.current_images_dir / Path(image_name).name]
         for path in candidates:
-            if path.exists():
-                
-                img = cv2.imread(str(path))
-                if img is not None:
-                    return img, str(path)
-        
-        default_path = str(candidates[0]) if candidates else image_name
-        return None, default_path
-
-    def visualize_bbox(self, dataset: supervision.DetectionDataset):
-        box_annotator = supervision.BoxAnnotator()
-        label_annotator = supervision.LabelAnnotator()
-
-        image_names = list(dataset.annotations.keys())
-        if not image_names:
-            print("No images found in the dataset for visualization.")
-            return
-        
-        print(f"Processing {len(image_names)} images...")
+            if self.current_images_dir and path.parent == self.current_images_dir:
+                if path.name in self._image_names:
+                    return path
+            elif path.is_file():
+                return path
+        return None
+
+    def _load_coco(self, annotations_path: Path, max_images: int, sample: str, seed: int) -> VisualizationSet:
+        # one streaming pass: images and categories are kept, annotations only as byte spans
+        classes: Dict[int, str] = {}
+        images: List[Tuple[int, str, int, int]] = []
+        selected = None
+        spans: Dict[int, array] = {}
 
-        for image_name in image_names:
-            image, loaded_path = self._read_image(image_name)
+        for key, offset, length, value in JsonArrayReader(str(annotations_path)).members():
+            if key == "categories":
+                classes[value["id"]] = _text(value["name"])
+            elif key == "images":
+                images.append((value["id"], _text(value["file_name"]), value.get("width"), value.get("height")))
+            elif key == "annotations":
+                if selected is None and images:
+                    # images came first, so annotations of unselected images need not be kept
+                    selected = {image[0] for image in _sample(images, max_images, sample, seed)}
+                if selected is not None and value["image_id"] not in selected:
+                    continue
+                spans.setdefault(value["image_id"], array("q")).extend((offset, length))
 
-            if image is None:
-                print(f"Warning: Could not load image for key '{image_name}'. Checked paths like: {loaded_path}. Skipping.")
+        jobs = []
+        for image_id, file_name, width, height in _sample(images, max_images, sample, seed):
+            path = self._resolve(file_name)
+            if path is None:
+                print(f"Warning: Could not find image '{file_name}'. Skipping.")
                 continue
+            jobs.append({
+                "name": file_name,
+                "image_path": str(path),
+                "size": (width, height) if width and height else None,
+                "spans": spans.get(image_id, array("q"))
+            })
+        return VisualizationSet("coco", jobs, classes=classes, annotations_path=str(annotations_path), total=len(images))
 
-            detections = dataset.annotations[image_name]
-            labels = [
-                f"{dataset.classes[class_id]}"
-                for class_id in detections.class_id
-            ]
-
-            annotated_frame = box_annotator.annotate(
-                scene=image.copy(),
-                detections=detections
-            )
-            
-            annotated_frame = label_annotator.annotate(
-                scene=annotated_frame,
-                detections=detections,
-                labels=labels
-            )
-
-            save_name = Path(image_name).name
-            cv2.imwrite(
-                str(self.output_dir / save_name),
-                annotated_frame
-            )
-        print(f"saved bounding box images to {self.output_dir}")
+    def _load_pascal_voc(self, max_images: int, sample: str, seed: int) -> VisualizationSet:
+        # plain listings: sampling a few images for review should not read every image
+        annotation_names = self._listing(self.datasetdir / "Annotations")
+        label_names = self._listing(self.datasetdir / "SegmentationClass")
+        image_paths = [
+            self.current_images_dir / name for name in sorted(self._listing(self.current_images_dir))
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith(".")
+        ]
 
-    def visualize_mask(self, dataset: supervision.DetectionDataset):
-        mask_annotator = supervision.MaskAnnotator()
+        jobs = []
+        for path in _sample(image_paths, max_images, sample, seed):
+            jobs.append({
+                "name": path.name,
+                "image_path": str(path),
+                "size": None,
+                "xml_path": str(self.datasetdir / "Annotations" / f"{path.stem}.xml") if f"{path.stem}.xml" in annotation_names else None,
+                "label_path": str(self.datasetdir / "SegmentationClass" / f"{path.stem}.png") if f"{path.stem}.png" in label_names else None
+            })
+        return VisualizationSet("pascal_voc", jobs, total=len(image_paths))
 
-        image_names = list(dataset.annotations.keys())
-        if not image_names:
+    def _render_all(self, dataset: VisualizationSet, mode: str):
+        if not dataset.jobs:
             print("No images found in the dataset for visualization.")
             return
-            
-        print(f"Processing {len(image_names)} images for masks...")
 
-        for image_name in image_names:
-            image, loaded_path = self._read_image(image_name)
+        state = {
+            "format": dataset.format,
+            "mode": mode,
+            "classes": dataset.classes,
+            "annotations_path": dataset.annotations_path,
+            "output_dir": str(self.output_dir),
+            "max_size": self.max_size,
+        }
+        failed = 0
 
-            if image is None:
-                print(f"Warning: Could not load image for key '{image_name}'. Checked paths like: {loaded_path}. Skipping.")
-                continue
+        def report(name, error):
+            nonlocal failed
+            if error is not None:
+                failed += 1
+                print(f"Warning: Could not load image for key '{name}' ({error}). Skipping.")
+
+        with tqdm(total=len(dataset.jobs)) as pbar:
+            if self.workers == 1:
+                _init_worker(state)
+                for job in dataset.jobs:
+                    report(*_render(job))
+                    pbar.update(1)
+            else:
+                # at most a few jobs per worker are queued, so memory does not grow with the dataset
+                window = self.workers * 2
+                jobs = iter(dataset.jobs)
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(state,)) as pool:
+                    pending = set()
+                    for job in jobs:
+                        pending.add(pool.submit(_render, job))
+                        if len(pending) < window:
+                            continue
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            report(*future.result())
+                            pbar.update(1)
+                    for future in wait(pending).done:
+                        report(*future.result())
+                        pbar.update(1)
+
+        print(f"Rendered {len(dataset.jobs) - failed} images ({failed} skipped) with {self.workers} workers.")
 
-            detections = dataset.annotations[image_name]
-
-            # labels = [
-            #     f"{dataset.classes[class_id]}"
-            #     for class_id in detections.class_id
-            # ]
-
-            annotated_frame = mask_annotator.annotate(
-                scene=image.copy(),
-                detections=detections,
-            )
-            save_name = Path(image_name).name
-            cv2.imwrite(
-                str(self.output_dir / save_name),
-                annotated_frame
-            )
+    def visualize_bbox(self, dataset: VisualizationSet):
+        print(f"Processing {len(dataset)} images...")
+        self._render_all(dataset, "bbox")
+        print(f"saved bounding box images to {self.output_dir}")
+
+    def visualize_mask(self, dataset: VisualizationSet):
+        print(f"Processing {len(dataset)} images for masks...")
+        self._render_all(dataset, "seg")
         print(f"saved segmentation masks to {self.output_dir}")
 
 
@@ -169,6 +486,37 @@ def main():
         choices=["bbox", "seg"],
         help="type of visualization to perform (bbox or mask)."
     )
+    parser.add_argument(
+        "--max-images",
+        type=int,
+        default=0,
+        help="render at most this many images (0 renders all)."
+    )
+    parser.add_argument(
+        "--sample",
+        type=str,
+        default="first",
+        choices=["first", "random"],
+        help="which images --max-images keeps: the first ones in dataset order or a random subset."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed for --sample random."
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=0,
+        help="downscale outputs so the longer side is at most this many pixels (0 keeps full resolution)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="rendering processes (0 uses every CPU, 1 renders in this process)."
+    )
 
     args = parser.parse_args()
 
@@ -184,13 +532,17 @@ def main():
 
     visualizer = Visulizer(
         datasetdir=args.dataset_dir, 
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        workers=args.workers,
+        max_size=args.max_size
     )
 
     try:
         dataset = visualizer.load_dataset(
             format=args.format, 
-            task=args.type,
+            max_images=args.max_images,
+            sample=args.sample,
+            seed=args.seed
         )
     except Exception as e:
         print(f"Error loading dataset: {e}")
@@ -0,0 +1,241 @@
+import json
+import re
+import sys
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("cvat_sdk")
+Image = pytest.importorskip("PIL.Image")
+
+from cvat_sdk.core.proxies.tasks import Task
+
+from src import annotate
+
+
+def task_json(task):
+    return {
+        "id": task["id"], "name": task["name"], "url": f"http://localhost/api/tasks/{task['id']}",
+        "size": len(task["files"]), "mode": "annotation", "status": "annotation", "subset": "",
+        "organization": None, "project_id": None, "owner": None, "assignee": None, "bug_tracker": "",
+        "created_date": "2024-01-01T00:00:00Z", "updated_date": "2024-01-01T00:00:00Z",
+        "overlap": None, "segment_size": 0, "data_chunk_size": None,
+        "data_compressed_chunk_type": "imageset", "data_original_chunk_type": "imageset",
+        "dimension": "2d", "data": 1, "image_quality": 70,
+        "jobs": {"count": 0, "completed": 0, "validation": 0, "url": "http://localhost"},
+        "labels": {"url": "http://localhost"},
+    }
+
+
+class MockCVAT(ThreadingHTTPServer):
+    """The task and data endpoints the uploader talks to; fail_after makes the next Upload-Multiple request fail."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.log = []
+        self.fail_after = None
+        self.chunks_received = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def data_requests(self):
+        return [entry for entry in self.log if entry[0] != "login"]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, payload=None, headers=()):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/api/server/about":
+            return self.reply(200, {"name": "CVAT", "description": "", "version": "2.12.0", "logo_url": "", "subtitle": ""})
+        match = re.match(r"/api/tasks/(\d+)/?$", path)
+        if match:
+            return self.reply(200, task_json(self.server.tasks[int(match[1])]))
+        match = re.match(r"/api/tasks/(\d+)/status/?$", path)
+        if match:
+            self.server.log.append(("status", int(match[1])))
+            return self.reply(200, {"state": "Finished", "message": "", "progress": 1.0})
+        self.reply(404, {"detail": path})
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        body = self.read_body()
+        if path == "/api/auth/login":
+            server.log.append(("login",))
+            return self.reply(200, {"key": "token"}, [("Set-Cookie", "sessionid=abc; Path=/"), ("Set-Cookie", "csrftoken=xyz; Path=/")])
+        if path == "/api/tasks":
+            with server.lock:
+                task_id = len(server.tasks) + 1
+                server.tasks[task_id] = {"id": task_id, "name": json.loads(body)["name"], "files": {}, "order": None}
+            server.log.append(("create", task_id))
+            return self.reply(201, task_json(server.tasks[task_id]))
+        match = re.match(r"/api/tasks/(\d+)/data/?$", path)
+        if not match:
+            return self.reply(404, {"detail": path})
+        task = server.tasks[int(match[1])]
+        if "Upload-Start" in self.headers:
+            server.log.append(("start", task["id"]))
+            return self.reply(202, {})
+        if "Upload-Multiple" in self.headers:
+            with server.lock:
+                if server.fail_after is not None and server.chunks_received >= server.fail_after:
+                    server.fail_after = None
+                    return self.reply(500, {"detail": "connection reset"})
+                server.chunks_received += 1
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            names = []
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition").startswith("client_files"):
+                    name = part.get_filename().split("/")[-1]
+                    task["files"][name] = len(part.get_payload(decode=True))
+                    names.append(name)
+            server.log.append(("chunk", task["id"], names))
+            return self.reply(200, {})
+        if "Upload-Finish" in self.headers:
+            task["order"] = json.loads(body)["upload_file_order"]
+            server.log.append(("finish", task["id"]))
+            return self.reply(202, {"rq_id": f"create:task-{task['id']}"})
+        self.reply(400, {"detail": "unexpected upload request"})
+
+
+@pytest.fixture
+def cvat_server():
+    server = MockCVAT()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for i in range(6):
+        Image.new("RGB", (32, 24), (40 * i, 20, 200 - 30 * i)).save(images / f"img_{i}.jpg")
+    annotations = tmp_path / "annotations"
+    annotations.mkdir()
+    (annotations / "instances.json").write_text(json.dumps({
+        "images": [{"id": i + 1, "file_name": f"img_{i}.jpg", "width": 32, "height": 24} for i in range(6)],
+        "annotations": [],
+        "categories": [{"id": 1, "name": "car"}],
+    }))
+    return tmp_path
+
+
+@pytest.fixture
+def run_annotate(monkeypatch, cvat_server, dataset):
+    def make_client(url, username, password):
+        client = make_client_with_auth(url, username, password)
+        client.config.status_check_period = 0.01
+        return client
+
+    make_client_with_auth = annotate.make_client_with_auth
+    imported = []
+    monkeypatch.setattr(annotate, "make_client_with_auth", make_client)
+    monkeypatch.setattr(Task, "import_annotations", lambda self, format_name, filename, **kwargs: imported.append(self.id))
+
+    def run(*extra):
+        # one file per chunk and one request at a time, so the failing request is always the same chunk
+        monkeypatch.setattr(sys, "argv", [
+            "annotate", "-u", cvat_server.url, "-U", "user", "-P", "password",
+            "--format", "coco", "--dataset-dir", str(dataset), "--task-name", "cars", "--labels", "car",
+            "--chunk-mb", "0.000001", "--upload-workers", "1", *extra,
+        ])
+        annotate.main()
+        return imported
+
+    return run
+
+
+def test_upload_sends_start_chunks_finish_then_polls_status(run_annotate, cvat_server, capsys):
+    imported = run_annotate()
+
+    assert "Success!" in capsys.readouterr().out
+    log = cvat_server.data_requests()
+    assert log[:2] == [("create", 1), ("start", 1)]
+    assert [entry[0] for entry in log[2:8]] == ["chunk"] * 6
+    assert log[8] == ("finish", 1)
+    assert log[9:] and all(entry == ("status", 1) for entry in log[9:])
+
+    names = [f"img_{i}.jpg" for i in range(6)]
+    task = cvat_server.tasks[1]
+    assert sorted(task["files"]) == names
+    assert task["order"] == names
+    assert imported == [1]
+
+
+def test_interrupted_chunk_resumes_with_remaining_chunks(run_annotate, cvat_server, dataset, capsys):
+    cvat_server.fail_after = 2
+    run_annotate()
+
+    out = capsys.readouterr().out
+    assert "rerun with --resume" in out
+    record = json.loads((dataset / annotate.PROGRESS_FILE).read_text())
+    uploaded = record["tasks"][0]["uploaded"]
+    # the chunk already in flight when the third one failed may still have landed
+    assert 2 not in uploaded and {0, 1} <= set(uploaded)
+    remaining = [i for i in range(6) if i not in uploaded]
+    first_run = len(cvat_server.log)
+
+    imported = run_annotate("--resume")
+
+    out = capsys.readouterr().out
+    assert f"Resuming upload: {len(uploaded)}/6 chunks already on the server" in out
+    assert "Success!" in out
+    log = [entry for entry in cvat_server.log[first_run:] if entry[0] != "login"]
+    assert [entry[0] for entry in log[:len(remaining)]] == ["chunk"] * len(remaining)
+    assert [entry[2] for entry in log[:len(remaining)]] == [[f"img_{i}.jpg"] for i in remaining]
+    assert log[len(remaining)] == ("finish", 1)
+    assert ("create", 2) not in log and ("start", 1) not in log
+    assert sorted(cvat_server.tasks[1]["files"]) == [f"img_{i}.jpg" for i in range(6)]
+    assert imported == [1]
+
+
+def test_resume_refuses_a_changed_image_list(run_annotate, cvat_server, dataset, capsys):
+    cvat_server.fail_after = 2
+    run_annotate()
+    Image.new("RGB", (32, 24)).save(dataset / "images" / "img_6.jpg")
+    capsys.readouterr()
+
+    run_annotate("--resume")
+
+    assert "records a different upload" in capsys.readouterr().out
+    assert len(cvat_server.tasks) == 1
+
+
+def test_coco_fallback_ignores_manifest_and_progress_files(tmp_path):
+    (tmp_path / ".manifest.json").write_text("{}")
+    (tmp_path / annotate.PROGRESS_FILE).write_text("{}")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "instances_det.json").write_text("{}")
+
+    assert annotate.prepare_zip_for_upload("coco", tmp_path, tmp_path) == str(tmp_path / "out" / "instances_det.json")
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+import pytest
+
+torch = pytest.importorskip("torch")
+misc = pytest.importorskip("groundingdino.util.misc")
+
+from src.embedding_cache import CachedBackboneBody, EmbeddingStore
+
+
+class ToyBackbone(torch.nn.Module):
+    """Two strided conv levels returning NestedTensors, like the backbone body inside the Joiner."""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv1 = torch.nn.Conv2d(3, 4, 3, stride=2, padding=1)
+        self.conv2 = torch.nn.Conv2d(4, 8, 3, stride=2, padding=1)
+
+    def forward(self, tensor_list):
+        tensors, mask = tensor_list.decompose()
+        out = OrderedDict()
+        x = tensors
+        for name, conv in (("0", self.conv1), ("1", self.conv2)):
+            x = conv(x)
+            level_mask = torch.nn.functional.interpolate(mask[None].float(), size=x.shape[-2:])[0].bool()
+            out[name] = misc.NestedTensor(x, level_mask)
+        return out
+
+
+def features(body, images, keys=None):
+    body.keys = keys
+    with torch.no_grad():
+        out = body(misc.nested_tensor_from_tensor_list(images))
+    return {name: x.tensors for name, x in out.items()}
+
+
+def test_stored_features_match_the_image_run_alone(tmp_path):
+    images = [torch.rand(3, 32, 48), torch.rand(3, 24, 40)]
+    backbone = ToyBackbone()
+    body = CachedBackboneBody(backbone, EmbeddingStore(tmp_path, {"model": "toy"}))
+
+    cold = features(body, images, keys=["a", "b"])
+    warm = features(body, images, keys=["a", "b"])
+
+    for name in cold:
+        assert torch.equal(cold[name], warm[name])
+        for i, image in enumerate(images):
+            alone = features(body, [image])[name][0]
+            h, w = alone.shape[-2:]
+            torch.testing.assert_close(cold[name][i, :, :h, :w], alone)
+            # the rest of the padded batch is zero, as the masks say
+            assert not cold[name][i, :, h:, :].any() and not cold[name][i, :, :, w:].any()
+
+
+def test_same_size_batches_match_the_plain_batched_path(tmp_path):
+    images = [torch.rand(3, 32, 48) for _ in range(3)]
+    body = CachedBackboneBody(ToyBackbone(), EmbeddingStore(tmp_path, {"model": "toy"}))
+
+    plain = features(body, images)
+    stored = features(body, images, keys=["a", "b", "c"])
+
+    for name in plain:
+        torch.testing.assert_close(stored[name], plain[name])
+
+
+def test_load_keeps_the_dtype_and_reads_through_the_memory_map(tmp_path):
+    store = EmbeddingStore(tmp_path, {"model": "toy"})
+    tensors = {"image_embed": torch.rand(4, 8, 8, dtype=torch.float16)}
+    store.save("key", "sam2", tensors)
+
+    loaded = store.load("key", "sam2")
+
+    assert loaded["image_embed"].dtype == torch.float16
+    assert torch.equal(loaded["image_embed"], tensors["image_embed"])
+    assert store.load("other", "sam2") is None
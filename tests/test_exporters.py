@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+Image = pytest.importorskip("PIL.Image")
+
+from src import exporters
+from src.mask_utils import CompactMask
+
+COLORMAP = [(0, 0, 0), (128, 0, 0), (0, 128, 0), (128, 128, 0)]
+CLASS_ID_MAP = {"cat": 1, "dog": 2, "bird": 3}
+
+
+def reference_seg_map(labels, masks, shape):
+    # the RGB renderer the palettized one replaced: each mask paints a 20px void border, then its class
+    seg_map = np.zeros(shape, dtype=np.uint8)
+    for label, mask in zip(labels, masks):
+        class_id = CLASS_ID_MAP.get(label.strip(), -1)
+        if 0 < class_id < len(COLORMAP):
+            dilated = cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8), iterations=20)
+            seg_map[dilated.astype(bool)] = exporters.VOID_INDEX
+            seg_map[mask] = class_id
+    return seg_map
+
+
+def masks_for(shape):
+    rng = np.random.default_rng(1)
+    masks = []
+    for _ in range(5):
+        mask = np.zeros(shape, dtype=bool)
+        y0, x0 = rng.integers(0, shape[0] - 10), rng.integers(0, shape[1] - 10)
+        mask[y0:y0 + rng.integers(5, 60), x0:x0 + rng.integers(5, 60)] = True
+        masks.append(mask)
+    return masks
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_segmentation_png_matches_the_rgb_renderer(tmp_path, compact):
+    shape = (120, 160)
+    labels = ["cat", "dog ", "unknown", "bird", "cat"]
+    masks = masks_for(shape)
+    result = {
+        "image_path": "images/frame_001.jpg",
+        "image_shape": shape,
+        "labels": labels,
+        "boxes": [[0, 0, 1, 1]] * len(labels),
+        "masks": [CompactMask.from_dense(mask) for mask in masks] if compact else masks,
+    }
+    exporter = exporters.PascalVOCExporter(input_dir=str(tmp_path))
+
+    exporter.save(result, CLASS_ID_MAP, COLORMAP, task="segmentation")
+    exporter.close()
+
+    with Image.open(tmp_path / "SegmentationClass" / "frame_001.png") as png:
+        assert png.mode == "P"
+        indices = np.asarray(png)
+        rgb = np.asarray(png.convert("RGB"))
+    expected = reference_seg_map(labels, masks, shape)
+    assert np.array_equal(indices, expected)
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:len(COLORMAP)] = COLORMAP
+    palette[exporters.VOID_INDEX] = exporters.VOID_COLOR
+    assert np.array_equal(rgb, palette[expected])
+    assert (tmp_path / "ImageSets" / "Segmentation" / "default.txt").read_text() == "frame_001\n"
+
+
+def test_segmentation_png_without_known_labels_is_background(tmp_path):
+    exporter = exporters.PascalVOCExporter(input_dir=str(tmp_path))
+    result = {"image_path": "a.jpg", "image_shape": (8, 8), "labels": ["unknown"], "boxes": [[0, 0, 4, 4]],
+              "masks": [np.ones((8, 8), dtype=bool)]}
+
+    exporter.save(result, CLASS_ID_MAP, COLORMAP, task="segmentation")
+
+    with Image.open(tmp_path / "SegmentationClass" / "a.png") as png:
+        assert not np.asarray(png).any()
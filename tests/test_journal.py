@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from src.journal import Journal
+
+SETTINGS = {"classes": ["car"], "box_threshold": 0.35}
+
+
+def write_journal(path, count):
+    journal = Journal(path, settings=SETTINGS)
+    for i in range(count):
+        journal.append(f"/data/img_{i}.jpg", {"records": [i]})
+    journal.close()
+
+
+def test_resume_drops_a_torn_last_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, 3)
+    intact = path.read_bytes()
+    with open(path, "ab") as f:
+        f.write(b'{"image_path": "/data/img_3.jpg", "rec')
+
+    journal = Journal(path, resume=True, settings=SETTINGS)
+
+    assert len(journal) == 3
+    assert "/data/img_2.jpg" in journal and "/data/img_3.jpg" not in journal
+    assert path.read_bytes() == intact
+    journal.append("/data/img_3.jpg", {"records": [3]})
+    assert [entry["records"] for entry in journal.replay()] == [[0], [1], [2], [3]]
+    journal.close()
+
+
+def test_resume_refuses_other_settings(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, 2)
+
+    with pytest.raises(ValueError, match="different settings"):
+        Journal(path, resume=True, settings={**SETTINGS, "box_threshold": 0.5})
+    assert len(path.read_text().splitlines()) == 3
+
+
+def test_without_resume_starts_over_and_remove_deletes_it(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, 2)
+
+    journal = Journal(path, settings=SETTINGS)
+
+    assert len(journal) == 0
+    assert list(journal.replay()) == []
+    assert json.loads(path.read_text().splitlines()[0]) == {"settings": journal.settings_hash}
+    journal.close()
+    journal.remove()
+    assert not path.exists()
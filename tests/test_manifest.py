@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from src import manifest as manifest_module
+from src.manifest import MANIFEST_NAME, DatasetManifest
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "SegmentationClass").mkdir()
+    for i in range(3):
+        Image.new("RGB", (16 + i, 12), (50 * i, 0, 0)).save(tmp_path / "images" / f"img_{i}.png")
+    Image.new("P", (16, 12)).save(tmp_path / "SegmentationClass" / "img_0.png")
+    return tmp_path
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    probed = []
+    probe = manifest_module._probe
+
+    def counting_probe(path):
+        probed.append(os.path.basename(path))
+        return probe(path)
+
+    monkeypatch.setattr(manifest_module, "_probe", counting_probe)
+    return probed
+
+
+def test_rerun_reuses_entries_and_reprobes_only_changed_files(dataset, probes):
+    first = DatasetManifest(dataset, workers=2).update()
+    assert sorted(probes) == ["img_0.png", "img_1.png", "img_2.png"]
+    assert (dataset / MANIFEST_NAME).exists()
+    assert [path.name for path in first.images("images")] == ["img_0.png", "img_1.png", "img_2.png"]
+
+    probes.clear()
+    DatasetManifest(dataset, workers=2).update()
+    assert probes == []
+
+    changed = dataset / "images" / "img_1.png"
+    Image.new("RGB", (40, 30), (0, 0, 255)).save(changed)
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    (dataset / "images" / "img_2.png").unlink()
+
+    rerun = DatasetManifest(dataset, workers=2).update()
+
+    assert probes == ["img_1.png"]
+    assert [path.name for path in rerun.images("images")] == ["img_0.png", "img_1.png"]
+    entry = rerun.entry(changed)
+    assert (entry["width"], entry["height"]) == (40, 30)
+    assert rerun.digest(changed) == hashlib.sha256(changed.read_bytes()).hexdigest()
+    assert rerun.digest(dataset / "images" / "img_0.png") == first.digest(dataset / "images" / "img_0.png")
+
+
+def test_rebuild_ignores_the_saved_index(dataset, probes):
+    DatasetManifest(dataset).update()
+    probes.clear()
+
+    DatasetManifest(dataset, rebuild=True).update()
+
+    assert sorted(probes) == ["img_0.png", "img_1.png", "img_2.png"]
+
+
+def test_find_resolves_names_and_skips_label_maps(dataset):
+    manifest = DatasetManifest(dataset).update()
+
+    assert manifest.find("img_0.png", subdirs=("images",)) == dataset / "images" / "img_0.png"
+    assert manifest.find("other/dir/img_2.png") == dataset / "images" / "img_2.png"
+    assert manifest.find("missing.png") is None
+    assert manifest.entry(dataset / "SegmentationClass" / "img_0.png") is None
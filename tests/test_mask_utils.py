@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+coco_mask = pytest.importorskip("pycocotools.mask")
+
+from src import mask_utils
+from src.mask_utils import CompactMask
+
+
+def random_masks():
+    rng = np.random.default_rng(0)
+    yield np.zeros((7, 5), dtype=bool)
+    yield np.ones((6, 9), dtype=bool)
+    single = np.zeros((10, 10), dtype=bool)
+    single[9, 9] = True
+    yield single
+    for _ in range(100):
+        h, w = rng.integers(1, 60, size=2)
+        mask = np.zeros((h, w), dtype=bool)
+        for _ in range(rng.integers(1, 4)):
+            y0, x0 = rng.integers(0, h), rng.integers(0, w)
+            y1, x1 = rng.integers(y0, h + 1), rng.integers(x0, w + 1)
+            mask[y0:y1, x0:x1] = True
+        # speckle, so runs start and end everywhere, not only at rectangle edges
+        mask ^= rng.random((h, w)) < 0.05
+        yield mask
+
+
+@pytest.mark.parametrize("mask", list(random_masks()))
+def test_rle_matches_pycocotools(mask):
+    reference = coco_mask.encode(np.asfortranarray(mask.astype(np.uint8)))
+
+    rle = mask_utils.encode_rle(mask)
+
+    assert rle["size"] == list(reference["size"])
+    assert rle["counts"] == reference["counts"].decode("ascii")
+    assert mask_utils.encode_rle(CompactMask.from_dense(mask)) == rle
+    assert np.array_equal(mask_utils.decode_rle(rle), mask)
+    assert np.array_equal(mask_utils.decode_rle(reference), mask)
+    assert np.array_equal(mask_utils.decode_rle_compact(rle).to_dense(), mask)
+    assert mask_utils.rle_area(rle) == int(coco_mask.area(reference))
+    assert mask_utils.rle_to_bbox(rle) == pytest.approx(coco_mask.toBbox(reference).tolist())
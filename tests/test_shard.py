@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+import pytest
+
+from src.shard import LeaseQueue
+
+ITEMS = [f"img_{i:02d}.jpg" for i in range(9)]
+
+
+def test_two_workers_claim_disjoint_chunks(tmp_path):
+    done = {}
+
+    def work(worker_id):
+        queue = LeaseQueue(tmp_path, worker_id=worker_id, lease_timeout=3, poll_interval=0.05)
+        done[worker_id] = []
+        for chunk_name, items in queue.create(ITEMS, chunk_size=2).claim_all():
+            time.sleep(0.05)  # long enough for the other worker to claim the next chunk meanwhile
+            done[worker_id].append((chunk_name, items))
+
+    threads = [threading.Thread(target=work, args=(worker_id,)) for worker_id in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    names = [name for chunks in done.values() for name, _ in chunks]
+    assert sorted(names) == [f"chunk_{i:05d}" for i in range(5)]
+    assert done["a"] and done["b"]
+    assert sorted(item for chunks in done.values() for _, items in chunks for item in items) == ITEMS
+    assert not list(tmp_path.glob("*.lease"))
+    for worker_id, chunks in done.items():
+        for name, _ in chunks:
+            assert (tmp_path / f"{name}.done").read_text() == worker_id
+
+
+def test_heartbeat_keeps_a_slow_chunk_leased(tmp_path):
+    holder = LeaseQueue(tmp_path, worker_id="a", lease_timeout=0.3).create(ITEMS, chunk_size=100)
+    other = LeaseQueue(tmp_path, worker_id="b", lease_timeout=0.3).create(ITEMS, chunk_size=100)
+
+    chunks = holder.claim_all()
+    next(chunks)
+    time.sleep(1.0)  # over three lease timeouts
+
+    assert other.claim() == (None, True)
+    with pytest.raises(StopIteration):
+        next(chunks)
+    assert (tmp_path / "chunk_00000.done").read_text() == "a"
+    assert other.claim() == (None, False)
+
+
+def test_expired_lease_is_taken_over_and_the_old_owner_leaves_it(tmp_path, capsys):
+    holder = LeaseQueue(tmp_path, worker_id="a", lease_timeout=30).create(ITEMS, chunk_size=100)
+    other = LeaseQueue(tmp_path, worker_id="b", lease_timeout=30).create(ITEMS, chunk_size=100)
+    lease = tmp_path / "chunk_00000.lease"
+
+    assert holder.claim() == (0, True)
+    with holder._hold(0):
+        # the holder stalled past the timeout and the other worker took the chunk over
+        os.utime(lease, (time.time() - 60, time.time() - 60))
+        assert other.claim() == (0, True)
+
+    assert "Lost the lease on chunk_00000" in capsys.readouterr().out
+    assert lease.read_text() == "b"
+    assert not (tmp_path / "chunk_00000.done").exists()